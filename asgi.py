@@ -0,0 +1,213 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import os
+import sys
+import time
+
+from werkzeug.exceptions import HTTPException
+
+import server
+from backend.pubsub import Message
+from sqlite.sqlite_driver import match_topic
+
+# Worker threads that run the Flask views and with them every SQLite call, how many requests may
+# wait for them, and how many live match streams may be open before new ones get a 503
+WORKERS = int(os.environ.get("SPORTSMETER_WORKERS", "8"))
+MAX_PENDING = int(os.environ.get("SPORTSMETER_MAX_PENDING", "256"))
+MAX_STREAMS = int(os.environ.get("SPORTSMETER_MAX_STREAMS", "10000"))
+BUSY_BODY = b'{"msg": "Server busy, try again later."}'
+
+def wsgi_environ(scope : dict, body : bytes):
+    # The PEP 3333 environ of an ASGI HTTP scope
+    host, port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        # The whole body has been read by now, also for chunked requests without a length
+        "CONTENT_LENGTH": str(len(body)),
+        "SERVER_NAME": host,
+        "SERVER_PORT": str(port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False
+    }
+    for name, value in scope.get("headers", []):
+        name, value = name.decode("latin-1").upper().replace("-", "_"), value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        if name == "CONTENT_TYPE":
+            environ[name] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+class SportsMeterASGI:
+    # Serves server.app over ASGI. Views run on a bounded thread pool, response bodies are pulled
+    # from it chunk by chunk, and live match streams wait on the event loop, so idle spectators
+    # hold no thread while scoring writes keep the workers.
+    def __init__(self, wsgi_app, workers : int = WORKERS, max_pending : int = MAX_PENDING,
+                 max_streams : int = MAX_STREAMS) -> None:
+        self.wsgi_app = wsgi_app
+        self.max_pending = max_pending
+        self.max_streams = max_streams
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="asgi")
+        # Only touched on the event loop
+        self.pending = 0
+        self.streams = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                server.db.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.extend(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+
+        endpoint, arguments = self.route(scope)
+        stream = endpoint == "match_stream"
+        if self.streams >= self.max_streams if stream else self.pending >= self.max_pending:
+            await self.respond(send, 503, BUSY_BODY, [(b"content-type", b"application/json"), (b"retry-after", b"1")])
+            return
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(self.watch_disconnect(receive, disconnected))
+        try:
+            if stream:
+                self.streams += 1
+                try:
+                    if await self.match_stream(arguments["match_id"], send, disconnected):
+                        return
+                finally:
+                    self.streams -= 1
+            self.pending += 1
+            try:
+                await self.wsgi(wsgi_environ(scope, bytes(body)), send, disconnected)
+            finally:
+                self.pending -= 1
+        finally:
+            watcher.cancel()
+
+    async def watch_disconnect(self, receive, disconnected : asyncio.Event):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    def route(self, scope : dict):
+        # (endpoint, view arguments) of the Flask route the request goes to
+        try:
+            return self.wsgi_app.url_map.bind("").match(scope["path"], scope["method"])
+        except HTTPException:
+            return None, {}
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def wsgi(self, environ : dict, send, disconnected : asyncio.Event):
+        response = {}
+
+        def start_response(status : str, headers : list, exc_info = None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+            return lambda data: response.setdefault("written", []).append(data)
+
+        def call():
+            # The view runs here, along with the first chunk so query errors of streamed bodies
+            # are still answered by the view's own error handling
+            body = self.wsgi_app(environ, start_response)
+            chunks = iter(body)
+            return body, chunks, next(chunks, None)
+
+        def next_chunk(chunks):
+            # Later chunks and close may run on any worker, bodies must not keep thread bound state
+            # such as a pooled connection between chunks (SqliteDriver.stream_rows reads every page
+            # on a connection of its own)
+            return next(chunks, None)
+
+        body, chunks, chunk = await self.run(call)
+        try:
+            await send({"type": "http.response.start", "status": response["status"], "headers": response["headers"]})
+            for data in response.get("written", []):
+                await send({"type": "http.response.body", "body": data, "more_body": True})
+            while chunk is not None and not disconnected.is_set():
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await self.run(next_chunk, chunks)
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if hasattr(body, "close"):
+                await self.run(body.close)
+
+    async def match_stream(self, match_id, send, disconnected : asyncio.Event):
+        # The live updates of server.match_stream without a thread per spectator. Returns False
+        # when the snapshot can not be read or the match does not exist, the WSGI view then
+        # answers with its error response.
+        started_at = time.perf_counter()
+        subscription = server.db.broker.subscribe(match_topic(match_id), asyncio.get_running_loop())
+        try:
+            snapshot = await self.run(server.db.get_match, match_id)
+        except Exception:
+            snapshot = None
+        if not snapshot:
+            subscription.close()
+            return False
+
+        try:
+            await send({"type": "http.response.start", "status": 200, "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no")]})
+            await self.send_event(send, Message("match", snapshot).encode())
+            server.request_metrics.observe(("match_stream", "GET", 200), time.perf_counter() - started_at)
+            while not disconnected.is_set():
+                waiter = asyncio.ensure_future(subscription.get_async(server.STREAM_KEEPALIVE_SEC))
+                closed = asyncio.ensure_future(disconnected.wait())
+                await asyncio.wait((waiter, closed), return_when=asyncio.FIRST_COMPLETED)
+                closed.cancel()
+                if not waiter.done():
+                    waiter.cancel()
+                    break
+                message = waiter.result()
+                await self.send_event(send, ": keepalive\n\n" if message is None else message.encode())
+                if message is not None and message.event == "reset":
+                    break
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            subscription.close()
+        return True
+
+    async def send_event(self, send, text : str):
+        await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": True})
+
+    async def respond(self, send, status : int, body : bytes, headers : list):
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body, "more_body": False})
+
+# uvicorn asgi:app (or any other ASGI server)
+app = SportsMeterASGI(server.app)
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+import threading
+import time
+
+class ResponseCache:
+    # Read-through LRU cache for query results. Every entry is tagged with the tables it was read
+    # from, and writes invalidate by table. Cached values are shared between callers and must be
+    # treated as read-only.
+    def __init__(self, max_entries : int = 1024, ttl : float = 30.0) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._metrics = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get_or_load(self, key : tuple, tags : tuple, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._metrics["hits"] += 1
+                    return entry[1]
+                self._remove(key)
+                self._metrics["expirations"] += 1
+            self._metrics["misses"] += 1
+            generation = self._generation
+
+        value = loader()
+
+        with self._lock:
+            # A write that landed while the loader ran may not be part of the value
+            if self.max_entries > 0 and generation == self._generation:
+                self._remove(key)
+                self._entries[key] = (now + self.ttl, value, tags)
+                for tag in tags:
+                    self._tags.setdefault(tag, set()).add(key)
+                while len(self._entries) > self.max_entries:
+                    self._remove(next(iter(self._entries)))
+                    self._metrics["evictions"] += 1
+        return value
+
+    def invalidate(self, *tags : str):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self._metrics["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def _remove(self, key : tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["entries"] = len(self._entries)
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+        return metrics
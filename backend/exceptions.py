@@ -9,3 +9,6 @@ class InvalidQueryError(Exception):
 
 class NoResultError(Exception):
     pass
+
+class ServerBusyError(Exception):
+    pass
@@ -0,0 +1,98 @@
+from bisect import bisect_left
+import logging
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+# Label values past this many series are folded into one, so unexpected labels cannot grow memory
+MAX_SERIES = 1000
+OTHER = "other"
+
+slow_query_log = logging.getLogger("sportsmeter.slow_queries")
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def label_text(names : tuple, values : tuple, extra : str = ""):
+    labels = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+class LatencyMetrics:
+    # Latency histograms (and optional row counters) per label values, in Prometheus' cumulative
+    # bucket layout. Observations only take a lock and bump a few integers.
+    def __init__(self, name : str, label_names : tuple, buckets : tuple = REQUEST_BUCKETS,
+                 max_series : int = MAX_SERIES) -> None:
+        self.name = name
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.max_series = max_series
+        # label values -> [bucket counts (last one is +Inf), sum of seconds, rows]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels : tuple, seconds : float, rows : int = 0):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                if len(self._series) >= self.max_series:
+                    labels = (OTHER,) * len(self.label_names)
+                series = self._series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += rows
+
+    def metrics(self):
+        # label values -> {"count", "seconds", "rows"}
+        with self._lock:
+            return {labels: {"count": sum(series[0]), "seconds": series[1], "rows": series[2]}
+                    for labels, series in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self, rows_name : str = None):
+        with self._lock:
+            series = [(labels, list(counts), seconds, rows) for labels, (counts, seconds, rows) in self._series.items()]
+        lines = [f"# TYPE {self.name} histogram"]
+        for labels, counts, seconds, _ in sorted(series):
+            total = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                total += count
+                bucket = 'le="' + str(bound) + '"'
+                lines.append(f"{self.name}_bucket{label_text(self.label_names, labels, bucket)} {total}")
+            lines.append(f"{self.name}_sum{label_text(self.label_names, labels)} {seconds}")
+            lines.append(f"{self.name}_count{label_text(self.label_names, labels)} {total}")
+        if rows_name is not None:
+            lines.append(f"# TYPE {rows_name} counter")
+            lines.extend(f"{rows_name}{label_text(self.label_names, labels)} {rows}" for labels, _, _, rows in sorted(series))
+        return lines
+
+class QueryMetrics(LatencyMetrics):
+    # Execution time and rows of every statement run on the pool's connections, labelled by
+    # statement name. Statements slower than slow_query_seconds are also logged with their SQL.
+    def __init__(self, label, slow_query_seconds : float = None, max_series : int = MAX_SERIES) -> None:
+        super().__init__("sportsmeter_query_duration_seconds", ("statement",), QUERY_BUCKETS, max_series)
+        self.label = label
+        self.slow_query_seconds = slow_query_seconds
+
+    def observe_query(self, query : str, seconds : float, rows : int):
+        self.observe((self.label(query),), seconds, max(rows, 0))
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            slow_query_log.warning("Slow query: %.1f ms, %d rows: %s", seconds * 1000, rows, " ".join(query.split()))
+
+    def render(self):
+        return super().render("sportsmeter_query_rows_total")
+
+def render_gauges(prefix : str, metrics : dict):
+    # Snapshot values of a component's metrics() as gauges, e.g. sportsmeter_pool_checkouts
+    lines = []
+    for key, value in metrics.items():
+        if isinstance(value, (int, float)):
+            lines.append(f"# TYPE {prefix}_{key} gauge")
+            lines.append(f"{prefix}_{key} {int(value) if isinstance(value, bool) else value}")
+    return lines
@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import hashlib
+import hmac
+import os
+import threading
+
+from backend.exceptions import ServerBusyError
+
+SCHEME = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+def encode(data : bytes):
+    return base64.b64encode(data).decode("ascii")
+
+def hash_password(password : str, cost : int = 14, block_size : int = 8, parallelism : int = 1):
+    # Stored as scrypt$<log2 n>$<r>$<p>$<salt>$<key>, so every hash carries the cost it was made with
+    salt = os.urandom(SALT_BYTES)
+    key = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=2 ** cost, r=block_size, p=parallelism,
+                         maxmem=256 * 1024 * 1024, dklen=KEY_BYTES)
+    return f"{SCHEME}${cost}${block_size}${parallelism}${encode(salt)}${encode(key)}"
+
+def verify_password(password : str, stored : str):
+    # Returns (matches, cost) where cost is None for a plaintext password from before hashing
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != SCHEME:
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8")), None
+    try:
+        cost, block_size, parallelism = int(parts[1]), int(parts[2]), int(parts[3])
+        if min(cost, block_size, parallelism) < 1:
+            return False, None
+        key = hashlib.scrypt(password.encode("utf-8"), salt=base64.b64decode(parts[4]), n=2 ** cost, r=block_size,
+                             p=parallelism, maxmem=256 * 1024 * 1024, dklen=KEY_BYTES)
+        return hmac.compare_digest(key, base64.b64decode(parts[5])), cost
+    except (ValueError, OverflowError, TypeError):
+        # A damaged hash matches no password
+        return False, None
+
+class PasswordHasher:
+    # Runs hashing on a few worker threads. Request threads wait for their result, but at most
+    # `workers` hashes use the CPU at once and at most `max_pending` wait, so a burst of logins
+    # is turned away instead of starving every other request.
+    def __init__(self, cost : int = 14, workers : int = 2, max_pending : int = 64, wait_timeout : float = 5.0) -> None:
+        self.cost = cost
+        self.wait_timeout = wait_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        # Verified when a login does not exist, so unknown logins take as long as wrong passwords
+        self._dummy_hash = None
+
+    def hash(self, password : str):
+        return self._run(hash_password, password, self.cost)
+
+    def verify(self, password : str, stored : str = None):
+        # Returns (matches, needs_rehash)
+        if stored is None and self._dummy_hash is None:
+            self._dummy_hash = self.hash("")
+        matches, cost = self._run(verify_password, password, self._dummy_hash if stored is None else stored)
+        return matches and stored is not None, cost != self.cost
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise ServerBusyError("Too many logins in progress, try again later.")
+        try:
+            return self._executor.submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
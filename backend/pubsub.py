@@ -0,0 +1,134 @@
+from queue import Empty, Full, Queue
+import asyncio
+import json
+import threading
+
+class Message:
+    __slots__ = ("event", "data", "_encoded")
+
+    def __init__(self, event : str, data) -> None:
+        self.event = event
+        self.data = data
+        self._encoded = None
+
+    def encode(self):
+        # Serialized once per publish and shared by every subscriber that sends it
+        if self._encoded is None:
+            self._encoded = f"event: {self.event}\ndata: {json.dumps(self.data)}\n\n"
+        return self._encoded
+
+# Put on a subscriber's queue in place of the messages it could not keep up with
+OVERFLOW = Message("reset", {"msg": "Subscriber fell behind, reload the current state."})
+
+class Subscription:
+    def __init__(self, broker, topic : str, max_queue : int) -> None:
+        self.broker = broker
+        self.topic = topic
+        self.closed = False
+        self._queue = Queue(max_queue + 1)
+        self._max_queue = max_queue
+
+    def put(self, message : Message):
+        # Never blocks the publisher. A subscriber whose buffer is full gets OVERFLOW and is
+        # dropped, the client reconnects and starts again from a fresh snapshot.
+        if self.closed:
+            return False
+        try:
+            if self._queue.qsize() < self._max_queue:
+                self._queue.put_nowait(message)
+                return True
+            self._queue.put_nowait(OVERFLOW)
+        except Full:
+            pass
+        self.broker.unsubscribe(self, overflowed=True)
+        return False
+
+    def get(self, timeout : float = None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+class AsyncSubscription(Subscription):
+    # Waits on the event loop instead of in a blocked thread, so an idle spectator costs a
+    # coroutine. Publishers on any thread wake it through the loop.
+    def __init__(self, broker, topic : str, max_queue : int, loop : asyncio.AbstractEventLoop) -> None:
+        super().__init__(broker, topic, max_queue)
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def put(self, message : Message):
+        delivered = super().put(message)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # The loop is closed, nobody is waiting any more
+            pass
+        return delivered
+
+    async def get_async(self, timeout : float = None):
+        while True:
+            try:
+                return self._queue.get_nowait()
+            except Empty:
+                pass
+            if self._ready.is_set():
+                self._ready.clear()
+                continue
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+class Broker:
+    def __init__(self, max_queue : int = 256) -> None:
+        self.max_queue = max_queue
+        self._topics = {}
+        self._lock = threading.Lock()
+        self._metrics = {"published": 0, "delivered": 0, "overflows": 0}
+
+    def subscribe(self, topic : str, loop : asyncio.AbstractEventLoop = None):
+        if loop is None:
+            subscription = Subscription(self, topic, self.max_queue)
+        else:
+            subscription = AsyncSubscription(self, topic, self.max_queue, loop)
+        with self._lock:
+            self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription : Subscription, overflowed : bool = False):
+        with self._lock:
+            if subscription.closed:
+                return
+            subscription.closed = True
+            subscribers = self._topics.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[subscription.topic]
+            if overflowed:
+                self._metrics["overflows"] += 1
+
+    def has_subscribers(self, topic : str):
+        with self._lock:
+            return topic in self._topics
+
+    def publish(self, topic : str, event : str, data):
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+            self._metrics["published"] += 1
+        message = Message(event, data)
+        delivered = sum(1 for subscription in subscribers if subscription.put(message))
+        with self._lock:
+            self._metrics["delivered"] += delivered
+        return delivered
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["topics"] = len(self._topics)
+            metrics["subscribers"] = sum(len(subscribers) for subscribers in self._topics.values())
+        return metrics
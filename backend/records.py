@@ -0,0 +1,68 @@
+class Record:
+    # Fixed-shape, read-only result row. Wraps the tuple sqlite3 already returned and reads like
+    # the dict it replaces (record["field"], record.field, keys(), get(), equality with dicts),
+    # without building a per-row hash table of repeated key strings.
+    __slots__ = ("_row",)
+    _fields = ()
+    _index = {}
+
+    def __init__(self, row : tuple) -> None:
+        self._row = tuple(row)
+
+    def __getitem__(self, key : str):
+        return self._row[self._index[key]]
+
+    def get(self, key : str, default = None):
+        index = self._index.get(key)
+        return default if index is None else self._row[index]
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return self._row
+
+    def items(self):
+        return zip(self._fields, self._row)
+
+    def __contains__(self, key : str):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def to_dict(self):
+        return dict(zip(self._fields, self._row))
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self._fields == other._fields and self._row == other._row
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{key}={value!r}' for key, value in self.items())})"
+
+def record_type(name : str, fields):
+    fields = tuple(fields)
+    if not fields or not all(field.isidentifier() and not field.startswith("_") for field in fields):
+        raise ValueError(f"Invalid record fields: {fields}")
+    namespace = {}
+    # A dict display is the cheapest way to build the JSON object of a row, so to_dict is generated
+    # per shape the same way collections.namedtuple generates its constructor.
+    exec("def to_dict(self):\n    row = self._row\n    return {" +
+         ", ".join(f"{field!r}: row[{index}]" for index, field in enumerate(fields)) + "}\n", namespace)
+    attributes = {field: property(lambda self, index=index: self._row[index]) for index, field in enumerate(fields)}
+    return type(name, (Record,), {
+        "__slots__": (),
+        "_fields": fields,
+        "_index": {field: index for index, field in enumerate(fields)},
+        "to_dict": namespace["to_dict"],
+        **attributes
+    })
@@ -0,0 +1,55 @@
+from itertools import chain
+import json
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+from backend.records import Record
+
+class RecordJSONProvider(DefaultJSONProvider):
+    # Result rows keep their column order, so there is nothing to gain from sorting keys
+    sort_keys = False
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+    def response(self, *args, **kwargs):
+        # ?format=compact sends a list of records as field names plus one array per row, encoded
+        # straight from the row tuples without building a dict per row
+        obj = args[0] if len(args) == 1 and not kwargs else None
+        if isinstance(obj, list) and request.args.get("format") == "compact" and \
+                all(isinstance(record, Record) for record in obj):
+            return super().response(compact(obj))
+        return super().response(*args, **kwargs)
+
+def compact(records : list):
+    return {"fields": list(records[0].keys()) if records else [], "rows": [record.values() for record in records]}
+
+def stream_json(batches, format : str = None):
+    # Encodes batches of records as they arrive: one JSON array (default), one object per line
+    # ("ndjson") or the compact fields/rows shape ("compact"). Every batch is encoded by a single
+    # call into the C encoder.
+    encode = json.JSONEncoder(ensure_ascii=True, check_circular=False).encode
+    batches = iter(batches)
+    first = next(batches, [])
+    if format == "ndjson":
+        for batch in chain([first], batches):
+            if batch:
+                yield "\n".join(map(encode, (record.to_dict() for record in batch))) + "\n"
+        return
+
+    if format == "compact":
+        yield '{"fields": ' + encode(list(first[0].keys()) if first else []) + ', "rows": ['
+        rows = lambda batch: [record.values() for record in batch]
+    else:
+        yield "["
+        rows = lambda batch: [record.to_dict() for record in batch]
+    separator = ""
+    for batch in chain([first], batches):
+        if batch:
+            yield separator + encode(rows(batch))[1:-1]
+            separator = ", "
+    yield "]}" if format == "compact" else "]"
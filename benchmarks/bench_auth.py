@@ -0,0 +1,35 @@
+"""Measures the login lookup behind every token check: a full scan of Users as before the
+unique index, the indexed query, and the login cache.
+
+Run from the repository root: python -m benchmarks.bench_auth [users]
+"""
+import sys
+
+from benchmarks.common import measure, report, temporary_database
+from sqlite.sqlite_driver import SqliteContext
+
+def add_users(db, users : int):
+    with SqliteContext(db.pool) as [conn, cur]:
+        cur.executemany("INSERT INTO Users (user_login, user_password) VALUES (?, ?)",
+                        [(f"user{number}", "secret") for number in range(users)])
+        conn.commit()
+
+def drop_login_index(db):
+    with SqliteContext(db.pool) as [conn, cur]:
+        cur.execute("DROP INDEX idx_users_login")
+        conn.commit()
+
+def main(users : int = 100_000):
+    login = f"user{users // 2}"
+    for name, options, scan in (("full scan", {"login_cache_size": 0}, True),
+                                ("index", {"login_cache_size": 0}, False),
+                                ("login cache", {}, False)):
+        with temporary_database(**options) as db:
+            add_users(db, users)
+            if scan:
+                drop_login_index(db)
+            repeat = 100 if scan else 5000
+            report(f"login_exists {name}, {users} users", measure(lambda: db.login_exists(login), repeat))
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,120 @@
+"""Micro-benchmarks of the SqliteDriver reads and writes on a generated tournament.
+
+Every method runs against the same dataset. Results can be saved and later runs compared against
+them; a run exits with status 1 when any p50 regressed by more than the tolerance.
+
+Run from the repository root:
+    python -m benchmarks.bench_driver [--scale-seasons 1] [--scale-events 1] [--repeat 200] [--cache]
+                                      [--only get_match] [--save before.json] [--compare before.json]
+"""
+import argparse
+from itertools import count
+import sys
+
+from benchmarks.common import compare_results, measure, populate, report, save_results, scaled, temporary_database
+
+def substitution_pair(db, match_id):
+    # An active player and a benched teammate of the same gender, swapping them keeps the gender
+    # counts, so the checks and the substitution run to completion
+    roster = db.get_match_roster(match_id)
+    for active in roster:
+        for benched in roster:
+            if active["player_active"] and not benched["player_active"] and \
+                    (active["player_gender"], active["player_team"]) == (benched["player_gender"], benched["player_team"]):
+                return [active["match_player"], benched["match_player"]]
+    raise SystemExit(f"Match {match_id} has no bench to substitute from, raise --scale-players")
+
+def reads(db, sizes):
+    last_match = sizes["matches"] - 1
+    last_season = sizes["seasons"] - 1
+    player = sizes["players"] // 2
+    old_player, new_player = substitution_pair(db, last_match)
+    return {
+        "get_seasons": lambda: db.get_seasons(),
+        "get_season_highscore": lambda: db.get_season_highscore(last_season),
+        "get_season_leaders": lambda: db.get_season_leaders(last_season),
+        "get_season_matches": lambda: db.get_season_matches(last_season),
+        "get_teams": lambda: db.get_teams(),
+        "get_matches page": lambda: db.get_matches({"limit": 50, "after": last_match // 2}),
+        "get_match": lambda: db.get_match(last_match),
+        "get_match_snapshot": lambda: db.get_match_snapshot(last_match),
+        "get_players": lambda: db.get_players(),
+        "get_players ids": lambda: db.get_players({"ids": "1,5,9,13,17"}),
+        "get_player": lambda: db.get_player(player),
+        "get_player_stats": lambda: db.get_player_stats(player),
+        "get_substitutions page": lambda: db.get_substitutions({"limit": 50}),
+        "get_match_substitutions": lambda: db.get_match_substitutions(last_match),
+        "get_match_players": lambda: db.get_match_players(last_match),
+        "get_match_roster": lambda: db.get_match_roster(last_match),
+        "get_events page": lambda: db.get_events({"limit": 100, "after": sizes["events"] // 2}),
+        "get_event": lambda: db.get_event(sizes["events"] // 2),
+        "get_match_events": lambda: db.get_match_events(last_match),
+        "get_notifications": lambda: db.get_notifications(),
+        "login_exists": lambda: db.login_exists("nobody"),
+        "check_gender_ratio": lambda: db.check_gender_ratio(last_match, new_player, old_player)
+    }
+
+def writes(db, sizes):
+    last_match = sizes["matches"] - 1
+    keys = count()
+    added = []
+    points = count()
+
+    def add_event():
+        added.append(db.add_event({"match_id": last_match, "event_player_1": 0, "event_player_2": 1,
+                                   "event_type": "goal", "event_value": 1})["event_id"])
+
+    def delete_event():
+        if added:
+            db.delete_event(added.pop())
+
+    # Swapped back and forth, every call is a legal substitution
+    pair = substitution_pair(db, last_match)
+
+    def substitute_player():
+        db.substitute_player(last_match, *pair)
+        pair.reverse()
+
+    return {
+        "add_event": add_event,
+        "add_events batch of 20": lambda: db.add_events([
+            {"idempotency_key": f"bench:{next(keys)}", "match_id": last_match, "event_player_1": 0,
+             "event_type": "shots", "event_value": 1} for _ in range(20)]),
+        "edit_event": lambda: db.edit_event(1, {"event_value": next(points) % 5}),
+        "delete_event": delete_event,
+        "edit_match points": lambda: db.edit_match(last_match, {"team_a_points": next(points) % 150}),
+        "add_notification": lambda: db.add_notification({"notification_title": "Bench",
+                                                         "notification_description": "Notification"}),
+        "substitute_player": substitute_player
+    }
+
+def main(argv : list = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for dimension in ("seasons", "teams", "players", "events"):
+        parser.add_argument(f"--scale-{dimension}", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--cache", action="store_true", help="keep the response cache on")
+    parser.add_argument("--only", action="append", help="run only benchmarks starting with this name")
+    parser.add_argument("--save")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    options = {} if args.cache else {"cache_size": 0}
+    results = {}
+    with temporary_database(**options) as db:
+        sizes = populate(db, **scaled(args.scale_seasons, args.scale_teams, args.scale_players, args.scale_events))
+        print(f"dataset: {sizes}")
+        for name, func in {**reads(db, sizes), **writes(db, sizes)}.items():
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            results[name] = report(name, measure(func, args.repeat, warmup=min(10, args.repeat)))
+
+    if args.save:
+        save_results(args.save, results)
+    if args.compare and compare_results(args.compare, results, args.tolerance):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
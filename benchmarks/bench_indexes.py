@@ -0,0 +1,57 @@
+"""Shows foreign key lookups staying flat as archived history grows.
+
+History grows by adding seasons, so every lookup returns the same number of rows at every size;
+only the size of the tables around it changes. Each size is measured with the migration indexes
+and again after dropping them, with the response cache disabled.
+
+Run from the repository root: python -m benchmarks.bench_indexes [max_events]
+"""
+import sys
+
+from backend.exceptions import InvalidInputError
+from benchmarks.common import measure, populate, report, temporary_database
+from sqlite.sqlite_driver import SqliteContext
+
+MATCHES_PER_SEASON = 100
+EVENTS_PER_MATCH = 50
+INDEXES = ["idx_matches_season", "idx_events_match", "idx_match_players_match_active", "idx_substitutions_match"]
+
+def lookups(db, sizes):
+    last_match = sizes["matches"] - 1
+    last_season = sizes["seasons"] - 1
+    return {
+        "get_match_events": lambda: db.get_match_events(last_match),
+        "get_season_matches": lambda: db.get_season_matches(last_season),
+        "get_match_players": lambda: db.get_match_players(last_match),
+        "get_match_substitutions": lambda: db.get_match_substitutions(last_match),
+        "check_gender_ratio": lambda: check_gender_ratio(db, last_match, 0)
+    }
+
+def check_gender_ratio(db, match_id, player_id):
+    # Generated lineups already field the most players of every gender, so adding one more breaks
+    # the rule, the lookup is measured either way
+    try:
+        db.check_gender_ratio(match_id, player_id)
+    except InvalidInputError:
+        pass
+
+def main(max_events : int = 1_000_000):
+    seasons = 2
+    while seasons * MATCHES_PER_SEASON * EVENTS_PER_MATCH <= max_events:
+        with temporary_database(cache_size=0) as db:
+            sizes = populate(db, seasons=seasons, matches_per_season=MATCHES_PER_SEASON,
+                             events_per_match=EVENTS_PER_MATCH)
+            print(f"\n{sizes['events']} events, {sizes['matches']} matches, {sizes['match_players']} roster rows")
+            repeat = 200
+            for name, lookup in lookups(db, sizes).items():
+                report(f"{name} indexed", measure(lookup, repeat))
+
+            with SqliteContext(db.pool) as [conn, cur]:
+                for index in INDEXES:
+                    cur.execute(f"DROP INDEX {index}")
+            for name, lookup in lookups(db, sizes).items():
+                report(f"{name} full scan", measure(lookup, repeat // 10, warmup=1))
+        seasons *= 10
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,31 @@
+"""Measures login throughput at different password hashing costs, with concurrent clients.
+
+Run from the repository root: python -m benchmarks.bench_login [clients] [logins_per_client]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import time
+
+from benchmarks.common import temporary_database
+
+COSTS = (12, 13, 14, 15)
+
+def main(clients : int = 8, logins : int = 10):
+    for cost in COSTS:
+        with temporary_database(password_cost=cost) as db:
+            for number in range(clients):
+                db.add_user(f"user{number}", "secret")
+
+            def client(number : int):
+                for _ in range(logins):
+                    assert db.user_exists(f"user{number}", "secret")
+
+            started_at = time.perf_counter()
+            with ThreadPoolExecutor(clients) as executor:
+                list(executor.map(client, range(clients)))
+            elapsed = time.perf_counter() - started_at
+            print(f"scrypt n=2^{cost:<3} {clients} clients  {clients * logins / elapsed:8.1f} logins/s  "
+                  f"{elapsed / logins * 1000:8.1f}ms per login round")
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,75 @@
+"""Compares per-row dicts with records for the list reads: build time, retained memory and JSON.
+
+"dict comprehension" is the previous driver code serialized with Flask's default provider,
+"records" is the current one and "records compact" the ?format=compact response body.
+
+Run from the repository root: python -m benchmarks.bench_rows [events]
+"""
+import sys
+import time
+import tracemalloc
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from backend.serialization import compact, RecordJSONProvider
+from benchmarks.common import populate, temporary_database
+from sqlite.sqlite_driver import EventRecord, SqliteContext
+from sqlite.statements import STATEMENTS
+
+def as_dicts(rows):
+    return [
+        {
+            "event_id": row[0],
+            "match_id": row[1],
+            "event_player_1": row[2],
+            "event_player_2": row[3],
+            "event_type": row[4],
+            "event_value": row[5]
+        } for row in rows
+    ]
+
+def as_records(rows):
+    return [EventRecord(row) for row in rows]
+
+def timed(func, *args, repeat : int = 5):
+    # Best of a few runs, single runs of this size are dominated by allocator and GC noise
+    best = None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - started_at
+        best = seconds if best is None else min(best, seconds)
+    return result, best
+
+def retained_bytes_per_row(db, build):
+    # Everything still referenced once the read returns: the row objects and whatever they keep alive
+    with SqliteContext(db.pool) as [conn, cur]:
+        tracemalloc.start()
+        result = build(cur.execute(STATEMENTS["get_events"]).fetchall())
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return size / len(result)
+
+def main(events : int = 200_000):
+    matches = max(1, events // 100)
+    app = Flask(__name__)
+    previous_json, record_json = DefaultJSONProvider(app), RecordJSONProvider(app)
+    with temporary_database(cache_size=0) as db:
+        populate(db, seasons=1, matches_per_season=matches, events_per_match=events // matches)
+        with SqliteContext(db.pool) as [conn, cur]:
+            rows = cur.execute(STATEMENTS["get_events"]).fetchall()
+
+        print(f"{len(rows)} event rows")
+        for name, build, dumps in (("dict comprehension", as_dicts, previous_json.dumps),
+                                   ("records", as_records, record_json.dumps),
+                                   ("records compact", as_records, lambda records: record_json.dumps(compact(records)))):
+            result, build_seconds = timed(build, rows)
+            body, dump_seconds = timed(dumps, result)
+            print(f"{name:<20} build {build_seconds / len(rows) * 1e9:7.0f}ns/row  "
+                  f"json {dump_seconds / len(rows) * 1e9:7.0f}ns/row  "
+                  f"total {len(rows) / (build_seconds + dump_seconds):10,.0f} rows/s  "
+                  f"retained {retained_bytes_per_row(db, build):5.0f}B/row  body {len(body) / 1e6:.1f}MB")
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
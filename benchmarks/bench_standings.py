@@ -0,0 +1,33 @@
+"""Compares the trigger-maintained season standings with rescanning every match of the season.
+
+Run from the repository root: python -m benchmarks.bench_standings [max_matches_per_season]
+"""
+import sys
+
+from benchmarks.common import measure, populate, report, temporary_database
+from sqlite.sqlite_driver import SqliteContext
+
+RESCAN = ("SELECT team_id, team_name, SUM(team_points) AS team_score FROM ("
+          "SELECT t.team_id, t.team_name, m.team_a_points AS team_points FROM Matches m, Teams t "
+          "WHERE m.match_season = ? AND t.team_id = m.team_a_id "
+          "UNION ALL "
+          "SELECT t.team_id, t.team_name, m.team_b_points AS team_points FROM Matches m, Teams t "
+          "WHERE m.match_season = ? AND t.team_id = m.team_b_id) "
+          "GROUP BY team_id ORDER BY team_score DESC")
+
+def rescan(db, season_id):
+    with SqliteContext(db.pool) as [conn, cur]:
+        return cur.execute(RESCAN, (season_id, season_id)).fetchall()
+
+def main(max_matches : int = 100_000):
+    matches = 100
+    while matches <= max_matches:
+        with temporary_database() as db:
+            populate(db, seasons=1, matches_per_season=matches, events_per_match=0)
+            print(f"\n{matches} matches in the season")
+            report("get_season_highscore standings", measure(lambda: db.get_season_highscore(0), 200))
+            report("get_season_highscore rescan", measure(lambda: rescan(db, 0), 20, warmup=1))
+        matches *= 10
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
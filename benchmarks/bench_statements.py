@@ -0,0 +1,40 @@
+"""Compares interpolated SQL text with the registry's bound statements on hot read paths.
+
+Run from the repository root: python -m benchmarks.bench_statements
+"""
+from itertools import count
+
+from benchmarks.common import measure, populate, report, temporary_database
+from sqlite.sqlite_driver import SqliteContext
+from sqlite.statements import STATEMENTS
+
+INTERPOLATED = {
+    "get_match": ("SELECT m.match_id, m.match_date, m.match_start_time, m.match_end_time, m.team_a_id, "
+                  "t1.team_name, m.team_b_id, t2.team_name, m.team_a_points, m.team_b_points "
+                  "FROM Matches m, Teams t1, Teams t2 "
+                  "WHERE m.match_id = {} AND m.team_a_id = t1.team_id AND m.team_b_id = t2.team_id"),
+    "get_match_events": ("SELECT event_id, match_id, event_player_1, event_player_2, event_type, event_value "
+                         "FROM Events WHERE match_id = {}")
+}
+
+def main(repeat : int = 5000):
+    with temporary_database() as db:
+        # More distinct ids than statement cache slots, as on a live server
+        sizes = populate(db, matches_per_season=1000, events_per_match=5)
+        print(f"dataset: {sizes}")
+        match_ids = count()
+
+        with SqliteContext(db.pool) as [conn, cur]:
+            for name, template in INTERPOLATED.items():
+                # Every distinct id produces new SQL text, so each call is parsed and planned again
+                report(f"{name} interpolated", measure(
+                    lambda: cur.execute(template.format(next(match_ids) % sizes["matches"])).fetchall(), repeat))
+                report(f"{name} bound", measure(
+                    lambda: cur.execute(STATEMENTS[name], (next(match_ids) % sizes["matches"],)).fetchall(), repeat))
+
+        report("SqliteDriver.get_match", measure(lambda: db.get_match(next(match_ids) % sizes["matches"]), repeat))
+        report("SqliteDriver.get_match_events",
+               measure(lambda: db.get_match_events(next(match_ids) % sizes["matches"]), repeat))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""Compares season leaders read from Player_Season_Stats with grouping every event of the season.
+
+Run from the repository root: python -m benchmarks.bench_stats [max_matches_per_season]
+"""
+import sys
+
+from benchmarks.common import measure, populate, report, temporary_database
+from sqlite.sqlite_driver import SqliteContext
+
+RESCAN = ("SELECT e.event_player_1, COUNT(*) AS event_count, SUM(COALESCE(e.event_value, 0)) AS value_total "
+          "FROM Matches m, Events e WHERE m.match_season = ? AND e.match_id = m.match_id AND e.event_type = ? "
+          "GROUP BY e.event_player_1 ORDER BY value_total DESC, event_count DESC LIMIT 10")
+
+def rescan(db, season_id):
+    with SqliteContext(db.pool) as [conn, cur]:
+        return cur.execute(RESCAN, (season_id, "goal")).fetchall()
+
+def main(max_matches : int = 10_000):
+    matches = 100
+    while matches <= max_matches:
+        # The response cache is off so every call runs its query
+        with temporary_database(cache_size=0) as db:
+            populate(db, seasons=3, matches_per_season=matches, events_per_match=20)
+            print(f"\n{matches} matches and {matches * 20} events per season")
+            report("get_season_leaders aggregates", measure(lambda: db.get_season_leaders(1), 200))
+            report("get_season_leaders rescan", measure(lambda: rescan(db, 1), 20, warmup=1))
+            report("get_player_stats", measure(lambda: db.get_player_stats(3), 200))
+            report("get_player_stats of a season", measure(lambda: db.get_player_stats(3, {"season": 1}), 50, warmup=1))
+        matches *= 10
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
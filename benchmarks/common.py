@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+from os import path
+import json
+import shutil
+import statistics
+import tempfile
+import time
+
+from sqlite.generator import write_database
+from sqlite.sqlite_driver import SqliteDriver
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+CREATE_SCRIPT = path.join(ROOT, "sqlite", "create.sql")
+
+@contextmanager
+def temporary_database(**driver_options):
+    directory = tempfile.mkdtemp(prefix="sportsmeter-bench-")
+    db = SqliteDriver(path.join(directory, "bench.db"), **driver_options)
+    db.create_tables(CREATE_SCRIPT)
+    try:
+        yield db
+    finally:
+        db.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+def populate(db : SqliteDriver, seasons : int = 2, teams : int = 8, players_per_team : int = 14,
+             matches_per_season : int = 50, events_per_match : int = 20, seed : int = 0):
+    # The tournament of sqlite.generator, with lineups and substitutions that follow the gender
+    # rule, summarised under the names the benchmarks index their lookups by
+    sizes = write_database(db, seed=seed, seasons=seasons, teams=teams, players_per_team=players_per_team,
+                           matches_per_season=matches_per_season, events_per_match=events_per_match)
+    return {"seasons": sizes["Seasons"], "teams": sizes["Teams"], "players": sizes["Players"],
+            "matches": sizes["Matches"], "events": sizes["Events"], "match_players": sizes["Match_Players"],
+            "substitutions": sizes["Substitutions"]}
+
+def scaled(seasons : float = 1.0, teams : float = 1.0, players : float = 1.0, events : float = 1.0):
+    # populate() arguments for the default dataset with every dimension multiplied by its factor
+    return {"seasons": max(1, round(2 * seasons)), "teams": max(2, round(8 * teams)),
+            "players_per_team": max(8, round(14 * players)), "matches_per_season": max(1, round(50 * seasons)),
+            "events_per_match": max(0, round(20 * events))}
+
+def measure(func, repeat : int = 1000, warmup : int = 10):
+    for _ in range(warmup):
+        func()
+    durations = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started_at)
+    return durations
+
+def percentile(durations : list, fraction : float):
+    ordered = sorted(durations)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def summary(durations : list):
+    return {
+        "calls": len(durations),
+        "mean_us": statistics.fmean(durations) * 1e6,
+        "p50_us": percentile(durations, 0.50) * 1e6,
+        "p95_us": percentile(durations, 0.95) * 1e6,
+        "p99_us": percentile(durations, 0.99) * 1e6
+    }
+
+def report(name : str, durations : list):
+    stats = summary(durations)
+    print(f"{name:<48} mean {stats['mean_us']:9.1f}us  p50 {stats['p50_us']:9.1f}us  "
+          f"p95 {stats['p95_us']:9.1f}us  p99 {stats['p99_us']:9.1f}us")
+    return stats
+
+def save_results(filepath : str, results : dict):
+    with open(filepath, "w") as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+def compare_results(filepath : str, results : dict, tolerance : float = 0.25):
+    # Names whose p50 got slower than the baseline by more than `tolerance`
+    with open(filepath) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = []
+    for name, stats in results.items():
+        if name in baseline and stats["p50_us"] > baseline[name]["p50_us"] * (1 + tolerance):
+            regressions.append(name)
+            print(f"REGRESSION {name}: p50 {baseline[name]['p50_us']:.1f}us -> {stats['p50_us']:.1f}us")
+    return regressions
@@ -0,0 +1,118 @@
+"""Multi-threaded load test of the Flask API through the test client.
+
+Every thread sends a weighted mix of match day requests for the whole run. Latency is reported
+per endpoint with p50/p95/p99, together with the overall throughput. Like bench_driver, results
+can be saved and compared against an earlier run.
+
+Run from the repository root:
+    python -m benchmarks.load [--threads 8] [--requests 200] [--scale-seasons 1] [--scale-events 1]
+                              [--save before.json] [--compare before.json]
+"""
+import argparse
+from collections import defaultdict
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import CREATE_SCRIPT, compare_results, populate, report, save_results, scaled
+
+def endpoints(sizes):
+    matches, seasons, players, events = sizes["matches"], sizes["seasons"], sizes["players"], sizes["events"]
+    # name -> (weight, method, url factory, json body factory)
+    return {
+        "GET /api/matches/<id>/snapshot": (10, "GET", lambda rand: f"/api/matches/{rand.randrange(matches)}/snapshot", None),
+        "GET /api/matches/<id>": (10, "GET", lambda rand: f"/api/matches/{rand.randrange(matches)}", None),
+        "GET /api/matches/<id>/players": (8, "GET", lambda rand: f"/api/matches/{rand.randrange(matches)}/players", None),
+        "GET /api/matches/<id>/events": (8, "GET", lambda rand: f"/api/matches/{rand.randrange(matches)}/events", None),
+        "GET /api/seasons/<id>/highscore": (5, "GET", lambda rand: f"/api/seasons/{rand.randrange(seasons)}/highscore", None),
+        "GET /api/seasons/<id>/leaders": (5, "GET", lambda rand: f"/api/seasons/{rand.randrange(seasons)}/leaders", None),
+        "GET /api/players/<id>/stats": (5, "GET", lambda rand: f"/api/players/{rand.randrange(players)}/stats", None),
+        "GET /api/players?ids=": (5, "GET", lambda rand: "/api/players?ids=" + ",".join(
+            str(rand.randrange(players)) for _ in range(14)), None),
+        "GET /api/events?limit=100": (4, "GET", lambda rand: f"/api/events?limit=100&after={rand.randrange(events)}", None),
+        "POST /api/events": (15, "POST", lambda rand: "/api/events", lambda rand: {
+            "match_id": rand.randrange(matches), "event_player_1": rand.randrange(players),
+            "event_type": "shots", "event_value": 1}),
+        "PUT /api/matches/<id>": (5, "PUT", lambda rand: f"/api/matches/{rand.randrange(matches)}",
+                                  lambda rand: {"team_a_points": rand.randrange(150)})
+    }
+
+def worker(app, mix, requests : int, seed : int, durations : dict, errors : dict, lock : threading.Lock):
+    rand = random.Random(seed)
+    client = app.test_client()
+    names = list(mix)
+    weights = [mix[name][0] for name in names]
+    local = defaultdict(list)
+    failed = defaultdict(int)
+    for name in rand.choices(names, weights, k=requests):
+        _, method, url, body = mix[name]
+        started_at = time.perf_counter()
+        response = client.open(url(rand), method=method, json=body(rand) if body else None)
+        response.get_data()
+        local[name].append(time.perf_counter() - started_at)
+        if response.status_code >= 400:
+            failed[name] += 1
+    with lock:
+        for name, values in local.items():
+            durations[name].extend(values)
+        for name, count in failed.items():
+            errors[name] += count
+
+def main(argv : list = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for dimension in ("seasons", "teams", "players", "events"):
+        parser.add_argument(f"--scale-{dimension}", type=float, default=1.0)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="requests per thread")
+    parser.add_argument("--save")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix="sportsmeter-load-")
+    # server.py opens its database on import
+    os.environ["SPORTSMETER_DB"] = os.path.join(directory, "load.db")
+    import server
+    try:
+        server.db.create_tables(CREATE_SCRIPT)
+        sizes = populate(server.db, **scaled(args.scale_seasons, args.scale_teams, args.scale_players,
+                                             args.scale_events))
+        # The dataset is already in place, the mock data import must not run
+        server.app._got_first_request = True
+        print(f"dataset: {sizes}, {args.threads} threads x {args.requests} requests")
+
+        mix = endpoints(sizes)
+        durations, errors, lock = defaultdict(list), defaultdict(int), threading.Lock()
+        threads = [threading.Thread(target=worker, args=(server.app, mix, args.requests, seed, durations, errors, lock))
+                   for seed in range(args.threads)]
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started_at
+
+        results = {}
+        for name in mix:
+            if durations[name]:
+                results[name] = report(name, durations[name])
+                if errors[name]:
+                    print(f"{'':<48} {errors[name]} of {len(durations[name])} responses were errors")
+        total = sum(len(values) for values in durations.values())
+        print(f"\n{total} requests in {elapsed:.2f}s, {total / elapsed:.1f} requests/s")
+    finally:
+        server.db.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.save:
+        save_results(args.save, results)
+    if args.compare and compare_results(args.compare, results, args.tolerance):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,27 @@
 from datetime import datetime
-from flask import jsonify, Flask, request
+import os
+import time
+from flask import g, jsonify, Flask, make_response, request, Response
 from flask_jwt_extended import create_access_token, JWTManager, jwt_required, create_refresh_token, get_jwt_identity, get_jwt
 
-from sqlite.sqlite_driver import SqliteDriver
-from backend.exceptions import DatabaseUnavailableError, InvalidInputError, InvalidQueryError, NoResultError
+from sqlite.sqlite_driver import match_topic, SqliteDriver
+from backend.exceptions import DatabaseUnavailableError, InvalidInputError, InvalidQueryError, NoResultError, ServerBusyError
+from backend.metrics import CONTENT_TYPE, LatencyMetrics, render_gauges
+from backend.pubsub import Message
+from backend.serialization import RecordJSONProvider, stream_json
 
 app = Flask(__name__)
+app.json = RecordJSONProvider(app)
 app.config["JWT_SECRET_KEY"] = "super-secret"  # Change this!
 jwt = JWTManager(app)
-db = SqliteDriver("database.db")
+# Queries slower than SPORTSMETER_SLOW_QUERY_MS milliseconds are logged to sportsmeter.slow_queries
+slow_query_ms = os.environ.get("SPORTSMETER_SLOW_QUERY_MS")
+db = SqliteDriver(os.environ.get("SPORTSMETER_DB", "database.db"),
+                  slow_query_ms=float(slow_query_ms) if slow_query_ms else None)
+request_metrics = LatencyMetrics("sportsmeter_request_duration_seconds", ("endpoint", "method", "status"))
 
 JWT_EXPIRY_SEC = 300
+STREAM_KEEPALIVE_SEC = 15
 
 def throws_exception(func):
     def wrapper(*args, **kwargs):
@@ -26,9 +37,75 @@ def throws_exception(func):
             return jsonify({"msg": "Backend error. Check logs."}), 503
         except NoResultError as err:
             return jsonify({"msg": str(err)}), 404
+        except ServerBusyError as err:
+            return jsonify({"msg": str(err)}), 503, {"Retry-After": "1"}
     wrapper.__name__ = func.__name__
     return wrapper
 
+def stream_response(batches):
+    # Large collections are sent as they are read, see SqliteDriver.stream_rows. The first batch
+    # is read before the response starts, so query errors still get a proper status code.
+    format = request.args.get("format")
+    chunks = stream_json(batches, format)
+    first_chunk = next(chunks, "")
+    mimetype = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return Response(stream_body(first_chunk, chunks), mimetype=mimetype)
+
+def stream_body(first_chunk : str, chunks):
+    # The server closes the body when the client goes away, which has to reach the stream
+    try:
+        yield first_chunk
+        yield from chunks
+    finally:
+        chunks.close()
+
+def list_arguments():
+    # Paging and filter arguments of a list endpoint, see SqliteDriver.list_query
+    return {key: value for key, value in request.args.items() if key != "format"}
+
+def conditional(*tables):
+    # GET responses carry an ETag built from the version counters of the tables they read, so
+    # polling clients get a 304 without the query running or the body being serialized.
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return func(*args, **kwargs)
+            etag = db.version_tag(*tables)
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+                response.set_etag(etag)
+                return response
+            response = make_response(func(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        wrapper.__name__ = func.__name__
+        return wrapper
+    return decorator
+
+@app.before_request
+def start_request_timer():
+    g.started_at = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Streamed responses are timed up to their first chunk, see stream_response
+    started_at = g.pop("started_at", None)
+    if started_at is not None:
+        request_metrics.observe((request.endpoint or "unmatched", request.method, response.status_code),
+                                time.perf_counter() - started_at)
+    return response
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    # Prometheus text exposition of request latencies, query times and the driver's counters
+    lines = request_metrics.render()
+    if db.queries is not None:
+        lines.extend(db.queries.render())
+    for component, values in db.metrics().items():
+        lines.extend(render_gauges(f"sportsmeter_{component}", values))
+    return Response("\n".join(lines) + "\n", content_type=CONTENT_TYPE)
+
 @app.before_first_request
 @throws_exception
 def setup_database():
@@ -90,6 +167,7 @@ def jwt_token_valid(user, claims):
 
 @app.route("/api/seasons", methods=["GET", "POST"])
 @throws_exception
+@conditional("Seasons")
 def seasons():
     if request.method == "POST":
         db.add_season(request.json)
@@ -106,6 +184,7 @@ def season(season_id):
 
 @app.route("/api/seasons/<season_id>/matches", methods=["GET", "POST"])
 @throws_exception
+@conditional("Matches", "Teams")
 def season_matches(season_id):
     if request.method == "POST":
         db.add_match(season_id, request.json)
@@ -113,11 +192,19 @@ def season_matches(season_id):
 
 @app.route("/api/seasons/<season_id>/highscore", methods=["GET"])
 @throws_exception
+@conditional("Matches", "Teams")
 def season_highscore(season_id):
     return db.get_season_highscore(season_id)
 
+@app.route("/api/seasons/<season_id>/leaders", methods=["GET"])
+@throws_exception
+@conditional("Events", "Matches", "Players", "Teams")
+def season_leaders(season_id):
+    return db.get_season_leaders(season_id, list_arguments())
+
 @app.route("/api/notifications", methods=["GET", "POST"])
 @throws_exception
+@conditional("Notifications")
 def notifications():
     if request.method == "POST":
         db.add_notifiaction(request.json)
@@ -134,13 +221,15 @@ def notification(notification_id):
 
 @app.route("/api/matches/", methods=["GET", "POST"])
 @throws_exception
+@conditional("Matches")
 def matches():
   if request.method == "POST":
       return db.add_match(request.json), 201
-  return db.get_matches(), 200
+  return stream_response(db.iter_matches(list_arguments()))
 
 @app.route("/api/matches/<match_id>", methods=["GET", "PUT", "DELETE"])
 @throws_exception
+@conditional("Matches", "Teams")
 def match(match_id):
     if request.method == "PUT":
         if db.edit_match(match_id, request.json):
@@ -152,17 +241,55 @@ def match(match_id):
         return {"msg": "Unable to delete match"}, 404
     return db.get_match(match_id)
 
+@app.route("/api/matches/<match_id>/stream", methods=["GET"])
+@throws_exception
+def match_stream(match_id):
+    # Subscribe before taking the snapshot so no update falls between the two
+    subscription = db.broker.subscribe(match_topic(match_id))
+    try:
+        snapshot = db.get_match(match_id)
+        if not snapshot:
+            raise NoResultError(f"Match {match_id} does not exist.")
+    except Exception:
+        subscription.close()
+        raise
+
+    def stream():
+        try:
+            yield Message("match", snapshot).encode()
+            while True:
+                message = subscription.get(timeout=STREAM_KEEPALIVE_SEC)
+                if message is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield message.encode()
+                if message.event == "reset":
+                    break
+        finally:
+            subscription.close()
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/matches/<match_id>/snapshot", methods=["GET"])
+@throws_exception
+@conditional("Matches", "Teams", "Match_Players", "Players", "Events", "Substitutions")
+def match_snapshot(match_id):
+    return db.get_match_snapshot(match_id)
+
 @app.route("/api/matches/<match_id>/players", methods=["GET", "POST"])
 @throws_exception
+@conditional("Match_Players", "Players")
 def match_players(match_id):
     if request.method == "POST":
         if "player_id" not in request.json:
             raise InvalidInputError("Player ID not provided.")
         db.add_match_player(match_id, request.json["player_id"])
-    return db.get_match_players(match_id)
+    return db.get_match_roster(match_id)
 
 @app.route("/api/teams/", methods=["GET", "POST"])
 @throws_exception
+@conditional("Teams")
 def teams():
     if request.method == "POST":
         db.add_team(request.json)
@@ -179,27 +306,31 @@ def team(team_id):
 
 @app.route("/api/substitutions", methods=["GET", "POST"])
 @throws_exception
+@conditional("Substitutions", "Players")
 def substitutions():
     if request.method == "POST":
-        db.add_substitution(request.json)
-    return db.get_substitutions()
+        db.add_substitution(request.json.get("substitution_match"), request.json)
+    return db.get_substitutions(list_arguments())
 
 @app.route("/api/substitutions/<substitution_id>", methods=["GET", "PUT"])
 @throws_exception
 def substitution(substitution_id):
     if request.method == "PUT":
         db.edit_substitution(substitution_id, request.json)
-    return db.get_substitution(substitution_id, request.json), 200
+    return db.get_substitution(substitution_id), 200
 
 @app.route("/api/players", methods=["GET", "POST"])
 @throws_exception
+@conditional("Players", "Teams")
 def players():
     if request.method == "POST":
         db.add_player(request.json)
-    return db.get_players()
+    # Served from the response cache, streamed the same way as the other collections
+    return stream_response([db.get_players(list_arguments())])
 
 @app.route("/api/players/<player_id>", methods=["GET", "PUT", "DELETE"])
 @throws_exception
+@conditional("Players", "Teams")
 def player(player_id):
     if request.method == "DELETE":
         db.delete_player(player_id)
@@ -208,15 +339,28 @@ def player(player_id):
         db.edit_player(player_id, request.json)
     return db.get_player(player_id)
 
+@app.route("/api/players/<player_id>/stats", methods=["GET"])
+@throws_exception
+@conditional("Events", "Matches", "Players")
+def player_stats(player_id):
+    return db.get_player_stats(player_id, list_arguments())
+
 @app.route("/api/events", methods=["GET", "POST"])
 @throws_exception
+@conditional("Events")
 def events():
     if request.method == "POST":
         return db.add_event(request.json)
-    return db.get_events(request.json)
+    return stream_response(db.iter_events(list_arguments()))
+
+@app.route("/api/events/batch", methods=["POST"])
+@throws_exception
+def events_batch():
+    return db.add_events(request.json), 201
 
 @app.route("/api/events/<event_id>", methods=["GET", "PUT", "DELETE"])
 @throws_exception
+@conditional("Events")
 def event(event_id):
     if request.method == "PUT":
         return db.edit_event(event_id, request.json)
@@ -227,5 +371,6 @@ def event(event_id):
 
 @app.route("/api/matches/<match_id>/events", methods=["GET"])
 @throws_exception
+@conditional("Events")
 def match_events(match_id):
     return db.get_match_events(match_id)
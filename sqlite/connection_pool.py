@@ -0,0 +1,229 @@
+from queue import Empty, LifoQueue
+import sqlite3
+import threading
+import time
+
+from backend.exceptions import DatabaseUnavailableError
+
+class TimedCursor(sqlite3.Cursor):
+    # Reports each statement to the connection's observer as (sql, seconds, rows). The time spent
+    # in execute and in the fetches of its rows is summed, so a statement is reported once the
+    # next one starts or the cursor closes.
+    _query = None
+
+    def execute(self, query : str, params = ()):
+        self._report()
+        started_at = time.perf_counter()
+        super().execute(query, params)
+        self._query, self._seconds, self._rows = query, time.perf_counter() - started_at, 0
+        if self.description is None:
+            self._rows = self.rowcount
+            self._report()
+        return self
+
+    def executemany(self, query : str, rows):
+        self._report()
+        started_at = time.perf_counter()
+        super().executemany(query, rows)
+        self._query, self._seconds, self._rows = query, time.perf_counter() - started_at, self.rowcount
+        self._report()
+        return self
+
+    def fetchone(self):
+        started_at = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started_at, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size : int = None):
+        started_at = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started_at, len(rows))
+        return rows
+
+    def fetchall(self):
+        started_at = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started_at, len(rows))
+        return rows
+
+    def close(self):
+        self._report()
+        super().close()
+
+    def _fetched(self, started_at : float, rows : int):
+        if self._query is not None:
+            self._seconds += time.perf_counter() - started_at
+            self._rows += rows
+
+    def _report(self):
+        if self._query is not None:
+            query, self._query = self._query, None
+            self.connection.observer(query, self._seconds, self._rows)
+
+class TimedConnection(sqlite3.Connection):
+    observer = None
+
+    def cursor(self, factory = TimedCursor):
+        return super().cursor(factory)
+
+class ConnectionPool:
+    def __init__(self, dbpath : str, pool_size : int = 5, timeout : float = 5.0, health_check : bool = True,
+                 cached_statements : int = 256, pragmas : dict = None, observer = None) -> None:
+        if pool_size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.dbpath = dbpath
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.health_check = health_check
+        # Each pooled connection keeps its compiled statements, see sqlite.statements
+        self.cached_statements = cached_statements
+        self.pragmas = pragmas or {}
+        # Called with (sql, seconds, rows) for every statement, see TimedCursor
+        self.observer = observer
+        # LIFO hands out the most recently used (warmest) connection first
+        self._idle = LifoQueue()
+        self._connections = []
+        # Connections being opened, they count against pool_size before they exist
+        self._opening = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+        self._metrics = {
+            "connections_opened": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "health_check_failures": 0
+        }
+
+    def open_connection(self, isolation_level : str = ""):
+        try:
+            conn = sqlite3.connect(self.dbpath, check_same_thread=False, isolation_level=isolation_level,
+                                   cached_statements=self.cached_statements,
+                                   factory=sqlite3.Connection if self.observer is None else TimedConnection)
+            if self.observer is not None:
+                conn.observer = self.observer
+            for name, value in self.pragmas.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+        except sqlite3.Error as error:
+            raise DatabaseUnavailableError(f"Unable to connect to db, error: {error}")
+        return conn
+
+    def connect(self):
+        # Opens a connection into a slot taken by _reserve, the slot is freed if that fails
+        try:
+            conn = self.open_connection()
+        except BaseException:
+            with self._lock:
+                self._opening -= 1
+            raise
+        with self._lock:
+            self._opening -= 1
+            self._connections.append(conn)
+            self._metrics["connections_opened"] += 1
+        return conn
+
+    def _reserve(self):
+        # Checked and taken under one lock, so concurrent checkouts can not open past pool_size
+        with self._lock:
+            if len(self._connections) + self._opening >= self.pool_size:
+                return False
+            self._opening += 1
+            return True
+
+    def acquire(self):
+        # Nested driver calls on the same thread share the connection they already hold,
+        # so a bounded pool can not deadlock on its own callers.
+        if getattr(self._local, "depth", 0) > 0:
+            self._local.depth += 1
+            return self._local.conn
+
+        if self._closed:
+            raise DatabaseUnavailableError("Connection pool is closed")
+        conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def bind_thread(self, conn):
+        # Pins a connection the pool does not own to the calling thread for its whole life
+        self._local.conn = conn
+        self._local.depth = 1
+
+    def release(self, conn):
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        self._local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    def _checkout(self):
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except Empty:
+            conn = self.connect() if self._reserve() else self._wait()
+
+        with self._lock:
+            self._metrics["checkouts"] += 1
+        if self.health_check and not self._healthy(conn):
+            with self._lock:
+                self._metrics["health_check_failures"] += 1
+            self._discard(conn)
+            conn = self.connect() if self._reserve() else self._wait()
+        return conn
+
+    def _wait(self):
+        started_at = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except Empty:
+            with self._lock:
+                self._metrics["timeouts"] += 1
+            raise DatabaseUnavailableError(f"No database connection available after {self.timeout}s")
+        waited = time.perf_counter() - started_at
+        with self._lock:
+            self._metrics["waits"] += 1
+            self._metrics["wait_time_total"] += waited
+            self._metrics["wait_time_max"] = max(self._metrics["wait_time_max"], waited)
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["pool_size"] = self.pool_size
+            metrics["open_connections"] = len(self._connections)
+        metrics["idle_connections"] = self._idle.qsize()
+        return metrics
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except Empty:
+                break
@@ -0,0 +1,228 @@
+from datetime import date, timedelta
+from os import path
+import argparse
+import random
+import sqlite3
+import time
+
+from sqlite.importer import CSV_TABLES
+from sqlite.roster import GENDERS
+from sqlite.sqlite_driver import MAX_GENDER_PLAYERS
+from sqlite.statements import insert_statement
+
+# Columns written for every generated table, ids included so CSV exports import to the same rows
+TABLE_COLUMNS = {
+    "Seasons": ("season_id", "season_title", "season_start_date", "season_end_date"),
+    "Teams": ("team_id", "team_name"),
+    "Players": ("player_id", "player_name", "player_gender", "player_team"),
+    "Matches": ("match_id", "match_date", "match_start_time", "match_end_time", "match_season",
+                "team_a_id", "team_b_id", "team_a_points", "team_b_points"),
+    "Match_Players": ("match_player_id", "match_player", "match_id", "player_active"),
+    "Substitutions": ("substitution_id", "substitution_time", "substitution_match", "substituted_player",
+                      "substituting_player"),
+    "Events": ("event_id", "match_id", "event_player_1", "event_player_2", "event_type", "event_value")
+}
+CITIES = ["Poznań", "Łódź", "Warszawa", "Kraków", "Wrocław", "Gdańsk", "Lublin", "Szczecin", "Katowice",
+          "Białystok", "Rzeszów", "Toruń", "Opole", "Kielce", "Olsztyn", "Bydgoszcz"]
+MASCOTS = ["Capricorns", "Pirates", "Unicorns", "Dragons", "Lynx", "Wolves", "Ravens", "Hawks", "Bears",
+           "Foxes", "Owls", "Bisons", "Kraken", "Phoenix", "Vipers", "Griffins"]
+FIRST_NAMES = {
+    "Male": ["Maciej", "Krzysztof", "Jakub", "Piotr", "Tomasz", "Michał", "Paweł", "Adam", "Marcin", "Kamil"],
+    "Female": ["Kinga", "Monika", "Anna", "Zofia", "Julia", "Maja", "Ola", "Natalia", "Ewa", "Marta"],
+    "Nonbinary": ["Alex", "Sasha", "Robin", "Kim", "Ari", "Nikola", "Jordan", "Eli", "Noa", "Sam"]
+}
+LAST_NAMES = ["Nowak", "Kowalski", "Wiśniewski", "Wójcik", "Kamiński", "Lewandowski", "Zieliński", "Szymański",
+              "Woźniak", "Dąbrowski", "Kozłowski", "Jankowski", "Mazur", "Kwiatkowski", "Krawczyk", "Piotrowski"]
+# Event types of open play and how often they happen. Every goal also records the assist of a
+# teammate most of the time, and a match ends with at most one catch.
+EVENT_WEIGHTS = {"shots": 30, "passes": 30, "tackles": 12, "defenses": 10, "turnovers": 8, "beats": 12,
+                 "misses": 8, "goal": 10, "yellow card": 2, "red card": 1}
+ASSIST_RATE = 0.6
+CATCH_RATE = 0.9
+GOAL_POINTS = 10
+CATCH_POINTS = 30
+
+def day(value : date):
+    return value.strftime("%Y%m%d")
+
+def clock(seconds : int):
+    return f"{seconds // 3600:02d}{seconds // 60 % 60:02d}{seconds % 60:02d}"
+
+def team_name(team_id : int):
+    city, mascot = CITIES[team_id % len(CITIES)], MASCOTS[team_id // len(CITIES) % len(MASCOTS)]
+    edition = team_id // (len(CITIES) * len(MASCOTS))
+    return f"{city} {mascot} {edition + 1}" if edition else f"{city} {mascot}"
+
+def generate(seed : int = 0, seasons : int = 2, teams : int = 8, players_per_team : int = 14,
+             matches_per_season : int = 50, events_per_match : int = 40, substitutions_per_match : int = 4,
+             max_gender_players : int = MAX_GENDER_PLAYERS, chunk_matches : int = 500):
+    # Yields (table, rows) chunks in foreign key order. Only one chunk of matches is held in memory,
+    # so the size of the tournament is bounded by disk, not RAM.
+    if teams < 2:
+        raise ValueError("A tournament needs at least two teams.")
+    rand = random.Random(seed)
+    # Both teams field the same number of players of every gender, the rule counts the whole field
+    per_team = max_gender_players // 2
+    if players_per_team < len(GENDERS) * per_team:
+        raise ValueError(f"Teams need at least {len(GENDERS) * per_team} players to field a legal squad.")
+
+    season_rows = []
+    for season_id in range(seasons):
+        start = date(2000 + season_id, 3, 1)
+        season_rows.append((season_id, str(2000 + season_id), day(start), day(start + timedelta(days=240))))
+    yield "Seasons", season_rows
+
+    yield "Teams", [(team_id, team_name(team_id)) for team_id in range(teams)]
+
+    squads = []
+    player_rows = []
+    for team_id in range(teams):
+        squad = {gender: [] for gender in GENDERS}
+        for number in range(players_per_team):
+            player_id = len(player_rows)
+            gender = GENDERS[number % len(GENDERS)]
+            player_rows.append((player_id, f"{rand.choice(FIRST_NAMES[gender])} {rand.choice(LAST_NAMES)}",
+                                gender, team_id))
+            squad[gender].append(player_id)
+        squads.append(squad)
+    yield "Players", player_rows
+
+    event_types = list(EVENT_WEIGHTS)
+    event_weights = list(EVENT_WEIGHTS.values())
+    ids = {"match_player_id": 0, "substitution_id": 0, "event_id": 1}
+    chunk = {"Matches": [], "Match_Players": [], "Substitutions": [], "Events": []}
+    for season_id, _, season_start, _ in season_rows:
+        start = date(int(season_start[:4]), 3, 1)
+        for number in range(matches_per_season):
+            match_id = season_id * matches_per_season + number
+            team_a, team_b = rand.sample(range(teams), 2)
+            starts_at = rand.randrange(9 * 3600, 17 * 3600, 15 * 60)
+            ends_at = starts_at + rand.randrange(40 * 60, 90 * 60, 60)
+
+            # Lineups: the same number of players of every gender from both teams, the rest on the bench
+            active, bench = {}, {}
+            for team_id in (team_a, team_b):
+                for gender, players in squads[team_id].items():
+                    lineup = rand.sample(players, len(players))
+                    active.update((player_id, (team_id, gender)) for player_id in lineup[:per_team])
+                    bench.update((player_id, (team_id, gender)) for player_id in lineup[per_team:])
+
+            # Substitutions swap a player for a benched teammate of the same gender, so the gender
+            # counts of the field never change and every substitution passes the rule
+            times = sorted(rand.randrange(starts_at, ends_at) for _ in range(substitutions_per_match))
+            for substituted_at in times:
+                substituted = rand.choice(list(active))
+                team_id, gender = active[substituted]
+                candidates = [player_id for player_id, player in bench.items() if player == (team_id, gender)]
+                if not candidates:
+                    continue
+                substituting = rand.choice(candidates)
+                bench[substituted] = active.pop(substituted)
+                active[substituting] = bench.pop(substituting)
+                chunk["Substitutions"].append((ids["substitution_id"], clock(substituted_at), match_id,
+                                               substituted, substituting))
+                ids["substitution_id"] += 1
+
+            for player_id, player_active in [*((player_id, 1) for player_id in active),
+                                             *((player_id, 0) for player_id in bench)]:
+                chunk["Match_Players"].append((ids["match_player_id"], player_id, match_id, player_active))
+                ids["match_player_id"] += 1
+
+            field = {team_a: [], team_b: []}
+            for player_id, (team_id, _) in active.items():
+                field[team_id].append(player_id)
+            points = {team_a: 0, team_b: 0}
+            events = []
+            for event_type in rand.choices(event_types, event_weights, k=events_per_match):
+                team_id = rand.choice((team_a, team_b))
+                player_id = rand.choice(field[team_id])
+                if event_type == "goal":
+                    points[team_id] += GOAL_POINTS
+                    if rand.random() < ASSIST_RATE:
+                        assist = rand.choice([teammate for teammate in field[team_id] if teammate != player_id])
+                        events.append(("goal", player_id, assist))
+                        events.append(("assist", assist, player_id))
+                        continue
+                events.append((event_type, player_id, None))
+            if rand.random() < CATCH_RATE:
+                team_id = rand.choice((team_a, team_b))
+                points[team_id] += CATCH_POINTS
+                events.append(("catch", rand.choice(field[team_id]), None))
+            for event_type, player_1, player_2 in events:
+                chunk["Events"].append((ids["event_id"], match_id, player_1, player_2, event_type, 1))
+                ids["event_id"] += 1
+
+            match_date = day(start + timedelta(days=number * 240 // max(1, matches_per_season)))
+            chunk["Matches"].append((match_id, match_date, clock(starts_at), clock(ends_at), season_id,
+                                     team_a, team_b, points[team_a], points[team_b]))
+
+            if len(chunk["Matches"]) >= chunk_matches:
+                yield from chunk.items()
+                chunk = {table: [] for table in chunk}
+    yield from ((table, rows) for table, rows in chunk.items() if rows)
+
+def write_database(db, **options):
+    # Bulk inserts every chunk as one write job of the driver's writer, then lets the driver drop
+    # whatever it cached about the replaced tables
+    sizes = dict.fromkeys(TABLE_COLUMNS, 0)
+    for table, rows in generate(**options):
+        query = insert_statement(table, TABLE_COLUMNS[table], "REPLACE")
+        db.writer.run(lambda cur: cur.executemany(query, rows))
+        sizes[table] += len(rows)
+    db.forget_rosters()
+    db.tables_changed(*TABLE_COLUMNS)
+    return sizes
+
+def csv_literal(value):
+    # The cell format sqlite.importer reads: NULL, bare numbers and quoted text
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def write_csv(directory : str, delimiter : str = ";", **options):
+    # One file per table under the names import_all looks for
+    filenames = dict(CSV_TABLES)
+    files = {}
+    sizes = dict.fromkeys(TABLE_COLUMNS, 0)
+    try:
+        for table, rows in generate(**options):
+            if table not in files:
+                files[table] = open(path.join(directory, filenames[table]), "w", encoding="utf-8", newline="")
+                files[table].write(delimiter.join(TABLE_COLUMNS[table]) + "\n")
+            files[table].writelines(delimiter.join(map(csv_literal, row)) + "\n" for row in rows)
+            sizes[table] += len(rows)
+    finally:
+        for csv_file in files.values():
+            csv_file.close()
+    return sizes
+
+if __name__ == "__main__":
+    # python -m sqlite.generator <database | csv directory> [--csv] [--seed 0] [--seasons 2] ...
+    from sqlite.sqlite_driver import SqliteDriver
+
+    parser = argparse.ArgumentParser(description="Generates a synthetic tournament.")
+    parser.add_argument("target", help="SQLite database to fill, or a directory with --csv")
+    parser.add_argument("--csv", action="store_true", help="write CSV files for insert_from_csv instead")
+    for option, default in (("seed", 0), ("seasons", 2), ("teams", 8), ("players_per_team", 14),
+                            ("matches_per_season", 50), ("events_per_match", 40), ("substitutions_per_match", 4)):
+        parser.add_argument(f"--{option.replace('_', '-')}", dest=option, type=int, default=default)
+    args = vars(parser.parse_args())
+    target, as_csv = args.pop("target"), args.pop("csv")
+
+    started_at = time.perf_counter()
+    if as_csv:
+        sizes = write_csv(target, **args)
+    else:
+        db = SqliteDriver(target)
+        db.create_tables(path.join(path.dirname(path.abspath(__file__)), "create.sql"))
+        try:
+            sizes = write_database(db, **args)
+        except sqlite3.Error as error:
+            raise SystemExit(f"Error while writing the tournament: {error}")
+        finally:
+            db.close()
+    for table, rows in sizes.items():
+        print(f"{table:<14} {rows:>10} rows")
+    print(f"{sum(sizes.values())} rows in {time.perf_counter() - started_at:.3f}s")
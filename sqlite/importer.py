@@ -0,0 +1,123 @@
+from csv import reader
+from itertools import islice
+from os import path
+import sqlite3
+import sys
+import time
+
+from sqlite.statements import check_identifiers, insert_statement
+
+# Tables in foreign key order with the file each one is loaded from
+CSV_TABLES = [
+    ("Seasons", "seasons.csv"),
+    ("Teams", "teams.csv"),
+    ("Matches", "matches.csv"),
+    ("Notifications", "notifications.csv"),
+    ("Players", "players.csv"),
+    ("Match_Players", "match_players.csv"),
+    ("Substitutions", "substitutions.csv"),
+    ("Events", "events.csv"),
+    ("Users", "users.csv")
+]
+CHUNK_SIZE = 5000
+
+def parse_literal(value : str, cast = None):
+    # CSV cells are written as SQL literals ('quoted text', bare numbers or NULL) and are
+    # converted to the column's declared type instead of being pasted into the SQL text.
+    value = value.strip()
+    if value == "" or value.upper() == "NULL":
+        return None
+    quoted = len(value) >= 2 and value[0] == "'" and value[-1] == "'"
+    if quoted:
+        value = value[1:-1].replace("''", "'")
+    if cast is not None:
+        return cast(value)
+    if not quoted:
+        raise ValueError(f"text value {value} is not quoted")
+    return value
+
+def csv_converter(declared_type : str):
+    declared_type = declared_type.upper()
+    if "INT" in declared_type:
+        cast = int
+    elif any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        cast = float
+    else:
+        cast = None
+
+    # Fast paths for the common cell shapes, everything else goes through parse_literal
+    if cast is not None:
+        def convert(value : str):
+            if value == "NULL":
+                return None
+            try:
+                return cast(value)
+            except ValueError:
+                return parse_literal(value, cast)
+    else:
+        def convert(value : str):
+            if len(value) >= 2 and value[0] == "'" and value[-1] == "'" and "'" not in value[1:-1]:
+                return value[1:-1]
+            return parse_literal(value)
+    return convert
+
+def csv_converters(cur : sqlite3.Cursor, table : str, header : list):
+    check_identifiers(table, *header)
+    declared_types = {row[1]: row[2] for row in cur.execute(f"PRAGMA table_info({table})")}
+    for column in header:
+        if column not in declared_types:
+            raise ValueError(f"table {table} has no column {column}")
+    return [csv_converter(declared_types[column]) for column in header]
+
+def drop_indexes(cur : sqlite3.Cursor, table : str):
+    indexes = cur.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+                          "AND sql IS NOT NULL", (table,)).fetchall()
+    for name, _ in indexes:
+        cur.execute(f"DROP INDEX {name}")
+    return [sql for _, sql in indexes]
+
+def import_rows(cur : sqlite3.Cursor, table : str, filepath : str, delimiter : str,
+                chunk_size : int = CHUNK_SIZE, defer_indexes : bool = False):
+    with open(filepath, encoding="utf-8", newline="") as csv_file:
+        content = reader(csv_file, delimiter=delimiter)
+        header = next(content)
+        converters = csv_converters(cur, table, header)
+        query = insert_statement(table, tuple(header), "REPLACE")
+
+        index_definitions = drop_indexes(cur, table) if defer_indexes else []
+        rows = 0
+        while True:
+            chunk = []
+            for row in islice(content, chunk_size):
+                if not row:
+                    continue
+                try:
+                    if len(row) != len(converters):
+                        raise ValueError(f"expected {len(converters)} values, got {len(row)}")
+                    chunk.append([convert(value) for convert, value in zip(converters, row)])
+                except ValueError as error:
+                    raise ValueError(f"line {content.line_num}: {error}")
+            if not chunk:
+                break
+            cur.executemany(query, chunk)
+            rows += len(chunk)
+        for definition in index_definitions:
+            cur.execute(definition)
+    return rows
+
+def import_report(stats : dict):
+    return (f"{stats['table']:<14} {stats['rows']:>10} rows in {stats['seconds']:8.3f}s "
+            f"({stats['rows_per_second']:,.0f} rows/s)")
+
+if __name__ == "__main__":
+    # python -m sqlite.importer <database> <csv directory> [--defer-indexes]
+    from sqlite.sqlite_driver import SqliteDriver
+
+    db = SqliteDriver(sys.argv[1])
+    db.create_tables(path.join(path.dirname(path.abspath(__file__)), "create.sql"))
+    started_at = time.perf_counter()
+    results = db.import_all(sys.argv[2], defer_indexes="--defer-indexes" in sys.argv)
+    for stats in results:
+        print(import_report(stats))
+    print(f"{sum(stats['rows'] for stats in results)} rows in {time.perf_counter() - started_at:.3f}s")
+    db.close()
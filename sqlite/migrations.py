@@ -0,0 +1,200 @@
+import sqlite3
+
+def season_stats_upsert(events : str, season : str, sign : int):
+    # Adds (sign 1) or removes (sign -1) the events of a row source to Player_Season_Stats, once
+    # for the player in event_player_1 (role 1) and once for event_player_2 (role 2)
+    return "".join(f"""
+        INSERT INTO Player_Season_Stats (season_id, event_type, player_role, player_id, event_count, value_total)
+        SELECT {season}, event_type, {role}, {player}, {sign} * COUNT(*), {sign} * SUM(COALESCE(event_value, 0))
+        FROM {events} WHERE {season} IS NOT NULL AND {player} IS NOT NULL GROUP BY {season}, event_type, {player}
+        ON CONFLICT (season_id, event_type, player_role, player_id) DO UPDATE
+        SET event_count = event_count + excluded.event_count, value_total = value_total + excluded.value_total;"""
+        for role, player in ((1, "event_player_1"), (2, "event_player_2")))
+
+EVENT_ROW = ("(SELECT {row}.event_type AS event_type, {row}.event_player_1 AS event_player_1, "
+             "{row}.event_player_2 AS event_player_2, {row}.event_value AS event_value)")
+EVENT_SEASON = "(SELECT match_season FROM Matches WHERE match_id = {row}.match_id)"
+MATCH_EVENTS = "(SELECT * FROM Events WHERE match_id = {row}.match_id)"
+
+# Schema changes applied on top of create.sql, in order. PRAGMA user_version stores how many
+# of them a database has already received, so every script runs exactly once per file.
+MIGRATIONS = [
+    # Foreign key access paths used by the season, match, roster and substitution lookups.
+    # The Match_Players index also covers get_match_players and the active player checks.
+    """
+    CREATE INDEX IF NOT EXISTS idx_matches_season ON Matches (match_season);
+    CREATE INDEX IF NOT EXISTS idx_events_match ON Events (match_id);
+    CREATE INDEX IF NOT EXISTS idx_match_players_match_active ON Match_Players (match_id, player_active, match_player);
+    CREATE INDEX IF NOT EXISTS idx_substitutions_match ON Substitutions (substitution_match);
+    """,
+    # Season standings kept up to date by triggers on Matches, so reading a season's highscore
+    # touches one row per team instead of every match of the season.
+    """
+    CREATE TABLE IF NOT EXISTS Season_Standings (
+        season_id INTEGER NOT NULL,
+        team_id INTEGER NOT NULL,
+        team_points INTEGER NOT NULL,
+        match_count INTEGER NOT NULL,
+        PRIMARY KEY (season_id, team_id)
+    ) WITHOUT ROWID;
+
+    INSERT OR REPLACE INTO Season_Standings (season_id, team_id, team_points, match_count)
+    SELECT season_id, team_id, SUM(points), COUNT(*) FROM (
+        SELECT match_season AS season_id, team_a_id AS team_id, COALESCE(team_a_points, 0) AS points FROM Matches
+        UNION ALL
+        SELECT match_season AS season_id, team_b_id AS team_id, COALESCE(team_b_points, 0) AS points FROM Matches
+    ) WHERE season_id IS NOT NULL AND team_id IS NOT NULL GROUP BY season_id, team_id;
+
+    CREATE TRIGGER IF NOT EXISTS standings_match_insert AFTER INSERT ON Matches BEGIN
+        INSERT INTO Season_Standings (season_id, team_id, team_points, match_count)
+        SELECT NEW.match_season, NEW.team_a_id, COALESCE(NEW.team_a_points, 0), 1
+        WHERE NEW.match_season IS NOT NULL AND NEW.team_a_id IS NOT NULL
+        ON CONFLICT (season_id, team_id) DO UPDATE SET team_points = team_points + excluded.team_points,
+                                                       match_count = match_count + 1;
+        INSERT INTO Season_Standings (season_id, team_id, team_points, match_count)
+        SELECT NEW.match_season, NEW.team_b_id, COALESCE(NEW.team_b_points, 0), 1
+        WHERE NEW.match_season IS NOT NULL AND NEW.team_b_id IS NOT NULL
+        ON CONFLICT (season_id, team_id) DO UPDATE SET team_points = team_points + excluded.team_points,
+                                                       match_count = match_count + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS standings_match_delete AFTER DELETE ON Matches BEGIN
+        UPDATE Season_Standings SET team_points = team_points - COALESCE(OLD.team_a_points, 0),
+                                    match_count = match_count - 1
+        WHERE season_id = OLD.match_season AND team_id = OLD.team_a_id;
+        UPDATE Season_Standings SET team_points = team_points - COALESCE(OLD.team_b_points, 0),
+                                    match_count = match_count - 1
+        WHERE season_id = OLD.match_season AND team_id = OLD.team_b_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS standings_match_update
+    AFTER UPDATE OF match_season, team_a_id, team_b_id, team_a_points, team_b_points ON Matches BEGIN
+        UPDATE Season_Standings SET team_points = team_points - COALESCE(OLD.team_a_points, 0),
+                                    match_count = match_count - 1
+        WHERE season_id = OLD.match_season AND team_id = OLD.team_a_id;
+        UPDATE Season_Standings SET team_points = team_points - COALESCE(OLD.team_b_points, 0),
+                                    match_count = match_count - 1
+        WHERE season_id = OLD.match_season AND team_id = OLD.team_b_id;
+        INSERT INTO Season_Standings (season_id, team_id, team_points, match_count)
+        SELECT NEW.match_season, NEW.team_a_id, COALESCE(NEW.team_a_points, 0), 1
+        WHERE NEW.match_season IS NOT NULL AND NEW.team_a_id IS NOT NULL
+        ON CONFLICT (season_id, team_id) DO UPDATE SET team_points = team_points + excluded.team_points,
+                                                       match_count = match_count + 1;
+        INSERT INTO Season_Standings (season_id, team_id, team_points, match_count)
+        SELECT NEW.match_season, NEW.team_b_id, COALESCE(NEW.team_b_points, 0), 1
+        WHERE NEW.match_season IS NOT NULL AND NEW.team_b_id IS NOT NULL
+        ON CONFLICT (season_id, team_id) DO UPDATE SET team_points = team_points + excluded.team_points,
+                                                       match_count = match_count + 1;
+    END;
+    """,
+    # Client supplied keys of ingested events, so a replayed batch returns the events it already
+    # created instead of inserting them again.
+    """
+    CREATE TABLE IF NOT EXISTS Event_Keys (
+        idempotency_key TEXT PRIMARY KEY,
+        event_id INTEGER NOT NULL REFERENCES Events(event_id)
+    ) WITHOUT ROWID;
+    """,
+    # Squad lookups behind the in-memory match rosters
+    """
+    CREATE INDEX IF NOT EXISTS idx_players_team ON Players (player_team);
+    """,
+    # Filters of the paged list reads. Every index ends in the rowid, so an equality filter
+    # walks its rows already in primary key order.
+    """
+    CREATE INDEX IF NOT EXISTS idx_events_type ON Events (event_type);
+    CREATE INDEX IF NOT EXISTS idx_events_player_1 ON Events (event_player_1);
+    CREATE INDEX IF NOT EXISTS idx_events_player_2 ON Events (event_player_2);
+    CREATE INDEX IF NOT EXISTS idx_matches_date ON Matches (match_date);
+    CREATE INDEX IF NOT EXISTS idx_matches_team_a ON Matches (team_a_id);
+    CREATE INDEX IF NOT EXISTS idx_matches_team_b ON Matches (team_b_id);
+    CREATE INDEX IF NOT EXISTS idx_substitutions_substituted ON Substitutions (substituted_player);
+    CREATE INDEX IF NOT EXISTS idx_substitutions_substituting ON Substitutions (substituting_player);
+    """,
+    # Per season event totals of every player, kept up to date by triggers on Events and on the
+    # season of their match, so season leaders read one row per player instead of every event.
+    f"""
+    CREATE TABLE IF NOT EXISTS Player_Season_Stats (
+        season_id INTEGER NOT NULL,
+        event_type TEXT NOT NULL,
+        player_role INTEGER NOT NULL,
+        player_id INTEGER NOT NULL,
+        event_count INTEGER NOT NULL,
+        value_total INTEGER NOT NULL,
+        PRIMARY KEY (season_id, event_type, player_role, player_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_player_season_stats_player ON Player_Season_Stats (player_id);
+
+    {season_stats_upsert("(SELECT m.match_season AS season_id, e.* FROM Events e, Matches m "
+                         "WHERE m.match_id = e.match_id)", "season_id", 1)}
+
+    CREATE TRIGGER IF NOT EXISTS stats_event_insert AFTER INSERT ON Events BEGIN
+        {season_stats_upsert(EVENT_ROW.format(row="NEW"), EVENT_SEASON.format(row="NEW"), 1)}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS stats_event_delete AFTER DELETE ON Events BEGIN
+        {season_stats_upsert(EVENT_ROW.format(row="OLD"), EVENT_SEASON.format(row="OLD"), -1)}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS stats_event_update
+    AFTER UPDATE OF match_id, event_player_1, event_player_2, event_type, event_value ON Events BEGIN
+        {season_stats_upsert(EVENT_ROW.format(row="OLD"), EVENT_SEASON.format(row="OLD"), -1)}
+        {season_stats_upsert(EVENT_ROW.format(row="NEW"), EVENT_SEASON.format(row="NEW"), 1)}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS stats_match_insert AFTER INSERT ON Matches BEGIN
+        {season_stats_upsert(MATCH_EVENTS.format(row="NEW"), "NEW.match_season", 1)}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS stats_match_delete AFTER DELETE ON Matches BEGIN
+        {season_stats_upsert(MATCH_EVENTS.format(row="OLD"), "OLD.match_season", -1)}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS stats_match_update AFTER UPDATE OF match_id, match_season ON Matches
+    WHEN OLD.match_id IS NOT NEW.match_id OR OLD.match_season IS NOT NEW.match_season BEGIN
+        {season_stats_upsert(MATCH_EVENTS.format(row="OLD"), "OLD.match_season", -1)}
+        {season_stats_upsert(MATCH_EVENTS.format(row="NEW"), "NEW.match_season", 1)}
+    END;
+    """,
+    # Login lookups by index, and one account per login. Duplicates left by earlier versions stop
+    # the migration, see PRECONDITIONS.
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_users_login ON Users (user_login);
+    """,
+    # Keys are deleted along with their event
+    """
+    CREATE INDEX IF NOT EXISTS idx_event_keys_event ON Event_Keys (event_id);
+    """
+]
+
+# Migration number -> a query that has to return no rows before the migration runs, and what its
+# rows are. Accounts are never merged or deleted on their owners' behalf.
+PRECONDITIONS = {
+    7: ("SELECT user_login FROM Users GROUP BY user_login HAVING COUNT(*) > 1 ORDER BY user_login",
+        "logins shared by more than one account, rename or remove the extra accounts first")
+}
+
+def check_precondition(conn : sqlite3.Connection, number : int):
+    if number not in PRECONDITIONS:
+        return
+    query, problem = PRECONDITIONS[number]
+    rows = conn.execute(query).fetchall()
+    if rows:
+        values = ", ".join(str(row[0]) for row in rows)
+        raise sqlite3.IntegrityError(f"Migration {number} can not run, {problem}: {values}")
+
+def schema_version(conn : sqlite3.Connection):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn : sqlite3.Connection):
+    version = schema_version(conn)
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        check_precondition(conn, number)
+        try:
+            conn.executescript(f"BEGIN IMMEDIATE; {script}; PRAGMA user_version = {number}; COMMIT;")
+        except sqlite3.Error:
+            # A failed script leaves its transaction open, nothing of it is kept
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+    return schema_version(conn)
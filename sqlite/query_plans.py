@@ -0,0 +1,98 @@
+from os import path
+import argparse
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from sqlite.statements import LIST_QUERIES, STATEMENTS, list_statement
+
+# List reads that go through a whole table by design, and the filters of theirs that are not
+# expected to narrow the scan: three genders, and an open date range, whose pages walk match_id
+# order up to the limit (with both bounds set idx_matches_date is searched instead)
+FULL_SCANS = {"get_notifications", "get_seasons", "get_teams", "get_matches", "get_players",
+              "get_substitutions", "get_events"}
+SCAN_FILTERS = {("get_players", "gender"), ("get_matches", "date_from"), ("get_matches", "date_to")}
+
+def statement_shapes():
+    # shape -> (statement, filters, query) for every fixed statement and every single-filter
+    # page shape of the list reads, e.g. "get_events[match,after,limit]"
+    shapes = {name: (name, (), query) for name, query in STATEMENTS.items()}
+    for name, (_, conditions) in LIST_QUERIES.items():
+        for filters in [(), *((field,) for field in conditions)]:
+            for after in (False, True):
+                for limit in (False, True):
+                    if filters or after or limit:
+                        shape = ",".join((*filters, *(["after"] if after else []), *(["limit"] if limit else [])))
+                        shapes[f"{name}[{shape}]"] = (name, filters, list_statement(name, filters, after, limit))
+    return shapes
+
+def query_plan(cur : sqlite3.Cursor, query : str):
+    # EXPLAIN QUERY PLAN needs every placeholder bound, the plan does not depend on the values
+    return [row[3] for row in cur.execute(f"EXPLAIN QUERY PLAN {query}", (1,) * query.count("?")).fetchall()]
+
+def is_scan(detail : str):
+    # Table-valued functions such as json_each are always "scanned" and are not table scans
+    return detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail and detail != "SCAN CONSTANT ROW"
+
+def audit(cur : sqlite3.Cursor, shapes : dict = None):
+    reports = []
+    for shape, (statement, filters, query) in (statement_shapes() if shapes is None else shapes).items():
+        plan = query_plan(cur, query)
+        reports.append({
+            "shape": shape,
+            "statement": statement,
+            "filters": filters,
+            "plan": plan,
+            "scans": [detail for detail in plan if is_scan(detail)],
+            "temp_btrees": [detail for detail in plan if "TEMP B-TREE" in detail]
+        })
+    return reports
+
+def expected_scan(report : dict):
+    return report["statement"] in FULL_SCANS and all((report["statement"], field) in SCAN_FILTERS
+                                                       for field in report["filters"])
+
+def regressions(reports : list):
+    return [report for report in reports if report["scans"] and not expected_scan(report)]
+
+def plan_report(report : dict):
+    flags = ("SCAN " if report["scans"] else "") + ("TEMP " if report["temp_btrees"] else "")
+    return f"{flags:<10} {report['shape']:<36} {' ; '.join(report['plan'])}"
+
+if __name__ == "__main__":
+    # python -m sqlite.query_plans [database] [--analyze]
+    # Without a database the plans are taken on a generated tournament, see sqlite.generator
+    from sqlite.generator import write_database
+    from sqlite.sqlite_driver import SqliteContext, SqliteDriver
+
+    parser = argparse.ArgumentParser(description="Audits the query plans of every driver statement.")
+    parser.add_argument("database", nargs="?", help="populated SQLite database, generated when omitted")
+    parser.add_argument("--analyze", action="store_true", help="run ANALYZE first so the planner has statistics")
+    args = parser.parse_args()
+
+    directory = None
+    if args.database is None:
+        directory = tempfile.mkdtemp(prefix="sportsmeter-plans-")
+        args.database = path.join(directory, "plans.db")
+    db = SqliteDriver(args.database)
+    try:
+        db.create_tables(path.join(path.dirname(path.abspath(__file__)), "create.sql"))
+        if directory is not None:
+            write_database(db)
+        with SqliteContext(db.pool) as [conn, cur]:
+            if args.analyze:
+                cur.execute("ANALYZE")
+                conn.commit()
+            reports = audit(cur)
+    finally:
+        db.close()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    for report in reports:
+        print(plan_report(report))
+    failed = regressions(reports)
+    for report in failed:
+        print(f"REGRESSION {report['shape']}: {' ; '.join(report['scans'])}")
+    sys.exit(1 if failed else 0)
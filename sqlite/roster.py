@@ -0,0 +1,59 @@
+from backend.exceptions import InvalidInputError
+
+GENDERS = ("Male", "Female", "Nonbinary")
+
+def check_gender_rule(gender_counts : dict, max_gender_players : int, new_gender : str, old_gender : str = None):
+    gender_ratio = dict(gender_counts)
+    if old_gender is not None:
+        gender_ratio[old_gender] = gender_ratio.get(old_gender, 0) - 1
+    gender_ratio[new_gender] = gender_ratio.get(new_gender, 0) + 1
+    if any(gender > max_gender_players for gender in gender_ratio.values()):
+        raise InvalidInputError("Gender rule broken!")
+
+class MatchRoster:
+    # Who plays in a match, who is on the field and how many active players of each gender there
+    # are. Loaded once per match inside a write job and updated by the jobs that change its
+    # Match_Players rows, so the rule checks of a live match need no database round trip.
+    def __init__(self, match_id, max_gender_players : int, squad_rows : list, entry_rows : list) -> None:
+        self.match_id = match_id
+        self.max_gender_players = max_gender_players
+        # player_id -> (player_gender, player_team) for both squads and everyone who played
+        self.squad = {row[0]: (row[1], row[2]) for row in squad_rows}
+        # player_id -> player_active
+        self.entries = {}
+        self.gender_counts = dict.fromkeys(GENDERS, 0)
+        for player_id, player_active, player_gender, player_team in entry_rows:
+            self.squad[player_id] = (player_gender, player_team)
+            self._set_active(player_id, player_active == 1)
+
+    def player(self, player_id : int):
+        return self.squad.get(player_id)
+
+    def remember(self, player_id : int, player_gender : str, player_team : int):
+        self.squad[player_id] = (player_gender, player_team)
+
+    def plays(self, player_id : int):
+        return player_id in self.entries
+
+    def is_active(self, player_id : int):
+        return self.entries.get(player_id, False)
+
+    def check_gender_rule(self, new_gender : str, old_gender : str = None):
+        check_gender_rule(self.gender_counts, self.max_gender_players, new_gender, old_gender)
+
+    def add(self, player_id : int, player_active : bool = True):
+        self.entries.setdefault(player_id, False)
+        self._set_active(player_id, player_active)
+
+    def activate(self, player_id : int):
+        self._set_active(player_id, True)
+
+    def deactivate(self, player_id : int):
+        self._set_active(player_id, False)
+
+    def _set_active(self, player_id : int, player_active : bool):
+        was_active = self.entries.get(player_id, False)
+        self.entries[player_id] = player_active
+        if was_active != player_active:
+            player_gender = self.squad[player_id][0]
+            self.gender_counts[player_gender] = self.gender_counts.get(player_gender, 0) + (1 if player_active else -1)
@@ -1,7 +1,21 @@
-from csv import reader
+from os import path
 import sqlite3
+import threading
+import time
 
+from backend.cache import ResponseCache
 from backend.exceptions import DatabaseUnavailableError, InvalidInputError, InvalidQueryError, NoResultError
+from backend.metrics import QueryMetrics
+from backend.passwords import PasswordHasher
+from backend.pubsub import Broker
+from backend.records import record_type
+from sqlite.connection_pool import ConnectionPool
+from sqlite.importer import CHUNK_SIZE, CSV_TABLES, import_rows
+from sqlite.migrations import migrate
+from sqlite.roster import check_gender_rule, MatchRoster
+from sqlite.statements import EVENT_COLUMNS, FILTER_FORMATS, LIST_QUERIES, STATEMENTS, insert_statement, list_statement, statement_name, update_statement
+from sqlite.unit_of_work import UnitOfWork
+from sqlite.writer import WriteQueue
 
 NOTIFICATION_FIELDS = ["notification_id", "notification_title", "notification_description"]
 MATCH_FIELDS = ["match_id", "match_date", "match_start_time", "match_end_time",
@@ -13,283 +27,414 @@ SUBSTITUTION_FIELDS = ["substitution_id", "substitution_match", "substitution_ti
                        "substituted_player", "substituting_player"]
 EVENT_FIELDS = ["event_id", "match_id", "event_player_1", "event_player_2", "event_type", "event_value"]
 MAX_GENDER_PLAYERS = 4
+STREAM_BATCH_SIZE = 500
+# Player_Season_Stats.player_role of the player in event_player_1 and in event_player_2
+STAT_ROLES = {"primary": 1, "secondary": 2}
+LEADERS_LIMIT = 10
+
+# Row shapes of the list reads, in the column order of their statements
+NotificationRecord = record_type("NotificationRecord", NOTIFICATION_FIELDS)
+SeasonRecord = record_type("SeasonRecord", SEASON_FIELDS)
+HighscoreRecord = record_type("HighscoreRecord", ["team_id", "team_name", "team_score"])
+TeamRecord = record_type("TeamRecord", TEAM_FIELDS)
+MatchRecord = record_type("MatchRecord", MATCH_FIELDS)
+SeasonMatchRecord = record_type("SeasonMatchRecord", ["match_id", "match_date", "match_start_time", "match_end_time",
+                                                      "team_a_name", "team_b_name", "team_a_points", "team_b_points"])
+PlayerRecord = record_type("PlayerRecord", PLAYER_FIELDS)
+SubstitutionRecord = record_type("SubstitutionRecord", ["substitution_id", "substitution_time", "substitution_match",
+                                                        "substituted_player", "substituting_player",
+                                                        "substituted_player_name", "substituting_player_name"])
+MatchPlayerRecord = record_type("MatchPlayerRecord", ["match_player_id", "match_player", "match_id", "player_active"])
+RosterRecord = record_type("RosterRecord", ["match_player_id", "match_player", "match_id", "player_active",
+                                            "player_name", "player_gender", "player_team"])
+EventRecord = record_type("EventRecord", EVENT_FIELDS)
+LeaderRecord = record_type("LeaderRecord", ["player_id", "player_name", "team_name", "event_count", "value_total"])
+TeamLeaderRecord = record_type("TeamLeaderRecord", ["team_id", "team_name", "event_count", "value_total"])
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -16 * 1024,
+    # INSERT OR REPLACE has to fire the delete triggers that keep Season_Standings in sync
+    "recursive_triggers": "ON"
+}
+
+def match_topic(match_id):
+    return f"match:{match_id}"
 
 class SqliteContext:
-    def __init__(self, dbpath : str) -> None:
-        self.dbpath = dbpath
+    def __init__(self, pool : ConnectionPool) -> None:
+        self.pool = pool
     
     def __enter__(self):
+        self.conn = self.pool.acquire()
         try:
-            self.conn = sqlite3.connect(self.dbpath)
-            if not self.conn:
-                raise DatabaseUnavailableError("Unable to connect to db, check connection")
             self.cursor = self.conn.cursor()
             return [self.conn, self.cursor]
         except sqlite3.Error as error:
+            self.pool.release(self.conn)
             raise DatabaseUnavailableError(f"Unable to connect to db, error: {error}")
     
     def __exit__(self, type, value, traceback):
         self.cursor.close()
-        self.conn.close()
+        self.pool.release(self.conn)
 
 class SqliteDriver:
-    def __init__(self, dbpath : str) -> None:
+    def __init__(self, dbpath : str, pool_size : int = 5, pool_timeout : float = 5.0,
+                 health_check : bool = True, cached_statements : int = 256, pragmas : dict = None,
+                 single_writer : bool = True, max_write_batch : int = 64, cache_size : int = 1024,
+                 cache_ttl : float = 30.0, stream_buffer : int = 256, login_cache_size : int = 4096,
+                 login_cache_ttl : float = 60.0, password_cost : int = 14, password_workers : int = 2,
+                 query_metrics : bool = True, slow_query_ms : float = None) -> None:
         self.dbpath = dbpath
+        # Time and rows of every statement, and a log of the ones slower than slow_query_ms
+        slow_query_seconds = None if slow_query_ms is None else slow_query_ms / 1000
+        self.queries = QueryMetrics(statement_name, slow_query_seconds) if query_metrics else None
+        self.pool = ConnectionPool(dbpath, pool_size, pool_timeout, health_check, cached_statements,
+                                   {**DEFAULT_PRAGMAS, **(pragmas or {})},
+                                   None if self.queries is None else self.queries.observe_query)
+        self.writer = WriteQueue(self.pool, single_writer, max_write_batch)
+        self.cache = ResponseCache(cache_size, cache_ttl)
+        # Known (and unknown) logins for the token checks, kept apart so responses cannot evict them
+        self.logins = ResponseCache(login_cache_size, login_cache_ttl)
+        self.passwords = PasswordHasher(password_cost, password_workers)
+        self.broker = Broker(stream_buffer)
+        # match_id -> MatchRoster, loaded and changed only inside write jobs
+        self.rosters = {}
+        self._rosters_lock = threading.Lock()
+        # Per-table write counters behind the HTTP ETags. The epoch changes whenever the counters
+        # restart, so tags handed out by an earlier process or schema never match again.
+        self.versions = {}
+        self.version_epoch = format(time.time_ns(), "x")
+        self._versions_lock = threading.Lock()
+
+    def close(self):
+        self.writer.close()
+        self.pool.close()
+        self.passwords.close()
+
+    def metrics(self):
+        # Counters of every component, see /api/metrics
+        return {"pool": self.pool.metrics(), "writer": self.writer.metrics(), "cache": self.cache.metrics(),
+                "logins": self.logins.metrics(), "broker": self.broker.metrics()}
     
     def create_tables(self, script_path : str):
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
             with open(script_path) as create_script:
                 cur.executescript(create_script.read())
             conn.commit()
+            try:
+                migrate(conn)
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while migrating database schema: {error}")
+        with self._versions_lock:
+            self.versions.clear()
+            self.version_epoch = format(time.time_ns(), "x")
+        self.cache.clear()
+        self.logins.clear()
+        self.forget_rosters()
         
     def insert_from_csv(self, table : str, filepath : str, delimiter : str):
+        return self.import_csv(table, filepath, delimiter)
+
+    def import_csv(self, table : str, filepath : str, delimiter : str = ";", chunk_size : int = CHUNK_SIZE,
+                   defer_indexes : bool = False):
+        started_at = time.perf_counter()
         try:
-            with SqliteContext(self.dbpath) as [conn, cur]:
-                with open(filepath, encoding="utf-8") as csv_file:
-                    content = reader(csv_file, delimiter=delimiter)
-                    header = next(content)
-
-                    for row in content:
-                        cur.execute(
-                            f"INSERT OR REPLACE INTO {table} ({','.join(header)}) VALUES ({','.join(row)});"
-                        )
-                    conn.commit()
-        except sqlite3.Error as error:
+            def load(cur):
+                self.forget_rosters()
+                return import_rows(cur, table, filepath, delimiter, chunk_size, defer_indexes)
+            rows = self.writer.run(load)
+        except (sqlite3.Error, ValueError) as error:
             raise InvalidQueryError(f"Sqlite error while adding data from file {filepath} : {error}")
+        self.tables_changed(table)
+        seconds = time.perf_counter() - started_at
+        return {"table": table, "rows": rows, "seconds": seconds, "rows_per_second": rows / seconds if seconds else 0}
+
+    def import_all(self, data_directory : str, delimiter : str = ";", chunk_size : int = CHUNK_SIZE,
+                   defer_indexes : bool = False):
+        results = []
+        for table, filename in CSV_TABLES:
+            filepath = path.join(data_directory, filename)
+            if path.exists(filepath):
+                results.append(self.import_csv(table, filepath, delimiter, chunk_size, defer_indexes))
+        return results
     
     def add_mock_data(self, data_directory : str):
-        self.insert_from_csv("Seasons", f"{data_directory}/seasons.csv", ";")
-        self.insert_from_csv("Teams", f"{data_directory}/teams.csv", ";")
-        self.insert_from_csv("Matches", f"{data_directory}/matches.csv", ";")
-        self.insert_from_csv("Notifications", f"{data_directory}/notifications.csv", ";")
-        self.insert_from_csv("Players", f"{data_directory}/players.csv", ";")
-        self.insert_from_csv("Match_Players", f"{data_directory}/match_players.csv", ";")
+        return self.import_all(data_directory)
     
     def get_insert_query(self, table : str, data : dict):
-        insert_query = f"INSERT INTO {table} ("
-        for key in data:
-            insert_query += f"{key}, "
-        insert_query = insert_query[:-2] + ") VALUES ("
-        for value in data.values():
-            if value is None:
-                insert_query += "NULL, "
-            else:
-                insert_query += f"'{value}', " if type(value) == str else f"{value}, "
-        insert_query = insert_query[:-2] + ")"
-        return insert_query
+        return insert_statement(table, tuple(data)), tuple(data.values())
     
     def get_update_query(self, table : str, data : dict, target_name : str, target_value):
-        update_query = f"UPDATE {table} SET "
-        for key in data:
-            update_query += f"{key} = "
-            if data[key] is None:
-                update_query += "NULL, "
-            else:
-                update_query += f"'{data[key]}', " if type(data[key]) == str else f"{data[key]}, "
-        update_query = update_query[:-2] + f" WHERE {target_name} = {target_value}"
-        return update_query
+        return update_statement(table, tuple(data), target_name), (*data.values(), target_value)
     
+    def tables_changed(self, *tables : str):
+        with self._versions_lock:
+            for table in tables:
+                self.versions[table] = self.versions.get(table, 0) + 1
+        self.cache.invalidate(*tables)
+        if "Users" in tables:
+            self.logins.invalidate("Users")
+
+    def version_tag(self, *tables : str):
+        with self._versions_lock:
+            return "-".join([self.version_epoch, *(str(self.versions.get(table, 0)) for table in tables)])
+
     def input_valid(self, allowed_fields : list, input_data : dict):
         for key in input_data:
             if key not in allowed_fields:
                 raise InvalidInputError(f"Illegal field in input data: {key}")
         return True
 
+    def list_query(self, statement : str, query : dict = None):
+        # Turns list arguments into a statement and its params: "limit", "after" (the last key of
+        # the previous page) and the filters LIST_QUERIES allows for the statement.
+        if not query:
+            return STATEMENTS[statement], ()
+        conditions = LIST_QUERIES[statement][1]
+        filters, params = [], []
+        for field in sorted(query):
+            if field in ("limit", "after"):
+                continue
+            if field not in conditions:
+                raise InvalidInputError(f"Illegal filter in query: {field}")
+            if field in FILTER_FORMATS and not FILTER_FORMATS[field].match(str(query[field])):
+                raise InvalidInputError(f"Illegal value of {field}: {query[field]}")
+            filters.append(field)
+            params.extend([query[field]] * conditions[field].count("?"))
+        after, limit = self.page_bound(query, "after"), self.page_bound(query, "limit")
+        if after is not None:
+            params.append(after)
+        if limit is not None:
+            params.append(limit)
+        return list_statement(statement, tuple(filters), after is not None, limit is not None), tuple(params)
+
+    def page_bound(self, query : dict, name : str):
+        value = query.get(name)
+        if value is None:
+            return None
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise InvalidInputError(f"Illegal value of {name}: {value}")
+        if name == "limit" and value < 1:
+            raise InvalidInputError(f"Illegal value of {name}: {value}")
+        return value
+
+    def stream_rows(self, statement : str, record, query : dict = None, batch_size : int = STREAM_BATCH_SIZE):
+        # Yields lists of records one keyset page at a time, so only one batch is in memory. Every
+        # page is read on a connection of its own, so a slow download holds neither a pooled
+        # connection nor a read transaction (which would stall WAL checkpoints) between batches.
+        query = dict(query or {})
+        key = LIST_QUERIES[statement][0].split(".")[-1]
+        remaining = self.page_bound(query, "limit")
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            page, params = self.list_query(statement, {**query, "limit": size})
+            with SqliteContext(self.pool) as [conn, cur]:
+                try:
+                    rows = cur.execute(page, params).fetchall()
+                except sqlite3.Error as error:
+                    raise InvalidQueryError(f"Error while streaming rows: {error}")
+            if not rows:
+                return
+            yield [record(row) for row in rows]
+            if len(rows) < size:
+                return
+            if remaining is not None:
+                remaining -= len(rows)
+            query["after"] = record(rows[-1])[key]
+
+    def iter_events(self, query : dict = None, batch_size : int = STREAM_BATCH_SIZE):
+        # Checked here, so illegal filters fail before the stream starts
+        self.list_query("get_events", query)
+        return self.stream_rows("get_events", EventRecord, query, batch_size)
+
+    def iter_matches(self, query : dict = None, batch_size : int = STREAM_BATCH_SIZE):
+        self.list_query("get_matches", query)
+        return self.stream_rows("get_matches", MatchRecord, query, batch_size)
+
     def get_notifications(self):
         rows = []
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute("SELECT notification_id, notification_title, notification_description FROM Notifications")
+                cur.execute(STATEMENTS["get_notifications"])
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while fetching notifications: {error}")
-            rows = [
-                {
-                    "notification_id": entry[0],
-                    "notification_title": entry[1],
-                    "notification_description": entry[2]
-                } for entry in cur.fetchall()
-            ]
+            rows = [NotificationRecord(entry) for entry in cur.fetchall()]
         return rows
 
     def add_notification(self, notification_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            if self.input_valid(NOTIFICATION_FIELDS, notification_data):
-                try:
-                    cur.execute(self.get_insert_query("Notifications", notification_data))
-                    conn.commit()
-                except sqlite3.Error as error:
-                    raise InvalidQueryError(f"Error while adding notification: {error}")
-                return True 
+        if self.input_valid(NOTIFICATION_FIELDS, notification_data):
+            try:
+                self.writer.execute(*self.get_insert_query("Notifications", notification_data))
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while adding notification: {error}")
+            self.tables_changed("Notifications")
+            return True 
         return False
 
     def edit_notification(self, notification_id : int, notification_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            if self.input_valid(NOTIFICATION_FIELDS, notification_data):
-                if "notification_id" in notification_data:
-                    del notification_data["notification_id"]
-                try:
-                    cur.execute(self.get_update_query("Notifications", notification_data,
-                                                      "notification_id", notification_id))
-                    conn.commit()
-                except sqlite3.Error as error:
-                    raise InvalidQueryError(f"Error while editing notification: {error}")
-                return True
+        if self.input_valid(NOTIFICATION_FIELDS, notification_data):
+            if "notification_id" in notification_data:
+                del notification_data["notification_id"]
+            try:
+                self.writer.execute(*self.get_update_query("Notifications", notification_data,
+                                                           "notification_id", notification_id))
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while editing notification: {error}")
+            self.tables_changed("Notifications")
+            return True
         return False
     
     def delete_notification(self, notification_id : int):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                cur.execute(f"DELETE FROM Notifications WHERE notification_id = {notification_id}")
-                conn.commit()
-                return True
-            except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while deleting notification: {error}")
+        try:
+            self.writer.execute(STATEMENTS["delete_notification"], (notification_id,))
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while deleting notification: {error}")
+        self.tables_changed("Notifications")
+        return True
 
     def get_seasons(self):
+        return self.cache.get_or_load(("get_seasons",), ("Seasons",), self._get_seasons)
+
+    def _get_seasons(self):
         rows = []
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute("SELECT * FROM Seasons")
+                cur.execute(STATEMENTS["get_seasons"])
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while fetching seasons: {error}")
-            rows = [
-                {
-                    "season_id": entry[0],
-                    "season_title": entry[1],
-                    "season_start_date": entry[2],
-                    "season_end_date": entry[3]
-                } for entry in cur.fetchall()
-            ]
+            rows = [SeasonRecord(entry) for entry in cur.fetchall()]
         return rows
 
     def add_season(self, season_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            if self.input_valid(SEASON_FIELDS, season_data):
-                try:
-                    cur.execute(self.get_insert_query("Seasons", season_data))
-                    conn.commit()
-                except sqlite3.Error as error:
-                    raise InvalidQueryError(f"Error while adding new season: {error}")
-                return True
+        if self.input_valid(SEASON_FIELDS, season_data):
+            try:
+                self.writer.execute(*self.get_insert_query("Seasons", season_data))
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while adding new season: {error}")
+            self.tables_changed("Seasons")
+            return True
         return False
 
     def edit_season(self, season_id, season_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            if self.input_valid(SEASON_FIELDS, season_data):
-                if "season_id" in season_data:
-                    del season_data["season_id"]
-                try:
-                    cur.execute(self.get_update_query("Seasons", season_data, "season_id", season_id))
-                    conn.commit()
-                except sqlite3.Error as error:
-                    raise InvalidQueryError(f"Error while editing season: {error}")
-                return True
-        return False
-    
-    def delete_season(self, season_id):
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        if self.input_valid(SEASON_FIELDS, season_data):
+            if "season_id" in season_data:
+                del season_data["season_id"]
             try:
-                cur.execute(f"DELETE FROM Seasons WHERE season_id = {season_id}")
-                conn.commit()
+                self.writer.execute(*self.get_update_query("Seasons", season_data, "season_id", season_id))
             except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while deleting season: {error}")
+                raise InvalidQueryError(f"Error while editing season: {error}")
+            self.tables_changed("Seasons")
             return True
+        return False
+    
+    def delete_season(self, season_id):
+        try:
+            self.writer.execute(STATEMENTS["delete_season"], (season_id,))
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while deleting season: {error}")
+        self.tables_changed("Seasons")
+        return True
 
     def get_season_highscore(self, season_id : int):
         rows = []
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute((f"SELECT team_id, team_name, SUM(points) AS highscore FROM ("
-                            f"SELECT t.team_id AS team_id, t.team_name as team_name, m.team_a_points as points "
-                            f"FROM Matches m, Teams t WHERE m.match_season = {season_id} AND t.team_id = m.team_a_id"
-                            f" UNION ALL "
-                            f"SELECT t.team_id AS team_id, t.team_name as team_name, m.team_b_points as points "
-                            f"FROM Matches m, Teams t WHERE m.match_season = {season_id} AND t.team_id = m.team_b_id"
-                            f") GROUP BY team_name ORDER BY highscore DESC"))
+                cur.execute(STATEMENTS["get_season_highscore"], (season_id,))
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while getting season highscore: {error}")
-            rows = [{"team_id": entry[0], "team_name": entry[1], "team_score": entry[2]} for entry in cur.fetchall()]
+            rows = [HighscoreRecord(entry) for entry in cur.fetchall()]
         return rows
 
+    def get_season_leaders(self, season_id : int, query : dict = None):
+        query = dict(query or {})
+        limit = self.page_bound(query, "limit") or LEADERS_LIMIT
+        query.pop("limit", None)
+        event_type = query.pop("event_type", "goal")
+        role = query.pop("role", "primary")
+        if role not in STAT_ROLES:
+            raise InvalidInputError(f"Illegal value of role: {role}")
+        if query:
+            raise InvalidInputError(f"Illegal filter in query: {next(iter(query))}")
+        params = (season_id, event_type, STAT_ROLES[role])
+        return self.cache.get_or_load(("get_season_leaders", str(season_id), event_type, role, limit),
+                                      ("Events", "Matches", "Players", "Teams"),
+                                      lambda: self._get_season_leaders(params, limit))
+
+    def _get_season_leaders(self, params : tuple, limit : int):
+        with SqliteContext(self.pool) as [conn, cur]:
+            try:
+                players = [LeaderRecord(row) for row in
+                           cur.execute(STATEMENTS["get_season_leaders"], params + (limit,)).fetchall()]
+                teams = [TeamLeaderRecord(row) for row in
+                         cur.execute(STATEMENTS["get_season_team_leaders"], params).fetchall()]
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while getting season leaders: {error}")
+        return {"season_id": params[0], "event_type": params[1], "players": players, "teams": teams}
+
     def get_teams(self):
+        return self.cache.get_or_load(("get_teams",), ("Teams",), self._get_teams)
+
+    def _get_teams(self):
         rows = []
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute("SELECT team_id, team_name FROM Teams")
+                cur.execute(STATEMENTS["get_teams"])
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while getting teams: {error}")
-            rows = [
-                {
-                    "team_id": entry[0],
-                    "team_name": entry[1]
-                } for entry in cur.fetchall()
-            ]
+            rows = [TeamRecord(entry) for entry in cur.fetchall()]
         return rows
     
     def add_team(self, team_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            if self.input_valid(TEAM_FIELDS, team_data):
-                try:
-                    cur.execute(self.get_insert_query("Teams", team_data))
-                    conn.commit()
-                except sqlite3.Error as error:
-                    raise InvalidQueryError(f"Error while adding new team: {error}")
-                return True
+        if self.input_valid(TEAM_FIELDS, team_data):
+            try:
+                self.writer.execute(*self.get_insert_query("Teams", team_data))
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while adding new team: {error}")
+            self.tables_changed("Teams")
+            return True
         return False
     
     def edit_team(self, team_id : int, team_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            if self.input_valid(TEAM_FIELDS, team_data):
-                if "team_id" in team_data:
-                    del team_data["team_id"]
-                try:
-                    cur.execute(self.get_update_query("Teams", team_data, "team_id", team_id))
-                    conn.commit()
-                except sqlite3.Error as error:
-                    raise InvalidQueryError(f"Error while editing team: {error}")
-                return True
-        return False
-    
-    def delete_team(self, team_id : int):
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        if self.input_valid(TEAM_FIELDS, team_data):
+            if "team_id" in team_data:
+                del team_data["team_id"]
             try:
-                cur.execute(f"DELETE FROM Teams WHERE team_id = {team_id}")
-                conn.commit()
+                self.writer.execute(*self.get_update_query("Teams", team_data, "team_id", team_id))
             except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while deleting team: {error}")
+                raise InvalidQueryError(f"Error while editing team: {error}")
+            self.tables_changed("Teams")
             return True
+        return False
+    
+    def delete_team(self, team_id : int):
+        try:
+            self.writer.execute(STATEMENTS["delete_team"], (team_id,))
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while deleting team: {error}")
+        self.tables_changed("Teams")
+        return True
 
-    def get_matches(self):
+    def get_matches(self, query : dict = None):
+        statement, params = self.list_query("get_matches", query)
         rows = []
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute("SELECT * FROM Matches")
+                cur.execute(statement, params)
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while getting matches: {error}")
-            rows = [
-                {
-                    "match_id": entry[0],
-                    "match_date": entry[1],
-                    "match_start_time": entry[2],
-                    "match_end_time": entry[3],
-                    "match_season": entry[4],
-                    "team_a_id": entry[5],
-                    "team_b_id": entry[6],
-                    "team_a_points": entry[7],
-                    "team_b_points": entry[8]
-                } for entry in cur.fetchall()
-            ]
+            rows = [MatchRecord(entry) for entry in cur.fetchall()]
         return rows
 
     def get_match(self, match_id : int):
         result = {}
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute(f"SELECT " 
-                            f"m.match_id, m.match_date, m.match_start_time, m.match_end_time, m.team_a_id,"
-                            f"t1.team_name, m.team_b_id, t2.team_name, m.team_a_points, m.team_b_points "
-                            f"FROM Matches m, Teams t1, Teams t2 "
-                            f"WHERE m.match_id = {match_id} AND m.team_a_id = t1.team_id AND m.team_b_id = t2.team_id")
+                cur.execute(STATEMENTS["get_match"], (match_id,))
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while getting a match: {error}")
             row = cur.fetchall()
@@ -308,90 +453,99 @@ class SqliteDriver:
                     }
         return result
 
+    def get_match_snapshot(self, match_id : int):
+        # Everything the match views show, read in one transaction. The nested reads reuse this
+        # thread's pooled connection, so under WAL they all see the same state of the database.
+        with SqliteContext(self.pool) as [conn, cur]:
+            try:
+                if not conn.in_transaction:
+                    cur.execute("BEGIN")
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while opening match {match_id} snapshot: {error}")
+            match = self.get_match(match_id)
+            if not match:
+                raise NoResultError(f"Match {match_id} does not exist.")
+            return {
+                "match": match,
+                "teams": [TeamRecord((match["team_a_id"], match["team_a_name"])),
+                          TeamRecord((match["team_b_id"], match["team_b_name"]))],
+                "roster": self.get_match_roster(match_id),
+                "events": self.get_match_events(match_id),
+                "substitutions": self.get_match_substitutions(match_id)
+            }
+
     def get_season_matches(self, season_id : int):
+        return self.cache.get_or_load(("get_season_matches", str(season_id)), ("Matches", "Teams"),
+                                      lambda: self._get_season_matches(season_id))
+
+    def _get_season_matches(self, season_id : int):
         rows = []
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute(f"SELECT " 
-                            f"m.match_id, m.match_date, m.match_start_time, m.match_end_time, t1.team_name,"
-                            f"t2.team_name, m.team_a_points, m.team_b_points "
-                            f"FROM Matches m, Teams t1, Teams t2 "
-                            f"WHERE m.match_season = {season_id} AND m.team_a_id = t1.team_id "
-                            f"AND m.team_b_id = t2.team_id")
+                cur.execute(STATEMENTS["get_season_matches"], (season_id,))
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while getting season matches: {error}")
-            rows = [{
-                "match_id": entry[0],
-                "match_date": entry[1],
-                "match_start_time": entry[2],
-                "match_end_time": entry[3],
-                "team_a_name": entry[4],
-                "team_b_name": entry[5],
-                "team_a_points": entry[6],
-                "team_b_points": entry[7]} for entry in cur.fetchall()]
+            rows = [SeasonMatchRecord(entry) for entry in cur.fetchall()]
         return rows
 
     def add_match(self, match_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            if self.input_valid(MATCH_FIELDS, match_data):
-                if "match_id" in match_data:
-                    del match_data["match_id"]
-                try:
-                    cur.execute(self.get_insert_query("Matches", match_data))
-                    conn.commit()
-                    cur.execute("SELECT match_id FROM Matches ORDER BY match_id LIMIT 1")
-                    res = cur.fetchall()
-                    if len(res) > 0:
-                        return self.get_match(res[0][0])
-                except sqlite3.Error as error:
-                    raise InvalidQueryError(f"Error while adding new match: {error}")
+        if self.input_valid(MATCH_FIELDS, match_data):
+            if "match_id" in match_data:
+                del match_data["match_id"]
+            try:
+                match_id = self.writer.execute(*self.get_insert_query("Matches", match_data))
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while adding new match: {error}")
+            self.tables_changed("Matches")
+            return self.get_match(match_id)
         return {}
     
+
     def edit_match(self, match_id : int, match_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            if self.input_valid(MATCH_FIELDS, match_data):
-                if "match_id" in match_data:
-                    del match_data["match_id"]
-                try:
-                    cur.execute(self.get_update_query("Matches", match_data, "match_id", match_id))
-                    conn.commit()
-                except sqlite3.Error as error:
-                    raise InvalidQueryError(f"Error while editing match: {error}")
-                return True
-        return False
-    
-    def delete_match(self, match_id : int):
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        if self.input_valid(MATCH_FIELDS, match_data):
+            if "match_id" in match_data:
+                del match_data["match_id"]
             try:
-                cur.execute(f"DELETE FROM Matches WHERE match_id = {match_id}")
-                conn.commit()
+                if "team_a_id" in match_data or "team_b_id" in match_data:
+                    self.roster_write(match_id, *self.get_update_query("Matches", match_data, "match_id", match_id))
+                else:
+                    self.writer.execute(*self.get_update_query("Matches", match_data, "match_id", match_id))
             except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while deleting match: {error}")
+                raise InvalidQueryError(f"Error while editing match: {error}")
+            self.tables_changed("Matches")
+            if self.broker.has_subscribers(match_topic(match_id)):
+                self.broker.publish(match_topic(match_id), "match", self.get_match(match_id))
             return True
+        return False
+    
+    def delete_match(self, match_id : int):
+        try:
+            self.roster_write(match_id, STATEMENTS["delete_match"], (match_id,))
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while deleting match: {error}")
+        self.tables_changed("Matches")
+        return True
+
+    def get_players(self, query : dict = None):
+        statement, params = self.list_query("get_players", query)
+        return self.cache.get_or_load(("get_players", statement, params), ("Players", "Teams"),
+                                      lambda: self._get_players(statement, params))
 
-    def get_players(self):
+    def _get_players(self, statement : str, params : tuple):
         rows = []
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                cur.execute("SELECT p.player_id, p.player_name, p.player_gender, t.team_name FROM Players p,"
-                            " Teams t WHERE p.player_team = t.team_id")
-                rows = [{
-                    "player_id": entry[0],
-                    "player_name": entry[1],
-                    "player_gender": entry[2],
-                    "player_team": entry[3]
-                    } for entry in cur.fetchall()
-                ]
+        with SqliteContext(self.pool) as [conn, cur]:
+            try:
+                cur.execute(statement, params)
+                rows = [PlayerRecord(entry) for entry in cur.fetchall()]
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while fetching players: {error}")
         return rows
 
     def get_player(self, player_id : int):
         response = {}
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute(f"SELECT p.player_id, p.player_name, p.player_gender, t.team_name FROM Players p, "
-                            f"Teams t WHERE p.player_team = t.team_id AND p.player_id = {player_id}")
+                cur.execute(STATEMENTS["get_player"], (player_id,))
                 row = cur.fetchall()
                 response = {
                     "player_id": row[0][0],
@@ -406,90 +560,108 @@ class SqliteDriver:
         return response
 
     def add_player(self, player_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            if self.input_valid(PLAYER_FIELDS, player_data):
-                if "player_gender" in player_data:
-                    if player_data["player_gender"] not in ["Male", "Female", "Nonbinary"]:
-                        raise InvalidInputError("Not allowed gender provided.")
-                try:
-                    cur.execute(self.get_insert_query("Players", player_data))
-                    conn.commit()
-                except sqlite3.Error as error:
-                    raise InvalidQueryError(f"Error while adding new player: {error}")
-                return True
+        if self.input_valid(PLAYER_FIELDS, player_data):
+            if "player_gender" in player_data:
+                if player_data["player_gender"] not in ["Male", "Female", "Nonbinary"]:
+                    raise InvalidInputError("Not allowed gender provided.")
+            try:
+                self.writer.execute(*self.get_insert_query("Players", player_data))
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while adding new player: {error}")
+            self.tables_changed("Players")
+            return True
         return False
     
     def edit_player(self, player_id : int, player_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            if self.input_valid(PLAYER_FIELDS, player_data):
-                if "player_id" in player_data:
-                    del player_data["player_id"]
-                if "gender" in player_data:
-                    if player_data["gender"] not in ["Male", "Female", "Nonbinary"]:
-                        raise InvalidInputError("Not allowed gender provided.")
-                try:
-                    cur.execute(self.get_update_query("Players", player_data, "player_id", player_id))
-                    conn.commit()
-                except sqlite3.Error as error:
-                    raise InvalidQueryError(f"Error while editing player: {error}")
-                return True
+        if self.input_valid(PLAYER_FIELDS, player_data):
+            if "player_id" in player_data:
+                del player_data["player_id"]
+            if "gender" in player_data:
+                if player_data["gender"] not in ["Male", "Female", "Nonbinary"]:
+                    raise InvalidInputError("Not allowed gender provided.")
+            try:
+                self.roster_write(None, *self.get_update_query("Players", player_data, "player_id", player_id))
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while editing player: {error}")
+            self.tables_changed("Players")
+            return True
         return False
 
     def delete_player(self, player_id : int):
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        try:
+            self.roster_write(None, STATEMENTS["delete_player"], (player_id,))
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while deleting player: {error}")
+        self.tables_changed("Players")
+        return True
+
+    def get_player_stats(self, player_id : int, query : dict = None):
+        query = dict(query or {})
+        season_id = query.pop("season", None)
+        if query:
+            raise InvalidInputError(f"Illegal filter in query: {next(iter(query))}")
+        return self.cache.get_or_load(("get_player_stats", str(player_id), season_id), ("Events", "Matches", "Players"),
+                                      lambda: self._get_player_stats(player_id, season_id))
+
+    def _get_player_stats(self, player_id : int, season_id : int = None):
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute(f"DELETE FROM Players WHERE player_id = {player_id}")
-                conn.commit()
+                if cur.execute(STATEMENTS["get_player_pair"], (player_id, player_id)).fetchone() is None:
+                    raise NoResultError(f"Player {player_id} does not exist.")
+                season_rows = cur.execute(STATEMENTS["get_player_season_stats"], (player_id,)).fetchall()
+                match_rows = []
+                if season_id is not None:
+                    match_rows = cur.execute(STATEMENTS["get_player_match_stats"],
+                                             (player_id, season_id, player_id, season_id)).fetchall()
             except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while deleting player: {error}")
-            return True
-    
-    def get_substitutions(self):
+                raise InvalidQueryError(f"Error while getting player {player_id} stats: {error}")
+        # Totals per role and event type, overall and per season. The per match breakdown reads
+        # events, so it is only built for the season asked for.
+        stats = {"player_id": player_id, "goals": 0, "assists": 0, "totals": {}, "seasons": {}}
+        for season, event_type, role, event_count, value_total in season_rows:
+            for scope in (stats["totals"], stats["seasons"].setdefault(season, {})):
+                self.add_stats(scope, role, event_type, event_count, value_total)
+        if season_id is not None:
+            stats["matches"] = {}
+            for match_id, event_type, role, event_count, value_total in match_rows:
+                self.add_stats(stats["matches"].setdefault(match_id, {}), role, event_type, event_count, value_total)
+        primary = stats["totals"].get("primary", {})
+        stats["goals"] = primary.get("goal", {}).get("count", 0)
+        stats["assists"] = primary.get("assist", {}).get("count", 0)
+        return stats
+
+    def add_stats(self, scope : dict, role : int, event_type : str, event_count : int, value_total : int):
+        role_name = "primary" if role == STAT_ROLES["primary"] else "secondary"
+        totals = scope.setdefault(role_name, {}).setdefault(event_type, {"count": 0, "value": 0})
+        totals["count"] += event_count
+        totals["value"] += value_total
+
+    def get_substitutions(self, query : dict = None):
+        statement, params = self.list_query("get_substitutions", query)
         rows = []
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                cur.execute("SELECT s.*, p1.player_name, p2.player_name FROM Substitutions s, Players p1, Players p2"
-                            " WHERE s.substituted_player = p1.player_id AND s.substituting_player = p2.player_id")
-                rows = [{
-                    "substitution_id": entry[0],
-                    "substitution_time": entry[1],
-                    "substitution_match": entry[2],
-                    "substituted_player": entry[3],
-                    "substituting_player": entry[4],
-                    "substituted_player_name": entry[5],
-                    "substituting_player_name": entry[6]   
-                } for entry in cur.fetchall()]
+        with SqliteContext(self.pool) as [conn, cur]:
+            try:
+                cur.execute(statement, params)
+                rows = [SubstitutionRecord(entry) for entry in cur.fetchall()]
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while fetching substitutions: {error}")
         return rows
     
     def get_match_substitutions(self, match_id : int):
         rows = []
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                cur.execute(f"SELECT s.*, p1.player_name, p2.player_name FROM Substitutions s, Players p1, Players p2"
-                            f" WHERE s.substituted_player = p1.player_id AND s.substituting_player = p2.player_id"
-                            f" AND s.substitution_match = {match_id}")
-                rows = [{
-                    "substitution_id": entry[0],
-                    "substitution_time": entry[1],
-                    "substitution_match": entry[2],
-                    "substituted_player": entry[3],
-                    "substituting_player": entry[4],
-                    "substituted_player_name": entry[5],
-                    "substituting_player_name": entry[6]   
-                } for entry in cur.fetchall()]
+        with SqliteContext(self.pool) as [conn, cur]:
+            try:
+                cur.execute(STATEMENTS["get_match_substitutions"], (match_id,))
+                rows = [SubstitutionRecord(entry) for entry in cur.fetchall()]
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while fetching substitutions for match {match_id}: {error}")
         return rows
         
     def get_substitution(self, substitution_id : int):
         result = {}
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute(f"SELECT s.*, p1.player_name, p2.player_name FROM Substitutions s, Players p1, Players p2"
-                            f" WHERE s.substituted_player = p1.player_id AND s.substituting_player = p2.player_id"
-                            f" AND s.substitution_id = {substitution_id}")
+                cur.execute(STATEMENTS["get_substitution"], (substitution_id,))
                 row = cur.fetchall()
                 result = {
                     "substitution_id": row[0][0],
@@ -508,149 +680,227 @@ class SqliteDriver:
     
     def get_match_players(self, match_id : int):
         rows = []
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute(f"SELECT * FROM Match_Players WHERE match_id = {match_id}")
-                rows = [{
-                    "match_player_id": entry[0],
-                    "match_player": entry[1],
-                    "match_id": entry[2],
-                    "player_active": True if entry[3] == 1 else False
-                } for entry in cur.fetchall()]
+                cur.execute(STATEMENTS["get_match_players"], (match_id,))
+                rows = [MatchPlayerRecord((*entry[:3], entry[3] == 1)) for entry in cur.fetchall()]
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while fetching players for match {match_id} : {error}")
         return rows
     
-    def check_gender_ratio(self, match_id : int, player_id : int, old_player_id = None):
-        player_data = self.get_player(player_id)
-        gender_ratio = {"Male": 0, "Female": 0, "Nonbinary": 0}
+    def get_match_roster(self, match_id : int):
+        # Match_Players entries together with the details of their players, in one query
+        rows = []
+        with SqliteContext(self.pool) as [conn, cur]:
+            try:
+                cur.execute(STATEMENTS["get_match_roster"], (match_id,))
+                rows = [RosterRecord((*entry[:3], entry[3] == 1, *entry[4:])) for entry in cur.fetchall()]
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while fetching roster of match {match_id}: {error}")
+        return rows
+
+    def transaction(self, func):
+        # Runs func(UnitOfWork) as one write job: one connection, one BEGIN IMMEDIATE transaction
+        return self.writer.run(lambda cur: func(UnitOfWork(cur)))
+
+    def roster_transaction(self, match_id, func):
+        # func(UnitOfWork, MatchRoster) may change the roster while it writes. Input errors must be
+        # raised before func changes the roster, any other failure drops the roster and the next
+        # job reloads it from what was committed.
+        def job(uow):
+            return func(uow, self._roster(uow, match_id))
+        try:
+            return self.transaction(job)
+        except (InvalidInputError, NoResultError):
+            raise
+        except BaseException:
+            self.forget_rosters(match_id)
+            raise
+
+    def _roster(self, uow : UnitOfWork, match_id):
+        with self._rosters_lock:
+            roster = self.rosters.get(str(match_id))
+        if roster is None:
+            roster = uow.load_roster(match_id, MAX_GENDER_PLAYERS)
+            with self._rosters_lock:
+                self.rosters[str(match_id)] = roster
+        return roster
 
-        if old_player_id is not None:
-            old_player = self.get_player(old_player_id)
-            gender_ratio[old_player["player_gender"]] -= 1
-        gender_ratio[player_data["player_gender"]] += 1
+    def _roster_player(self, uow : UnitOfWork, roster : MatchRoster, player_id : int):
+        player = roster.player(player_id)
+        if player is None:
+            player = uow.players(player_id)[player_id]
+            roster.remember(player_id, *player)
+        return player
+
+    def roster_write(self, match_id, query : str, params : tuple = ()):
+        # A write that changes rosters outside of roster_transaction drops them in the same job,
+        # so no later job validates against the old state. match_id None drops every roster.
+        def write(uow):
+            self.forget_rosters(match_id)
+            return uow.execute(query, params).lastrowid
+        return self.transaction(write)
+
+    def forget_rosters(self, match_id = None):
+        with self._rosters_lock:
+            if match_id is None:
+                self.rosters.clear()
+            else:
+                self.rosters.pop(str(match_id), None)
+
+    def check_gender_ratio(self, match_id : int, player_id : int, old_player_id = None):
+        with self._rosters_lock:
+            roster = self.rosters.get(str(match_id))
+        if roster is not None:
+            # Reads only, rosters are changed by write jobs
+            with SqliteContext(self.pool) as [conn, cur]:
+                try:
+                    new_gender = self._roster_player(UnitOfWork(cur), roster, player_id)[0]
+                    old_gender = (None if old_player_id is None
+                                  else self._roster_player(UnitOfWork(cur), roster, old_player_id)[0])
+                except sqlite3.Error as error:
+                    raise InvalidQueryError(f"Error while fetching gender ratio: {error}")
+            roster.check_gender_rule(new_gender, old_gender)
+            return
 
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
+            uow = UnitOfWork(cur)
             try:
-                cur.execute(f"SELECT p.player_gender FROM Match_Players mp, Players p WHERE mp.match_id"
-                            f" = {match_id} AND mp.match_player_id = p.player_id AND mp.player_active = 1")
-                for row in cur.fetchall():
-                    gender_ratio[row[0]] += 1
+                if old_player_id is None:
+                    players = uow.players(player_id)
+                else:
+                    players = uow.players(player_id, old_player_id)
+                gender_counts = uow.active_genders(match_id)
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while fetching gender ratio: {error}")
-        
-        if any(gender > MAX_GENDER_PLAYERS for gender in gender_ratio.values()):
-            raise InvalidInputError("Gender rule broken!")
-        
+        check_gender_rule(gender_counts, MAX_GENDER_PLAYERS, players[player_id][0],
+                          None if old_player_id is None else players[old_player_id][0])
+
     def check_players_same_team(self, old_player : int, new_player : int):
-        old_player_data = self.get_player(old_player)
-        new_player_data = self.get_player(new_player)
-        if old_player_data["player_team"] != new_player_data["player_team"]:
+        with SqliteContext(self.pool) as [conn, cur]:
+            try:
+                players = UnitOfWork(cur).players(old_player, new_player)
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while fetching players: {error}")
+        if players[old_player][1] != players[new_player][1]:
             raise InvalidInputError("Players are not in the same team!")
         return True
-    
+
+    def _substitute(self, uow : UnitOfWork, roster : MatchRoster, old_player : int, new_player : int):
+        old_gender, old_team = self._roster_player(uow, roster, old_player)
+        new_gender, new_team = self._roster_player(uow, roster, new_player)
+        if old_team != new_team:
+            raise InvalidInputError("Players are not in the same team!")
+        if not roster.plays(old_player):
+            raise InvalidInputError(f"Player {old_player} does not play in this match!")
+        if not roster.is_active(old_player):
+            raise InvalidInputError("Substituted player is inactive!")
+        if roster.is_active(new_player):
+            raise InvalidInputError("Substituting player is already active!")
+        roster.check_gender_rule(new_gender, old_gender)
+
+        uow.execute(STATEMENTS["deactivate_match_player"], (roster.match_id, old_player))
+        roster.deactivate(old_player)
+        if roster.plays(new_player):
+            uow.execute(STATEMENTS["activate_match_player"], (roster.match_id, new_player))
+            roster.activate(new_player)
+        else:
+            uow.execute(STATEMENTS["insert_match_player"], (new_player, roster.match_id, 1))
+            roster.add(new_player)
+
     def substitute_player(self, match_id : int, old_player : int, new_player : int):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                self.check_players_same_team(old_player, new_player)
-                players = self.get_match_players(match_id)
-                old_player_detected = False
-                new_player_detected = False
-                for player in players:
-                    if player["match_player"] == old_player:
-                        if player["player_active"] == False:
-                            raise InvalidInputError("Substituted player is inactive!")
-                        old_player_detected = True
-                    if player["match_player"] == new_player:
-                        if player["player_active"] == True:
-                            raise InvalidInputError("Substituting player is already active!")
-                        new_player_detected = True
-
-                if not old_player_detected:
-                    raise InvalidInputError(f"Player {old_player} does not play in this match!")
-                cur.execute(f"UPDATE Match_Players SET player_active = 0 WHERE "
-                            f"match_id = {match_id} AND match_player = {old_player}")
-                
-                if not new_player_detected:
-                    self.check_gender_ratio(match_id, new_player, old_player)
-                    cur.execute(f"INSERT INTO Match_Players(match_player, match_id, player_active)"
-                                f"VALUES ({new_player}, {match_id}, 1)")
-                else:
-                    cur.execute(f"UPDATE Match_Players SET player_active = 1 WHERE "
-                                f"match_id = {match_id} AND match_player = {new_player}")
-                    
-                conn.commit()
-            except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while changing match {match_id} players: {error}")
-    
+        try:
+            self.roster_transaction(match_id, lambda uow, roster: self._substitute(uow, roster, old_player, new_player))
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while changing match {match_id} players: {error}")
+        self.tables_changed("Match_Players")
+
     def add_substitution(self, match_id : int, substitution_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                self.substitute_player(match_id, substitution_data["substituted_player"],
-                                       substitution_data["substituting_player"])
-                substitution_data["substitution_match"] = match_id
-                cur.execute(self.get_insert_query("Substitutions", substitution_data))
-                conn.commit()
-            except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while adding new player: {error}")
+        substitution_data["substitution_match"] = match_id
+        # Built before the roster changes, an illegal field fails without touching it
+        query = self.get_insert_query("Substitutions", substitution_data)
+
+        def substitute(uow, roster):
+            self._substitute(uow, roster, substitution_data["substituted_player"],
+                             substitution_data["substituting_player"])
+            uow.execute(*query)
+        try:
+            self.roster_transaction(match_id, substitute)
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while adding new player: {error}")
+        self.tables_changed("Substitutions", "Match_Players")
+        self.broker.publish(match_topic(match_id), "substitution", substitution_data)
         return True
-    
+
     def edit_substitution(self, substitution_id : int, substitution_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                if "substitution_id" in substitution_data:
-                    del substitution_data["substitution_id"]
-                self.substitute_player(substitution_data["substitution_match"],
-                                       substitution_data["substituted_player"],
-                                       substitution_data["substituting_player"])
-                cur.execute(self.get_update_query("Substitutions", substitution_data,
-                                                  "substitution_id", substitution_id))
-                conn.commit()
-            except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while editing substitution: {error}")
+        if "substitution_id" in substitution_data:
+            del substitution_data["substitution_id"]
+
+        query = self.get_update_query("Substitutions", substitution_data, "substitution_id", substitution_id)
+
+        def substitute(uow, roster):
+            self._substitute(uow, roster, substitution_data["substituted_player"],
+                             substitution_data["substituting_player"])
+            uow.execute(*query)
+        try:
+            self.roster_transaction(substitution_data["substitution_match"], substitute)
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while editing substitution: {error}")
+        self.tables_changed("Substitutions", "Match_Players")
         return True
-    
+
     def add_match_player(self, match_id : int, player_id : int):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                self.check_gender_ratio(match_id, player_id)
-                players = self.get_match_players(match_id)
-                if any(player["match_player"] == player_id for player in players):
-                    raise InvalidInputError(f"Player {player_id} is already in the match!")
-                cur.execute(self.get_insert_query("Match_Players",
-                                                  {"match_player": player_id, "match_id": match_id, "player_active": 1}
-                                                  ))
-                conn.commit()
-            except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while adding match player: {error}")
+        def add_player(uow, roster):
+            roster.check_gender_rule(self._roster_player(uow, roster, player_id)[0])
+            if roster.plays(player_id):
+                raise InvalidInputError(f"Player {player_id} is already in the match!")
+            uow.execute(STATEMENTS["insert_match_player"], (player_id, match_id, 1))
+            roster.add(player_id)
+        try:
+            self.roster_transaction(match_id, add_player)
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while adding match player: {error}")
+        self.tables_changed("Match_Players")
         return True
 
     def delete_match_player(self, match_id : int, player_id : int):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                cur.execute(f"DELETE FROM Match_Players WHERE match_id = {match_id} AND match_player = {player_id}")
-                conn.commit()
-            except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while deleting player {player_id}: {error}")
+        try:
+            self.roster_write(match_id, STATEMENTS["delete_match_player"], (match_id, player_id))
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while deleting player {player_id}: {error}")
+        self.tables_changed("Match_Players")
         return True
 
+    def check_credentials(self, *values):
+        # Logins and passwords come straight from request bodies
+        if not all(isinstance(value, str) for value in values):
+            raise InvalidInputError("Invalid login or password.")
+
     def user_exists(self, user_login : str, user_password : str):
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        self.check_credentials(user_login, user_password)
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute(f"SELECT * FROM Users WHERE user_login = '{user_login}' "
-                            f"AND user_password = '{user_password}'")
-                rows = cur.fetchall()
-                if len(rows) > 0:
-                    return True
-                else:
-                    return False
+                row = cur.execute(STATEMENTS["get_user_password"], (user_login,)).fetchone()
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while fetching user : {error}")
+        # Hashing runs on the password workers, outside the pooled connection
+        matches, needs_rehash = self.passwords.verify(user_password, None if row is None else row[1])
+        if matches and needs_rehash:
+            # Plaintext or other-cost hashes are replaced the first time their owner logs in
+            try:
+                self.writer.execute(STATEMENTS["set_user_password"],
+                                    (self.passwords.hash(user_password), row[0], row[1]))
+            except sqlite3.Error as error:
+                raise InvalidQueryError(f"Error while rehashing password of {user_login} : {error}")
+        return matches
             
     def login_exists(self, login : str):
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        return self.logins.get_or_load(("login_exists", login), ("Users",), lambda: self._login_exists(login))
+
+    def _login_exists(self, login : str):
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute(f"SELECT * FROM Users WHERE user_login = '{login}'")
+                cur.execute(STATEMENTS["login_exists"], (login,))
                 rows = cur.fetchall()
                 if len(rows) > 0:
                     return True
@@ -660,53 +910,49 @@ class SqliteDriver:
                 raise InvalidQueryError(f"Error while fetching login : {error}")
 
     def add_user(self, user_login : str, user_password : str):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                if self.user_exists(user_login, user_password):
-                    raise InvalidInputError(f"User {user_login} already exists!")
-                cur.execute(self.get_insert_query("Users", {"user_login": user_login, "user_password": user_password}))
-                conn.commit()
-            except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while adding new user : {error}")
+        self.check_credentials(user_login, user_password)
+        password_hash = self.passwords.hash(user_password)
+        def add(cur):
+            if cur.execute(STATEMENTS["login_exists"], (user_login,)).fetchone() is not None:
+                raise InvalidInputError(f"User {user_login} already exists!")
+            cur.execute(*self.get_insert_query("Users", {"user_login": user_login, "user_password": password_hash}))
+        try:
+            self.writer.run(add)
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while adding new user : {error}")
+        self.tables_changed("Users")
 
     def edit_user(self, user_id : int, user_data : dict):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                cur.execute(self.get_update_query("Users", user_data, "user_id", user_id))
-                conn.commit()
-            except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while editing user {user_id} : {error}")
+        self.check_credentials(*(user_data[field] for field in ("user_login", "user_password") if field in user_data))
+        if "user_password" in user_data:
+            user_data = {**user_data, "user_password": self.passwords.hash(user_data["user_password"])}
+        try:
+            self.writer.execute(*self.get_update_query("Users", user_data, "user_id", user_id))
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while editing user {user_id} : {error}")
+        self.tables_changed("Users")
 
     def delete_user(self, user_id : int):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                cur.execute(f"DELETE FROM Users WHERE user_id = {user_id}")
-                conn.commit()
-            except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while deleting user {user_id}: {error}")
+        try:
+            self.writer.execute(STATEMENTS["delete_user"], (user_id,))
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while deleting user {user_id}: {error}")
+        self.tables_changed("Users")
 
-    def get_events(self):
-        with SqliteContext(self.dbpath) as [conn, cur]:
+    def get_events(self, query : dict = None):
+        statement, params = self.list_query("get_events", query)
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute("SELECT * FROM Events")
-                response = [
-                    {
-                        "event_id": row[0],
-                        "match_id": row[1],
-                        "event_player_1": row[2],
-                        "event_player_2": row[3],
-                        "event_type": row[4],
-                        "event_value": row[5]
-                    } for row in cur.fetchall()
-                ]
+                cur.execute(statement, params)
+                response = [EventRecord(row) for row in cur.fetchall()]
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while fetching events: {error}")
             return response
     
     def get_event(self, event_id : int):
-        with SqliteContext(self.dbpath) as [conn, cur]:
+        with SqliteContext(self.pool) as [conn, cur]:
             try:
-                cur.execute(f"SELECT * FROM Events WHERE event_id = {event_id}")
+                cur.execute(STATEMENTS["get_event"], (event_id,))
                 row = cur.fetchall()
                 response = {
                     "event_id": row[0][0],
@@ -721,60 +967,86 @@ class SqliteDriver:
             return response
     
     def get_match_events(self, match_id : int):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                cur.execute(f"SELECT * FROM Events WHERE match_id = {match_id}")
-                response = [
-                    {
-                        "event_id": row[0],
-                        "match_id": row[1],
-                        "event_player_1": row[2],
-                        "event_player_2": row[3],
-                        "event_type": row[4],
-                        "event_value": row[5]
-                    } for row in cur.fetchall()
-                ]
+        with SqliteContext(self.pool) as [conn, cur]:
+            try:
+                cur.execute(STATEMENTS["get_match_events"], (match_id,))
+                response = [EventRecord(row) for row in cur.fetchall()]
             except sqlite3.Error as error:
                 raise InvalidQueryError(f"Error while fetching match {match_id} events: {error}")
             return response
 
     def add_event(self, event_data : dict):
-        self.input_valid(EVENT_FIELDS, event_data)
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                cur.execute(self.get_insert_query("Events", event_data))
-                conn.commit()
-            except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while adding event: {error}")
-            
-            cur.execute("SELECT * FROM Events ORDER BY event_id DESC LIMIT 1")
-            res = cur.fetchall()
-            row = {
-                "event_id": res[0][0],
-                "match_id": res[0][1],
-                "event_player_1": res[0][2],
-                "event_player_2": res[0][3],
-                "event_type": res[0][4],
-                "event_value": res[0][5]
+        return self.add_events([event_data])[0]
+
+    def add_events(self, events : list):
+        if not isinstance(events, list) or not events:
+            raise InvalidInputError("Expected a non-empty list of events.")
+        batch = []
+        for event_data in events:
+            if not isinstance(event_data, dict):
+                raise InvalidInputError("Every event has to be an object.")
+            event_data = dict(event_data)
+            idempotency_key = event_data.pop("idempotency_key", None)
+            self.input_valid(EVENT_FIELDS, event_data)
+            batch.append((idempotency_key, event_data))
+
+        def insert(cur):
+            rows = []
+            for idempotency_key, event_data in batch:
+                if idempotency_key is not None:
+                    known = cur.execute(STATEMENTS["get_event_key"], (idempotency_key,)).fetchone()
+                    if known is not None:
+                        row = cur.execute(STATEMENTS["get_event"], known).fetchone()
+                        if row is None:
+                            # Fails the whole job, so none of the batch is stored without its key
+                            raise NoResultError(f"Event registered under idempotency key {idempotency_key} "
+                                                "no longer exists.")
+                        rows.append((row, False))
+                        continue
+                query = insert_statement("Events", tuple(event_data), returning=EVENT_COLUMNS)
+                row = cur.execute(query, tuple(event_data.values())).fetchone()
+                if idempotency_key is not None:
+                    cur.execute(STATEMENTS["insert_event_key"], (idempotency_key, row[0]))
+                rows.append((row, True))
+            return rows
+        try:
+            rows = self.writer.run(insert)
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while adding events: {error}")
+        self.tables_changed("Events")
+
+        response = []
+        for row, created in rows:
+            event = {
+                "event_id": row[0],
+                "match_id": row[1],
+                "event_player_1": row[2],
+                "event_player_2": row[3],
+                "event_type": row[4],
+                "event_value": row[5]
             }
-            return row
+            if created:
+                self.broker.publish(match_topic(event["match_id"]), "event", event)
+            response.append(event)
+        return response
 
     def delete_event(self, event_id : int):
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                cur.execute(f"DELETE FROM Events WHERE event_id = {event_id}")
-                conn.commit()
-            except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while deleting event {event_id}: {error}")
-    
+        def delete(cur):
+            cur.execute(STATEMENTS["delete_event_keys"], (event_id,))
+            cur.execute(STATEMENTS["delete_event"], (event_id,))
+        try:
+            self.writer.run(delete)
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while deleting event {event_id}: {error}")
+        self.tables_changed("Events")
+
     def edit_event(self, event_id : int, event_data : dict):
         self.input_valid(EVENT_FIELDS, event_data)
         if "event_id" in event_data:
             del event_data["event_id"]
-        with SqliteContext(self.dbpath) as [conn, cur]:
-            try:
-                cur.execute(self.get_update_query("Events", event_data, "event_id", event_id))
-                conn.commit()
-            except sqlite3.Error as error:
-                raise InvalidQueryError(f"Error while editing event {event_id}: {error}")
+        try:
+            self.writer.execute(*self.get_update_query("Events", event_data, "event_id", event_id))
+        except sqlite3.Error as error:
+            raise InvalidQueryError(f"Error while editing event {event_id}: {error}")
+        self.tables_changed("Events")
         return self.get_event(event_id)
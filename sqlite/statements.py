@@ -0,0 +1,183 @@
+from functools import lru_cache
+import re
+
+from backend.exceptions import InvalidInputError
+
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+ID_LIST = re.compile(r"^\d+(,\d+)*$")
+QUERY_TABLE = re.compile(r"\b(?:INTO|UPDATE|FROM)\s+(\w+)", re.IGNORECASE)
+
+MATCH_COLUMNS = ("m.match_id, m.match_date, m.match_start_time, m.match_end_time, m.team_a_id, "
+                 "t1.team_name, m.team_b_id, t2.team_name, m.team_a_points, m.team_b_points")
+SEASON_MATCH_COLUMNS = ("m.match_id, m.match_date, m.match_start_time, m.match_end_time, t1.team_name, "
+                        "t2.team_name, m.team_a_points, m.team_b_points")
+PLAYER_COLUMNS = "p.player_id, p.player_name, p.player_gender, t.team_name"
+SUBSTITUTION_COLUMNS = ("s.substitution_id, s.substitution_time, s.substitution_match, s.substituted_player, "
+                        "s.substituting_player, p1.player_name, p2.player_name")
+EVENT_COLUMNS = "event_id, match_id, event_player_1, event_player_2, event_type, event_value"
+
+# Every fixed query shape the driver issues. Values are always bound through "?" placeholders,
+# so sqlite3's per-connection statement cache compiles each shape once per pooled connection.
+STATEMENTS = {
+    "get_notifications": "SELECT notification_id, notification_title, notification_description FROM Notifications",
+    "delete_notification": "DELETE FROM Notifications WHERE notification_id = ?",
+
+    "get_seasons": "SELECT season_id, season_title, season_start_date, season_end_date FROM Seasons",
+    "delete_season": "DELETE FROM Seasons WHERE season_id = ?",
+    "get_season_highscore": ("SELECT s.team_id, t.team_name, s.team_points FROM Season_Standings s, Teams t "
+                             "WHERE s.season_id = ? AND s.match_count > 0 AND t.team_id = s.team_id "
+                             "ORDER BY s.team_points DESC"),
+
+    "get_teams": "SELECT team_id, team_name FROM Teams",
+    "delete_team": "DELETE FROM Teams WHERE team_id = ?",
+
+    "get_matches": ("SELECT match_id, match_date, match_start_time, match_end_time, match_season, "
+                    "team_a_id, team_b_id, team_a_points, team_b_points FROM Matches"),
+    "get_match": (f"SELECT {MATCH_COLUMNS} FROM Matches m, Teams t1, Teams t2 "
+                  "WHERE m.match_id = ? AND m.team_a_id = t1.team_id AND m.team_b_id = t2.team_id"),
+    "get_season_matches": (f"SELECT {SEASON_MATCH_COLUMNS} FROM Matches m, Teams t1, Teams t2 "
+                           "WHERE m.match_season = ? AND m.team_a_id = t1.team_id AND m.team_b_id = t2.team_id"),
+    "delete_match": "DELETE FROM Matches WHERE match_id = ?",
+
+    "get_players": f"SELECT {PLAYER_COLUMNS} FROM Players p, Teams t WHERE p.player_team = t.team_id",
+    "get_player": (f"SELECT {PLAYER_COLUMNS} FROM Players p, Teams t "
+                   "WHERE p.player_team = t.team_id AND p.player_id = ?"),
+    "delete_player": "DELETE FROM Players WHERE player_id = ?",
+    "get_player_pair": "SELECT player_id, player_gender, player_team FROM Players WHERE player_id IN (?, ?)",
+
+    "get_substitutions": (f"SELECT {SUBSTITUTION_COLUMNS} FROM Substitutions s, Players p1, Players p2 "
+                          "WHERE s.substituted_player = p1.player_id AND s.substituting_player = p2.player_id"),
+    "get_match_substitutions": (f"SELECT {SUBSTITUTION_COLUMNS} FROM Substitutions s, Players p1, Players p2 "
+                                "WHERE s.substituted_player = p1.player_id AND s.substituting_player = p2.player_id"
+                                " AND s.substitution_match = ?"),
+    "get_substitution": (f"SELECT {SUBSTITUTION_COLUMNS} FROM Substitutions s, Players p1, Players p2 "
+                         "WHERE s.substituted_player = p1.player_id AND s.substituting_player = p2.player_id"
+                         " AND s.substitution_id = ?"),
+
+    "get_match_players": "SELECT match_player_id, match_player, match_id, player_active FROM Match_Players "
+                         "WHERE match_id = ? ORDER BY match_player_id",
+    "get_match_roster": ("SELECT mp.match_player_id, mp.match_player, mp.match_id, mp.player_active, p.player_name, "
+                         "p.player_gender, p.player_team FROM Match_Players mp, Players p "
+                         "WHERE mp.match_id = ? AND p.player_id = mp.match_player ORDER BY mp.match_player_id"),
+    "get_active_genders": ("SELECT p.player_gender FROM Match_Players mp, Players p WHERE mp.match_id = ? "
+                           "AND mp.match_player = p.player_id AND mp.player_active = 1"),
+    "get_roster_entries": ("SELECT mp.match_player, mp.player_active, p.player_gender, p.player_team "
+                           "FROM Match_Players mp, Players p WHERE mp.match_id = ? AND mp.match_player = p.player_id "
+                           "ORDER BY mp.match_player_id"),
+    "get_match_squads": ("SELECT p.player_id, p.player_gender, p.player_team FROM Matches m, Players p "
+                         "WHERE m.match_id = ? AND p.player_team IN (m.team_a_id, m.team_b_id)"),
+    "deactivate_match_player": "UPDATE Match_Players SET player_active = 0 WHERE match_id = ? AND match_player = ?",
+    "activate_match_player": "UPDATE Match_Players SET player_active = 1 WHERE match_id = ? AND match_player = ?",
+    "insert_match_player": "INSERT INTO Match_Players (match_player, match_id, player_active) VALUES (?, ?, ?)",
+    "delete_match_player": "DELETE FROM Match_Players WHERE match_id = ? AND match_player = ?",
+
+    "get_user_password": "SELECT user_id, user_password FROM Users WHERE user_login = ?",
+    "set_user_password": "UPDATE Users SET user_password = ? WHERE user_id = ? AND user_password = ?",
+    "login_exists": "SELECT user_id FROM Users WHERE user_login = ?",
+    "delete_user": "DELETE FROM Users WHERE user_id = ?",
+
+    "get_events": f"SELECT {EVENT_COLUMNS} FROM Events",
+    "get_event": f"SELECT {EVENT_COLUMNS} FROM Events WHERE event_id = ?",
+    "get_match_events": f"SELECT {EVENT_COLUMNS} FROM Events WHERE match_id = ?",
+    "delete_event": "DELETE FROM Events WHERE event_id = ?",
+    "get_player_season_stats": ("SELECT season_id, event_type, player_role, event_count, value_total "
+                                "FROM Player_Season_Stats WHERE player_id = ? AND event_count > 0"),
+    "get_player_match_stats": ("SELECT e.match_id, e.event_type, 1, COUNT(*), SUM(COALESCE(e.event_value, 0)) "
+                               "FROM Events e, Matches m WHERE e.event_player_1 = ? AND m.match_id = e.match_id "
+                               "AND m.match_season = ? GROUP BY e.match_id, e.event_type "
+                               "UNION ALL "
+                               "SELECT e.match_id, e.event_type, 2, COUNT(*), SUM(COALESCE(e.event_value, 0)) "
+                               "FROM Events e, Matches m WHERE e.event_player_2 = ? AND m.match_id = e.match_id "
+                               "AND m.match_season = ? GROUP BY e.match_id, e.event_type"),
+    "get_season_leaders": ("SELECT s.player_id, p.player_name, t.team_name, s.event_count, s.value_total "
+                           "FROM Player_Season_Stats s JOIN Players p ON p.player_id = s.player_id "
+                           "LEFT JOIN Teams t ON t.team_id = p.player_team "
+                           "WHERE s.season_id = ? AND s.event_type = ? AND s.player_role = ? AND s.event_count > 0 "
+                           "ORDER BY s.value_total DESC, s.event_count DESC, s.player_id LIMIT ?"),
+    "get_season_team_leaders": ("SELECT t.team_id, t.team_name, SUM(s.event_count) AS event_count, "
+                                "SUM(s.value_total) AS value_total FROM Player_Season_Stats s, Players p, Teams t "
+                                "WHERE s.season_id = ? AND s.event_type = ? AND s.player_role = ? "
+                                "AND p.player_id = s.player_id AND t.team_id = p.player_team "
+                                "GROUP BY t.team_id HAVING event_count > 0 "
+                                "ORDER BY value_total DESC, event_count DESC, t.team_id"),
+    "get_event_key": "SELECT event_id FROM Event_Keys WHERE idempotency_key = ?",
+    "insert_event_key": "INSERT INTO Event_Keys (idempotency_key, event_id) VALUES (?, ?)",
+    "delete_event_keys": "DELETE FROM Event_Keys WHERE event_id = ?"
+}
+
+# Keyset paged list reads: the key column of each statement and the condition every filter it
+# accepts adds. A filter value is bound to each "?" of its condition.
+LIST_QUERIES = {
+    "get_events": ("event_id", {
+        "match": "match_id = ?",
+        "event_type": "event_type = ?",
+        "player": "(event_player_1 = ? OR event_player_2 = ?)"
+    }),
+    "get_matches": ("match_id", {
+        "season": "match_season = ?",
+        "team": "(team_a_id = ? OR team_b_id = ?)",
+        "date_from": "match_date >= ?",
+        "date_to": "match_date <= ?"
+    }),
+    "get_players": ("p.player_id", {
+        # Comma separated player ids, looked up with one IN over the bound list
+        "ids": "p.player_id IN (SELECT value FROM json_each('[' || ? || ']'))",
+        "team": "p.player_team = ?",
+        "gender": "p.player_gender = ?"
+    }),
+    "get_substitutions": ("s.substitution_id", {
+        "match": "s.substitution_match = ?",
+        "player": "(s.substituted_player = ? OR s.substituting_player = ?)"
+    })
+}
+
+# Filter values that have to match a format before they are bound
+FILTER_FORMATS = {"ids": ID_LIST}
+
+def check_identifiers(*names):
+    for name in names:
+        if not IDENTIFIER.match(name):
+            raise InvalidInputError(f"Illegal identifier in query: {name}")
+
+@lru_cache(maxsize=1024)
+def insert_statement(table : str, columns : tuple, conflict : str = "", returning : str = ""):
+    check_identifiers(table, *columns)
+    verb = f"INSERT OR {conflict}" if conflict else "INSERT"
+    query = f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    return f"{query} RETURNING {returning}" if returning else query
+
+@lru_cache(maxsize=1024)
+def update_statement(table : str, columns : tuple, target_name : str):
+    check_identifiers(table, target_name, *columns)
+    assignments = ", ".join(f"{column} = ?" for column in columns)
+    return f"UPDATE {table} SET {assignments} WHERE {target_name} = ?"
+
+@lru_cache(maxsize=1024)
+def list_statement(name : str, filters : tuple, after : bool, limit : bool):
+    key, conditions = LIST_QUERIES[name]
+    clauses = [conditions[field] for field in filters]
+    if after:
+        clauses.append(f"{key} > ?")
+    query = STATEMENTS[name]
+    if clauses:
+        query += (" AND " if " WHERE " in query else " WHERE ") + " AND ".join(clauses)
+    if after or limit:
+        query += f" ORDER BY {key}"
+    return f"{query} LIMIT ?" if limit else query
+
+STATEMENT_NAMES = {query: name for name, query in STATEMENTS.items()}
+
+@lru_cache(maxsize=1024)
+def statement_name(query : str):
+    # Metrics label of a query: its STATEMENTS name, the list query it was built from, or its verb
+    # and table for the generated inserts and updates
+    name = STATEMENT_NAMES.get(query)
+    if name is not None:
+        return name
+    for name in LIST_QUERIES:
+        if query.startswith(STATEMENTS[name]):
+            return name
+    words = query.split(None, 1)
+    verb = words[0].lower() if words else "empty"
+    table = QUERY_TABLE.search(query)
+    return f"{verb} {table.group(1)}" if table else verb
@@ -1,9 +1,22 @@
+import asyncio
 import json
 import pytest
+import sqlite3
+import threading
+import time
 
 from os import path, remove
-from .sqlite_driver import SqliteDriver
-from backend.exceptions import InvalidInputError, NoResultError
+from .connection_pool import ConnectionPool
+from .generator import generate, write_csv, write_database
+from .migrations import MIGRATIONS
+from .query_plans import audit, regressions
+from .sqlite_driver import match_topic, SqliteContext, SqliteDriver
+from .statements import STATEMENTS
+from backend.cache import ResponseCache
+from backend.exceptions import DatabaseUnavailableError, InvalidInputError, InvalidQueryError, NoResultError
+from backend.pubsub import Broker, OVERFLOW
+from backend.records import Record
+from backend.serialization import stream_json
 
 class TestSqlite:
     @pytest.fixture
@@ -11,6 +24,7 @@ class TestSqlite:
         db = SqliteDriver("test.db")
         db.create_tables("create.sql")
         yield db
+        db.close()
         if path.exists("test.db"):
             remove("test.db")
 
@@ -563,3 +577,660 @@ class TestSqlite:
             "event_type": "misses",
             "event_value": 1
         }
+
+    def test_pool_reuses_connections(self, database):
+        database.insert_from_csv("Teams", "test_input/teams.csv", ";")
+        for _ in range(10):
+            database.get_teams()
+        metrics = database.pool.metrics()
+        assert metrics["connections_opened"] == 1 and metrics["idle_connections"] == 1
+
+    def test_pool_nested_contexts_share_connection(self, database):
+        checkouts = database.pool.metrics()["checkouts"]
+        with SqliteContext(database.pool) as [outer_conn, _]:
+            with SqliteContext(database.pool) as [inner_conn, _]:
+                assert inner_conn is outer_conn
+        assert database.pool.metrics()["checkouts"] == checkouts + 1
+
+    def test_pool_exhausted(self, database):
+        db = SqliteDriver("test.db", pool_size=1, pool_timeout=0.05)
+        errors = []
+
+        def checkout():
+            try:
+                with SqliteContext(db.pool):
+                    pass
+            except DatabaseUnavailableError as error:
+                errors.append(error)
+
+        with SqliteContext(db.pool):
+            thread = threading.Thread(target=checkout)
+            thread.start()
+            thread.join()
+        db.close()
+        assert len(errors) == 1 and db.pool.metrics()["timeouts"] == 1
+
+    def test_pool_never_opens_past_its_size(self, database):
+        class SlowPool(ConnectionPool):
+            def open_connection(self, isolation_level : str = ""):
+                time.sleep(0.02)
+                return super().open_connection(isolation_level)
+
+        pool = SlowPool("test.db", pool_size=2)
+        barrier = threading.Barrier(8)
+
+        def checkout():
+            barrier.wait()
+            conn = pool.acquire()
+            time.sleep(0.01)
+            pool.release(conn)
+
+        threads = [threading.Thread(target=checkout) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        metrics = pool.metrics()
+        pool.close()
+        assert metrics["connections_opened"] == 2 and metrics["idle_connections"] == 2
+
+        # A connection that fails to open gives its slot back
+        broken = ConnectionPool(path.join("missing", "test.db"), pool_size=1, timeout=0.05)
+        for _ in range(2):
+            with pytest.raises(DatabaseUnavailableError, match="Unable to connect"):
+                broken.acquire()
+
+    def test_values_are_bound(self, database):
+        database.add_team({"team_name": "O'Neill Owls"})
+        database.edit_team(1, {"team_name": "Robert'); DROP TABLE Teams;--"})
+        assert database.get_teams() == [{"team_id": 1, "team_name": "Robert'); DROP TABLE Teams;--"}]
+
+    def test_illegal_column_name(self, database):
+        with pytest.raises(InvalidInputError):
+            database.edit_user(1, {"user_login = 'x' --": "value"})
+
+    def test_wal_journal_mode(self, database):
+        with SqliteContext(database.pool) as [conn, cur]:
+            assert cur.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            assert cur.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+
+    def test_concurrent_writes(self, database):
+        def add_events():
+            for _ in range(25):
+                database.add_event({"match_id": 0, "event_player_1": 0, "event_player_2": None,
+                                    "event_type": "shots", "event_value": 1})
+
+        threads = [threading.Thread(target=add_events) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        events = database.get_events()
+        assert len(events) == 200 and len({event["event_id"] for event in events}) == 200
+        assert database.writer.metrics()["jobs"] == 200
+
+    def test_failed_write_keeps_batch(self, database):
+        def fail(cur):
+            cur.execute("INSERT INTO Teams (team_name) VALUES ('rolled back')")
+            raise InvalidInputError("rejected")
+
+        futures = [
+            database.writer.submit(lambda cur: cur.execute("INSERT INTO Teams (team_name) VALUES ('first')")),
+            database.writer.submit(fail),
+            database.writer.submit(lambda cur: cur.execute("INSERT INTO Teams (team_name) VALUES ('second')"))
+        ]
+        with pytest.raises(InvalidInputError):
+            futures[1].result()
+        futures[2].result()
+        assert [team["team_name"] for team in database.get_teams()] == ["first", "second"]
+
+    def test_inline_writer(self, database):
+        db = SqliteDriver("test.db", single_writer=False)
+        db.add_team({"team_name": "inline"})
+        with pytest.raises(InvalidInputError):
+            db.add_team({"team_name": "inline", "illegal_field": ""})
+        assert db.get_teams() == [{"team_id": 1, "team_name": "inline"}]
+        db.close()
+
+    def test_migrations_add_indexes(self, database):
+        database.create_tables("create.sql")
+        with SqliteContext(database.pool) as [conn, cur]:
+            assert cur.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+            plan = cur.execute("EXPLAIN QUERY PLAN " + STATEMENTS["get_match_events"], (0,)).fetchall()
+            assert "idx_events_match" in plan[0][3]
+            plan = cur.execute("EXPLAIN QUERY PLAN " + STATEMENTS["get_active_genders"], (0,)).fetchall()
+            assert any("idx_match_players_match_active" in step[3] for step in plan)
+
+    def test_duplicate_logins_stop_migration(self, database):
+        with SqliteContext(database.pool) as [conn, cur]:
+            cur.execute("DROP INDEX idx_users_login")
+            cur.executemany("INSERT INTO Users (user_login, user_password) VALUES (?, ?)",
+                            [("ann", "first"), ("bob", "only"), ("ann", "second")])
+            cur.execute("PRAGMA user_version = 6")
+            conn.commit()
+        with pytest.raises(InvalidQueryError, match="Migration 7 can not run.*: ann$"):
+            database.create_tables("create.sql")
+        with SqliteContext(database.pool) as [conn, cur]:
+            assert cur.execute("SELECT COUNT(*) FROM Users").fetchone()[0] == 3
+            assert cur.execute("PRAGMA user_version").fetchone()[0] == 6
+            cur.execute("UPDATE Users SET user_login = 'ann2' WHERE user_password = 'second'")
+            conn.commit()
+        database.create_tables("create.sql")
+        with SqliteContext(database.pool) as [conn, cur]:
+            assert cur.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+            assert cur.execute("SELECT COUNT(*) FROM Users").fetchone()[0] == 3
+
+    def test_import_all(self, database):
+        results = database.import_all("test_input", defer_indexes=True)
+        assert [stats["table"] for stats in results] == ["Seasons", "Teams", "Matches", "Notifications", "Players",
+                                                         "Match_Players", "Substitutions"]
+        assert all(stats["rows"] > 0 and stats["rows_per_second"] > 0 for stats in results)
+        with open("test_output/teams.json", encoding="utf-8") as teams_results:
+            assert database.get_teams() == json.load(teams_results)
+        with SqliteContext(database.pool) as [conn, cur]:
+            indexes = [row[0] for row in cur.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                                     "AND tbl_name = 'Matches'")]
+            assert "idx_matches_season" in indexes
+
+    def test_import_typed_values(self, database, tmp_path):
+        csv_path = tmp_path / "seasons.csv"
+        csv_path.write_text("season_id;season_title;season_start_date;season_end_date\n"
+                            "'7';'It''s fine';'20220101';NULL\n8;'2023';'20230101';'20231231'\n", encoding="utf-8")
+        database.import_csv("Seasons", str(csv_path), chunk_size=1)
+        assert database.get_seasons() == [
+            {"season_id": 7, "season_title": "It's fine", "season_start_date": "20220101", "season_end_date": None},
+            {"season_id": 8, "season_title": "2023", "season_start_date": "20230101", "season_end_date": "20231231"}
+        ]
+
+    def test_import_unquoted_text(self, database, tmp_path):
+        csv_path = tmp_path / "teams.csv"
+        csv_path.write_text("team_id;team_name\n1;'Valid'\n2;Broken'\n", encoding="utf-8")
+        with pytest.raises(InvalidQueryError, match="line 3"):
+            database.import_csv("Teams", str(csv_path))
+        assert database.get_teams() == []
+
+    def test_season_standings_follow_matches(self, database):
+        database.insert_from_csv("Seasons", "test_input/seasons.csv", ";")
+        database.insert_from_csv("Teams", "test_input/teams.csv", ";")
+        database.insert_from_csv("Matches", "test_input/matches.csv", ";")
+        database.insert_from_csv("Matches", "test_input/matches.csv", ";")
+        database.edit_match(5, {"team_b_points": 100})
+        database.delete_match(4)
+        database.add_match({"match_date": "20220901", "match_start_time": "100000", "match_season": 1,
+                            "team_a_id": 1, "team_b_id": 8, "team_a_points": 5, "team_b_points": 0})
+        assert database.get_season_highscore(1) == [
+            {"team_id": 8, "team_name": "Lublin Lynx", "team_score": 100},
+            {"team_id": 2, "team_name": "Warszawa Unicorns", "team_score": 60},
+            {"team_id": 1, "team_name": "Łódź Pirates", "team_score": 5}
+        ]
+
+    def test_cached_reads_invalidated_by_writes(self, database):
+        database.insert_from_csv("Teams", "test_input/teams.csv", ";")
+        teams = database.get_teams()
+        assert database.get_teams() is teams
+        assert database.cache.metrics()["hits"] == 1
+
+        database.edit_team(1, {"team_name": "Łódź Privateers"})
+        assert {"team_id": 1, "team_name": "Łódź Privateers"} in database.get_teams()
+        database.add_team({"team_name": "Gdańsk Gulls"})
+        assert len(database.get_teams()) == len(teams) + 1
+
+    def test_cache_eviction_and_expiry(self):
+        cache = ResponseCache(max_entries=2, ttl=0.05)
+        for key in ("a", "b", "a", "c"):
+            cache.get_or_load((key,), ("Teams",), lambda: key)
+        assert cache.get_or_load(("b",), ("Teams",), lambda: "reloaded") == "reloaded"
+        time.sleep(0.06)
+        assert cache.get_or_load(("c",), ("Teams",), lambda: "expired") == "expired"
+        metrics = cache.metrics()
+        assert metrics["evictions"] == 2 and metrics["expirations"] == 1 and metrics["hits"] == 1
+
+    def test_version_tags_follow_writes(self, database):
+        teams_tag = database.version_tag("Teams")
+        matches_tag = database.version_tag("Matches", "Teams")
+        database.add_team({"team_name": "Gdańsk Gulls"})
+        assert database.version_tag("Teams") != teams_tag
+        assert database.version_tag("Matches", "Teams") != matches_tag
+        assert database.version_tag("Seasons") == database.version_tag("Seasons")
+
+        database.insert_from_csv("Notifications", "test_input/notifications.csv", ";")
+        notifications_tag = database.version_tag("Notifications")
+        database.delete_notification(database.get_notifications()[0]["notification_id"])
+        assert database.version_tag("Notifications") != notifications_tag
+
+    def test_match_updates_published(self, database):
+        database.insert_from_csv("Teams", "test_input/teams.csv", ";")
+        database.insert_from_csv("Matches", "test_input/matches.csv", ";")
+        database.insert_from_csv("Players", "test_input/players.csv", ";")
+        subscription = database.broker.subscribe(match_topic(5))
+        database.edit_match(5, {"team_a_points": 42})
+        database.add_event({"match_id": 5, "event_player_1": 1, "event_type": "goal", "event_value": 1})
+        database.add_event({"match_id": 6, "event_player_1": 1, "event_type": "goal", "event_value": 1})
+        match, event = subscription.get(timeout=1), subscription.get(timeout=1)
+        assert match.event == "match" and match.data["team_a_points"] == 42
+        assert event.event == "event" and event.data["match_id"] == 5
+        assert subscription.get(timeout=0.01) is None
+        subscription.close()
+        assert not database.broker.has_subscribers(match_topic(5))
+
+    def test_async_subscriber_waits_on_event_loop(self):
+        broker = Broker(max_queue=2)
+
+        async def spectate():
+            subscription = broker.subscribe("match:1", asyncio.get_running_loop())
+            publisher = threading.Timer(0.05, broker.publish, ("match:1", "event", {"event_id": 1}))
+            publisher.start()
+            try:
+                message = await subscription.get_async(timeout=5)
+                return message, await subscription.get_async(timeout=0.01)
+            finally:
+                publisher.join()
+                subscription.close()
+
+        message, keepalive = asyncio.run(spectate())
+        assert message.event == "event" and message.data == {"event_id": 1}
+        assert keepalive is None and not broker.has_subscribers("match:1")
+
+    def test_asgi_streams_release_their_connections(self, monkeypatch, tmp_path):
+        # server.py opens its database on import
+        monkeypatch.setenv("SPORTSMETER_DB", str(tmp_path / "asgi.db"))
+        import asgi
+        import server
+        server.db.create_tables("create.sql")
+        sizes = write_database(server.db, seasons=1, matches_per_season=30, events_per_match=40)
+        server.app._got_first_request = True
+
+        async def download(disconnect_after = None):
+            # Body chunks of GET /api/events, the client goes away after disconnect_after of them
+            gone = asyncio.Event()
+            requests = [{"type": "http.request", "body": b"", "more_body": False}]
+            chunks = []
+
+            async def receive():
+                if requests:
+                    return requests.pop()
+                await gone.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                if message["type"] == "http.response.body" and message["body"]:
+                    chunks.append(message["body"])
+                    if len(chunks) == disconnect_after:
+                        gone.set()
+                        await asyncio.sleep(0.01)
+
+            await asgi.app({"type": "http", "method": "GET", "path": "/api/events", "headers": []}, receive, send)
+            return b"".join(chunks)
+
+        async def clients():
+            return await asyncio.gather(*(download(2 if number % 2 else None) for number in range(6)))
+
+        try:
+            bodies = asyncio.run(clients())
+            assert all(len(json.loads(body)) == sizes["Events"] for body in bodies[::2])
+            assert all(not body.endswith(b"]") for body in bodies[1::2])
+            metrics = server.db.pool.metrics()
+            assert metrics["idle_connections"] == metrics["open_connections"] <= metrics["pool_size"]
+            assert len(server.db.get_events({"limit": "1"})) == 1
+
+            # Unknown matches are a 404 before any stream or subscription starts, on both servers
+            assert server.app.test_client().get("/api/matches/999/stream").status_code == 404
+            sent = []
+
+            async def unknown_match():
+                requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+                async def receive():
+                    if requests:
+                        return requests.pop()
+                    await asyncio.Event().wait()
+
+                async def send(message):
+                    sent.append(message)
+
+                await asgi.app({"type": "http", "method": "GET", "path": "/api/matches/999/stream", "headers": []},
+                               receive, send)
+
+            asyncio.run(asyncio.wait_for(unknown_match(), 5))
+            assert sent[0]["status"] == 404 and not sent[-1]["more_body"]
+            assert not server.db.broker.has_subscribers(match_topic(999))
+        finally:
+            server.db.close()
+
+    def test_slow_subscriber_dropped(self):
+        broker = Broker(max_queue=2)
+        slow, fast = broker.subscribe("match:1"), broker.subscribe("match:1")
+        for number in range(3):
+            broker.publish("match:1", "event", {"number": number})
+            fast.get(timeout=1)
+        assert [slow.get(timeout=1).data for _ in range(2)] == [{"number": 0}, {"number": 1}]
+        assert slow.get(timeout=1) is OVERFLOW
+        assert broker.metrics()["overflows"] == 1 and broker.metrics()["subscribers"] == 1
+
+    def test_add_events_batch_is_idempotent(self, database):
+        database.insert_from_csv("Players", "test_input/players.csv", ";")
+        database.insert_from_csv("Matches", "test_input/matches.csv", ";")
+        batch = [
+            {"idempotency_key": "tablet-1:1", "match_id": 0, "event_player_1": 0, "event_player_2": 1,
+             "event_type": "shots", "event_value": 1},
+            {"idempotency_key": "tablet-1:2", "match_id": 0, "event_player_1": 1, "event_player_2": None,
+             "event_type": "goal", "event_value": 1}
+        ]
+        created = database.add_events(batch)
+        assert [event["event_id"] for event in created] == [1, 2]
+        assert created[1] == {"event_id": 2, "match_id": 0, "event_player_1": 1, "event_player_2": None,
+                              "event_type": "goal", "event_value": 1}
+
+        replayed = database.add_events(batch + [{"idempotency_key": "tablet-1:3", "match_id": 0,
+                                                 "event_player_1": 0, "event_type": "catch", "event_value": 1}])
+        assert replayed[:2] == created and replayed[2]["event_id"] == 3
+        assert len(database.get_events()) == 3
+
+        # Deleting an event drops its key with it
+        database.delete_event(3)
+        with SqliteContext(database.pool) as [conn, cur]:
+            assert cur.execute("SELECT idempotency_key FROM Event_Keys ORDER BY event_id").fetchall() == [
+                ("tablet-1:1",), ("tablet-1:2",)]
+            # A key left behind by an event removed some other way fails the whole batch
+            cur.execute("DELETE FROM Events WHERE event_id = 1")
+            conn.commit()
+        for _ in range(3):
+            with pytest.raises(NoResultError):
+                database.add_events([{"match_id": 0, "event_player_1": 0, "event_type": "shots", "event_value": 1},
+                                     batch[0]])
+        assert [event["event_id"] for event in database.get_events()] == [2]
+
+    def test_add_events_batch_rolls_back(self, database):
+        with pytest.raises(InvalidInputError):
+            database.add_events([{"match_id": 0, "event_player_1": 0, "event_type": "goal"},
+                                 {"match_id": 0, "event_player_1": 0, "event_kind": "goal"}])
+        with pytest.raises(InvalidQueryError):
+            database.add_events([{"match_id": 0, "event_player_1": 0, "event_type": "goal"},
+                                 {"match_id": 0, "event_player_1": 0, "event_type": None}])
+        assert database.get_events() == []
+
+    def test_failed_substitution_leaves_roster(self, database):
+        database.insert_from_csv("Teams", "test_input/teams.csv", ";")
+        database.insert_from_csv("Players", "test_input/players.csv", ";")
+        database.insert_from_csv("Matches", "test_input/matches.csv", ";")
+        database.insert_from_csv("Match_Players", "test_input/match_players.csv", ";")
+        roster = database.get_match_players(0)
+        checkouts = database.pool.metrics()["checkouts"]
+        with pytest.raises(InvalidQueryError):
+            database.add_substitution(0, {"substitution_time": "121000", "substituted_player": 0,
+                                          "substituting_player": 3, "substitution_note": "injury"})
+        assert database.pool.metrics()["checkouts"] == checkouts
+        assert database.get_match_players(0) == roster
+        assert database.get_match_substitutions(0) == []
+
+    def test_illegal_substitution_field_leaves_roster(self, database):
+        database.insert_from_csv("Teams", "test_input/teams.csv", ";")
+        database.insert_from_csv("Players", "test_input/players.csv", ";")
+        database.insert_from_csv("Matches", "test_input/matches.csv", ";")
+        database.insert_from_csv("Match_Players", "test_input/match_players.csv", ";")
+        database.substitute_player(0, 1, 2)
+        database.substitute_player(0, 2, 1)
+        for substitute in (lambda data: database.add_substitution(0, data),
+                           lambda data: database.edit_substitution(1, {**data, "substitution_match": 0})):
+            with pytest.raises(InvalidInputError):
+                substitute({"substitution_time": "121000", "substituted_player": 1, "substituting_player": 2,
+                            "bad key": "injury"})
+            assert database.rosters["0"].is_active(1) and not database.rosters["0"].is_active(2)
+        database.add_substitution(0, {"substitution_time": "121000", "substituted_player": 1,
+                                      "substituting_player": 2})
+        assert database.rosters["0"].is_active(2) and not database.rosters["0"].is_active(1)
+
+    def test_roster_follows_substitutions(self, database):
+        database.insert_from_csv("Teams", "test_input/teams.csv", ";")
+        database.insert_from_csv("Players", "test_input/players.csv", ";")
+        database.insert_from_csv("Matches", "test_input/matches.csv", ";")
+        database.insert_from_csv("Match_Players", "test_input/match_players.csv", ";")
+        database.add_substitution(0, {"substitution_time": "121000", "substituted_player": 1,
+                                      "substituting_player": 2})
+        roster = database.rosters["0"]
+        assert roster.gender_counts == {"Male": 3, "Female": 3, "Nonbinary": 0}
+        assert roster.is_active(2) and not roster.is_active(1)
+
+        database.substitute_player(0, 7, 1)
+        assert database.rosters["0"] is roster
+        active = {player["match_player"] for player in database.get_match_players(0) if player["player_active"]}
+        assert active == {player for player, player_active in roster.entries.items() if player_active}
+
+        database.delete_match_player(0, 1)
+        assert "0" not in database.rosters
+        with pytest.raises(InvalidQueryError):
+            database.add_substitution(0, {"substitution_time": "121000", "substituted_player": 2,
+                                          "substituting_player": 1, "substitution_note": "injury"})
+        assert "0" not in database.rosters
+        assert database.get_match_players(0)[-1]["match_player"] == 2
+
+    def test_list_reads_return_records(self, database):
+        database.insert_from_csv("Teams", "test_input/teams.csv", ";")
+        team = database.get_teams()[0]
+        assert isinstance(team, Record)
+        assert team == {"team_id": 0, "team_name": "Poznań Capricorns"} and team.team_name == team["team_name"]
+        assert list(team.keys()) == ["team_id", "team_name"] and team.get("team_city") is None
+        assert json.loads(json.dumps(database.get_teams(), default=Record.to_dict))[0] == team
+        with pytest.raises(KeyError):
+            team["team_city"]
+
+    def test_iter_events_streams_batches(self, database):
+        database.insert_from_csv("Players", "test_input/players.csv", ";")
+        database.insert_from_csv("Matches", "test_input/matches.csv", ";")
+        database.add_events([{"match_id": 0, "event_player_1": 0, "event_type": "shots", "event_value": number}
+                             for number in range(5)])
+        batches = list(database.iter_events(batch_size=2))
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert [event for batch in batches for event in batch] == database.get_events()
+        assert json.loads("".join(stream_json(batches))) == database.get_events()
+        assert [json.loads(line) for line in "".join(stream_json(batches, "ndjson")).splitlines()] == database.get_events()
+
+        # Every page is read on a connection of its own, none is held between batches, also not
+        # when the stream is resumed on another thread
+        stream = database.iter_events({"limit": "3"}, batch_size=2)
+        assert [event["event_id"] for event in next(stream)] == [1, 2]
+        metrics = database.pool.metrics()
+        assert metrics["idle_connections"] == metrics["open_connections"]
+        thread = threading.Thread(target=lambda: batches.append(next(stream)))
+        batches = []
+        thread.start()
+        thread.join()
+        assert [event["event_id"] for batch in batches for event in batch] == [3]
+        assert next(stream, None) is None
+        metrics = database.pool.metrics()
+        assert metrics["idle_connections"] == metrics["open_connections"]
+
+    def test_list_reads_page_and_filter(self, database):
+        database.insert_from_csv("Teams", "test_input/teams.csv", ";")
+        database.insert_from_csv("Players", "test_input/players.csv", ";")
+        database.insert_from_csv("Matches", "test_input/matches.csv", ";")
+        database.add_events([{"match_id": number % 2, "event_player_1": 0, "event_player_2": number % 3,
+                              "event_type": "goal" if number % 2 else "shots", "event_value": 1}
+                             for number in range(10)])
+        events = database.get_events()
+        first_page = database.get_events({"limit": "3"})
+        assert first_page == events[:3]
+        assert database.get_events({"limit": "3", "after": first_page[-1]["event_id"]}) == events[3:6]
+        assert database.get_events({"event_type": "goal", "player": "2", "after": "2"}) == \
+            [event for event in events if event["event_type"] == "goal" and event["event_id"] > 2
+             and 2 in (event["event_player_1"], event["event_player_2"])]
+        assert [batch for batch in database.iter_events({"match": "1"})] == \
+            [[event for event in events if event["match_id"] == 1]]
+
+        team = database.get_matches()[0]["team_a_id"]
+        assert database.get_matches({"team": team, "date_from": "20220401"}) == \
+            [match for match in database.get_matches() if team in (match["team_a_id"], match["team_b_id"])
+             and match["match_date"] >= "20220401"]
+        assert all(player["player_team"] == "Poznań Capricorns" for player in database.get_players({"team": 0}))
+        with pytest.raises(InvalidInputError):
+            database.get_events({"event_kind": "goal"})
+        with pytest.raises(InvalidInputError):
+            database.get_substitutions({"limit": "0"})
+
+    def test_player_stats_and_season_leaders(self, database):
+        database.insert_from_csv("Seasons", "test_input/seasons.csv", ";")
+        database.insert_from_csv("Teams", "test_input/teams.csv", ";")
+        database.insert_from_csv("Players", "test_input/players.csv", ";")
+        database.insert_from_csv("Matches", "test_input/matches.csv", ";")
+        goal, assist, _ = database.add_events([
+            {"match_id": 0, "event_player_1": 0, "event_player_2": 1, "event_type": "goal", "event_value": 1},
+            {"match_id": 0, "event_player_1": 1, "event_player_2": None, "event_type": "assist", "event_value": 1},
+            {"match_id": 1, "event_player_1": 0, "event_player_2": None, "event_type": "goal", "event_value": 2}
+        ])
+        stats = database.get_player_stats(0)
+        assert stats["goals"] == 2 and stats["assists"] == 0
+        assert stats["totals"] == {"primary": {"goal": {"count": 2, "value": 3}}}
+        assert stats["seasons"][0] == stats["totals"] and "matches" not in stats
+        assert database.get_player_stats(0, {"season": 0})["matches"][1] == {"primary": {"goal": {"count": 1, "value": 2}}}
+        assert database.get_player_stats(1)["totals"]["secondary"] == {"goal": {"count": 1, "value": 1}}
+        assert database.get_player_stats(1)["assists"] == 1
+
+        leaders = database.get_season_leaders(0)
+        assert [(player["player_id"], player["value_total"]) for player in leaders["players"]] == [(0, 3)]
+        assert leaders["teams"][0]["team_id"] == 0 and leaders["teams"][0]["event_count"] == 2
+
+        # The aggregates follow edits, deletions and matches moving to another season
+        database.edit_event(goal["event_id"], {"event_player_1": 1})
+        database.delete_event(assist["event_id"])
+        leaders = database.get_season_leaders(0, {"role": "primary"})
+        assert [(player["player_id"], player["value_total"]) for player in leaders["players"]] == [(0, 2), (1, 1)]
+        assert database.get_player_stats(1)["assists"] == 0
+        database.edit_match(1, {"match_season": 1})
+        assert [player["player_id"] for player in database.get_season_leaders(0)["players"]] == [1]
+        assert [player["player_id"] for player in database.get_season_leaders(1)["players"]] == [0]
+        with pytest.raises(NoResultError):
+            database.get_player_stats(100)
+        with pytest.raises(InvalidInputError):
+            database.get_season_leaders(0, {"role": "keeper"})
+
+    def test_batched_player_lookups(self, database):
+        database.insert_from_csv("Teams", "test_input/teams.csv", ";")
+        database.insert_from_csv("Players", "test_input/players.csv", ";")
+        database.insert_from_csv("Matches", "test_input/matches.csv", ";")
+        database.insert_from_csv("Match_Players", "test_input/match_players.csv", ";")
+        players = database.get_players({"ids": "5,0,3"})
+        assert [player["player_id"] for player in players] == [0, 3, 5]
+        assert players[1] == database.get_player(3)
+        with pytest.raises(InvalidInputError):
+            database.get_players({"ids": "1,x"})
+
+        roster = database.get_match_roster(0)
+        assert [{key: entry[key] for key in ("match_player_id", "match_player", "match_id", "player_active")}
+                for entry in roster] == database.get_match_players(0)
+        player = database.get_player(roster[0]["match_player"])
+        assert (roster[0]["player_name"], roster[0]["player_gender"]) == (player["player_name"], player["player_gender"])
+
+    def test_match_snapshot_is_one_read_transaction(self, database):
+        database.insert_from_csv("Teams", "test_input/teams.csv", ";")
+        database.insert_from_csv("Players", "test_input/players.csv", ";")
+        database.insert_from_csv("Matches", "test_input/matches.csv", ";")
+        database.insert_from_csv("Match_Players", "test_input/match_players.csv", ";")
+        database.insert_from_csv("Substitutions", "test_input/substitutions.csv", ";")
+        event = database.add_event({"match_id": 0, "event_player_1": 0, "event_type": "goal", "event_value": 1})
+        checkouts = database.pool.metrics()["checkouts"]
+        snapshot = database.get_match_snapshot(0)
+        assert database.pool.metrics()["checkouts"] == checkouts + 1
+        assert snapshot["match"] == database.get_match(0)
+        assert [team["team_id"] for team in snapshot["teams"]] == [snapshot["match"]["team_a_id"],
+                                                                   snapshot["match"]["team_b_id"]]
+        assert snapshot["roster"] == database.get_match_roster(0)
+        assert snapshot["events"] == [event]
+        assert snapshot["substitutions"] == database.get_match_substitutions(0)
+        with pytest.raises(NoResultError):
+            database.get_match_snapshot(100)
+
+    def test_login_cache_follows_user_writes(self, database):
+        assert not database.login_exists("referee")
+        database.add_user("referee", "secret")
+        assert database.login_exists("referee")
+        checkouts = database.pool.metrics()["checkouts"]
+        assert database.login_exists("referee") and database.logins.metrics()["hits"] >= 1
+        assert database.pool.metrics()["checkouts"] == checkouts
+        with pytest.raises(InvalidInputError):
+            database.add_user("referee", "other secret")
+        database.edit_user(1, {"user_login": "scorekeeper"})
+        assert not database.login_exists("referee") and database.login_exists("scorekeeper")
+        database.delete_user(1)
+        assert not database.login_exists("scorekeeper")
+
+    def test_passwords_are_hashed(self, database):
+        database.add_user("referee", "secret")
+        with SqliteContext(database.pool) as [conn, cur]:
+            stored = cur.execute("SELECT user_password FROM Users WHERE user_login = 'referee'").fetchone()[0]
+            cur.execute("INSERT INTO Users (user_login, user_password) VALUES ('legacy', 'plain')")
+            conn.commit()
+        assert stored.startswith("scrypt$") and "secret" not in stored
+        assert database.user_exists("referee", "secret")
+        assert not database.user_exists("referee", "Secret") and not database.user_exists("nobody", "secret")
+        with pytest.raises(InvalidInputError):
+            database.add_user("referee", "secret")
+
+        # Plaintext passwords from before hashing still work and are hashed on first login
+        assert database.user_exists("legacy", "plain")
+        with SqliteContext(database.pool) as [conn, cur]:
+            upgraded = cur.execute("SELECT user_password FROM Users WHERE user_login = 'legacy'").fetchone()[0]
+        assert upgraded.startswith("scrypt$") and database.user_exists("legacy", "plain")
+
+        # Missing or non-string credentials are input errors, a damaged hash matches nothing
+        for login, password in (("referee", None), (None, "secret"), ("referee", 7), (["referee"], "secret")):
+            with pytest.raises(InvalidInputError):
+                database.user_exists(login, password)
+            with pytest.raises(InvalidInputError):
+                database.add_user(login, password)
+        with pytest.raises(InvalidInputError):
+            database.edit_user(1, {"user_password": None})
+        for damaged in ("scrypt$x$8$1$$", "scrypt$-1$8$1$AAAA$AAAA", "scrypt$14$0$1$AAAA$AAAA"):
+            with SqliteContext(database.pool) as [conn, cur]:
+                cur.execute("UPDATE Users SET user_password = ? WHERE user_login = 'legacy'", (damaged,))
+                conn.commit()
+            assert not database.user_exists("legacy", "plain")
+
+    def test_generator_is_deterministic_and_legal(self, database, tmp_path):
+        options = {"seed": 7, "seasons": 2, "teams": 4, "matches_per_season": 6, "events_per_match": 12}
+        assert list(generate(**options)) == list(generate(**options))
+        assert list(generate(**options)) != list(generate(**{**options, "seed": 8}))
+
+        sizes = write_database(database, **options)
+        assert sizes["Matches"] == len(database.get_matches()) == 12
+        for match in database.get_matches():
+            active = [player for player in database.get_match_roster(match["match_id"]) if player["player_active"]]
+            assert len(active) == 12
+            genders = [player["player_gender"] for player in active]
+            assert all(genders.count(gender) <= 4 for gender in genders)
+
+        # The CSV export loads through import_all into the same tables
+        assert write_csv(str(tmp_path), **options) == sizes
+        results = {stats["table"]: stats["rows"] for stats in database.import_all(str(tmp_path))}
+        assert results == sizes
+        assert len(database.get_events()) == sizes["Events"]
+
+    def test_query_metrics_and_slow_query_log(self, database, caplog):
+        database.insert_from_csv("Seasons", "test_input/seasons.csv", ";")
+        database.queries.reset()
+        seasons = database.get_seasons()
+        metrics = database.queries.metrics()[("get_seasons",)]
+        assert metrics["count"] == 1 and metrics["rows"] == len(seasons) and metrics["seconds"] > 0
+        assert 'sportsmeter_query_rows_total{statement="get_seasons"}' in "\n".join(database.queries.render())
+
+        database.cache.clear()
+        database.queries.slow_query_seconds = 0
+        with caplog.at_level("WARNING", logger="sportsmeter.slow_queries"):
+            database.get_seasons()
+        assert any("FROM Seasons" in record.getMessage() for record in caplog.records)
+
+    def test_hot_path_queries_use_indexes(self, database):
+        write_database(database, seasons=1, teams=4, matches_per_season=20, events_per_match=10)
+        with SqliteContext(database.pool) as [conn, cur]:
+            reports = audit(cur)
+            assert set(STATEMENTS) <= {report["shape"] for report in reports}
+            assert regressions(reports) == []
+
+        # Losing an index turns its lookups into scans and the audit reports them. A new connection,
+        # since the pooled ones keep the plans of their cached EXPLAIN statements.
+        conn = sqlite3.connect(database.dbpath)
+        try:
+            conn.execute("DROP INDEX idx_events_match")
+            failed = {report["shape"] for report in regressions(audit(conn.cursor()))}
+        finally:
+            conn.close()
+        assert "get_match_events" in failed and "get_events[match,limit]" in failed
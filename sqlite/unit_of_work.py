@@ -0,0 +1,35 @@
+import sqlite3
+
+from backend.exceptions import NoResultError
+from sqlite.roster import GENDERS, MatchRoster
+from sqlite.statements import STATEMENTS
+
+class UnitOfWork:
+    # Reads and writes of one driver operation on a single cursor. Inside a write job they all
+    # share its connection and BEGIN IMMEDIATE transaction, so validations see exactly the state
+    # the writes are applied to.
+    def __init__(self, cur : sqlite3.Cursor) -> None:
+        self.cur = cur
+
+    def execute(self, query : str, params : tuple = ()):
+        return self.cur.execute(query, params)
+
+    def players(self, *player_ids : int):
+        # player_id -> (player_gender, player_team), one query for up to two players
+        self.cur.execute(STATEMENTS["get_player_pair"], (player_ids[0], player_ids[-1]))
+        players = {row[0]: (row[1], row[2]) for row in self.cur.fetchall()}
+        for player_id in player_ids:
+            if player_id not in players:
+                raise NoResultError(f"Player {player_id} does not exist.")
+        return players
+
+    def active_genders(self, match_id):
+        gender_counts = dict.fromkeys(GENDERS, 0)
+        for row in self.cur.execute(STATEMENTS["get_active_genders"], (match_id,)).fetchall():
+            gender_counts[row[0]] = gender_counts.get(row[0], 0) + 1
+        return gender_counts
+
+    def load_roster(self, match_id, max_gender_players : int):
+        squad_rows = self.cur.execute(STATEMENTS["get_match_squads"], (match_id,)).fetchall()
+        entry_rows = self.cur.execute(STATEMENTS["get_roster_entries"], (match_id,)).fetchall()
+        return MatchRoster(match_id, max_gender_players, squad_rows, entry_rows)
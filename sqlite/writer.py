@@ -0,0 +1,136 @@
+from concurrent.futures import Future
+from queue import Empty, Queue
+import sqlite3
+import threading
+
+from sqlite.connection_pool import ConnectionPool
+
+class WriteQueue:
+    def __init__(self, pool : ConnectionPool, threaded : bool = True, max_batch : int = 64) -> None:
+        self.pool = pool
+        self.threaded = threaded
+        self.max_batch = max_batch
+        self._queue = Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._metrics = {"jobs": 0, "failed_jobs": 0, "batches": 0, "failed_batches": 0, "max_batch": 0}
+        if threaded:
+            self._connection = pool.open_connection(isolation_level=None)
+            self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+            self._thread.start()
+
+    def run(self, func):
+        # Runs func(cursor) atomically and returns its result once the change is committed.
+        # Writes issued from inside a job join the job that is already running.
+        if not self.threaded:
+            return self._run_inline(func)
+        if threading.current_thread() is self._thread:
+            return func(self._cursor)
+        return self.submit(func).result()
+
+    def submit(self, func):
+        future = Future()
+        self._queue.put((func, future))
+        return future
+
+    def execute(self, query : str, params : tuple = ()):
+        return self.run(lambda cur: cur.execute(query, params).lastrowid)
+
+    def executemany(self, query : str, rows):
+        return self.run(lambda cur: cur.executemany(query, rows).rowcount)
+
+    def _run_inline(self, func):
+        conn = self.pool.acquire()
+        cur = conn.cursor()
+        nested = conn.in_transaction
+        try:
+            cur.execute("SAVEPOINT write_job" if nested else "BEGIN IMMEDIATE")
+            try:
+                result = func(cur)
+            except BaseException:
+                if nested:
+                    cur.execute("ROLLBACK TO write_job")
+                    cur.execute("RELEASE write_job")
+                else:
+                    conn.rollback()
+                raise
+            if nested:
+                cur.execute("RELEASE write_job")
+            else:
+                conn.commit()
+            return result
+        finally:
+            cur.close()
+            self.pool.release(conn)
+
+    def _run(self):
+        self._cursor = self._connection.cursor()
+        # Reads issued while a job runs go through the write connection and see the batch so far
+        self.pool.bind_thread(self._connection)
+        running = True
+        while running:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except Empty:
+                    break
+                if job is None:
+                    running = False
+                    break
+                batch.append(job)
+            self._commit_batch(batch)
+        self._cursor.close()
+        self._connection.close()
+
+    def _commit_batch(self, batch : list):
+        cur = self._cursor
+        results = []
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            for func, future in batch:
+                cur.execute("SAVEPOINT write_job")
+                try:
+                    results.append((future, func(cur), None))
+                    cur.execute("RELEASE write_job")
+                except Exception as error:
+                    cur.execute("ROLLBACK TO write_job")
+                    cur.execute("RELEASE write_job")
+                    results.append((future, None, error))
+            cur.execute("COMMIT")
+        except sqlite3.Error as error:
+            if self._connection.in_transaction:
+                cur.execute("ROLLBACK")
+            self._record(batch, len(batch), failed_batch=True)
+            for _, future in batch:
+                future.set_exception(error)
+            return
+
+        self._record(batch, sum(1 for result in results if result[2] is not None))
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _record(self, batch : list, failed : int, failed_batch : bool = False):
+        with self._lock:
+            self._metrics["jobs"] += len(batch)
+            self._metrics["failed_jobs"] += failed
+            self._metrics["batches"] += 1
+            self._metrics["failed_batches"] += 1 if failed_batch else 0
+            self._metrics["max_batch"] = max(self._metrics["max_batch"], len(batch))
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["queued"] = self._queue.qsize()
+        return metrics
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
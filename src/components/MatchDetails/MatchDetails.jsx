@@ -41,6 +41,12 @@ export default function MatchDetails() {
             }
         }
         fetchMatchDetails();
+
+        // Live score updates are pushed by the server instead of being polled
+        const stream = new EventSource(`/api/matches/${match_id}/stream`);
+        stream.addEventListener("match", (message) => setMatchDetails(JSON.parse(message.data)));
+        stream.addEventListener("reset", () => fetchMatchDetails());
+        return () => stream.close();
     }, []);
 
     const Demo = styled('div')(({ theme }) => ({
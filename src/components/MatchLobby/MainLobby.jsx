@@ -92,6 +92,19 @@ export default function MainLobby() {
     }
 
 
+    /* Match and roster from one consistent snapshot in a single request */
+    const fetchMatchSnapshot = async () => {
+        try {
+            const result = await axios.get(`/api/matches/${match_id}/snapshot`);
+            setMatchDetails(result?.data?.match);
+            setMatchPlayers(result?.data?.roster);
+        }
+        catch (error) {
+            console.log(error);
+            navigate("/");
+        }
+    }
+
     const initMatchDetails = () => {
         setTeam_a_score(matchDetails.team_a_points);
         setTeam_b_score(matchDetails.team_b_points);
@@ -136,17 +149,6 @@ export default function MainLobby() {
         }
     }*/
 
-    const fetchPlayer = async (player_id) => {
-        try {
-            const result = await axios.get(`/api/players/${player_id}`);
-            return (result?.data);
-        }
-        catch (error) {
-            console.log(error);
-        }
-
-    }
-
     /*const fetchTeams =  async () => {
         try {
             const result = await axios('/api/teams');
@@ -162,20 +164,13 @@ export default function MainLobby() {
         return { active, number, name, gender, shotsSuc, shots, passesSuc, passes, tacklesSuc, tackles, defensesSuc, defenses, turnoversSuc, turnovers, beatsSuc, beats, catchesSuc, catches };
     }
 
-    async function createTeam(teamArray) {
-        teamOutput = [];
-        for (let i = 0; i < teamArray.length; i++) {
-            await fetchPlayer(teamArray[i].match_player).then((player) => {
-                if (player) {
-                    teamOutput[i] = createData(teamArray[i].player_active, player.player_id, player.player_name, player.player_gender, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0);
-                    console.log(teamOutput[i]);
-                }
-            })
-        }
-        return teamOutput;
+    /* The roster endpoint already carries the player details, no request per player */
+    function createTeam(teamArray) {
+        return teamArray.map((player) =>
+            createData(player.player_active, player.match_player, player.player_name, player.player_gender, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0));
     }
-    const getTeams = async () => {
-        setMatchPlayersStats(await createTeam(MatchPlayers));
+    const getTeams = () => {
+        setMatchPlayersStats(createTeam(MatchPlayers));
     }
 
     function SnitchCatch(team_snitch) {
@@ -414,8 +409,7 @@ export default function MainLobby() {
 
     useEffect(() => {
         SnitchCatch();
-        fetchMatchDetails();
-        fetchMatchPlayers();
+        fetchMatchSnapshot();
         initMatchDetails();
         getTeams();
     }, []);